@@ -1,11 +1,10 @@
 import streamlit as st
-import networkx as nx
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-import random
-import time
-from collections import defaultdict
-import heapq
+import os
+import json
+import urllib.error
+import urllib.request
+
+from routing_core import EmergencyHospitalLocator
 
 # Set page configuration
 st.set_page_config(
@@ -123,250 +122,52 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-class EmergencyHospitalLocator:
-    def __init__(self):
-        self.graph = nx.Graph()
-        self.person_location = None
-        self.hospitals = []
-        self.all_locations = []
-        self.shortest_paths = {}
-        self.distances = {}
-        
-    def generate_city_graph(self, num_hospitals, complexity):
-        """Generate a realistic city-like graph with roads and locations"""
-        self.graph.clear()
-        self.hospitals = []
-        self.all_locations = []
-        
-        # Define complexity parameters
-        complexity_params = {
-            'simple': {'nodes': 8, 'connections': 12},
-            'medium': {'nodes': 12, 'connections': 18},
-            'complex': {'nodes': 16, 'connections': 25}
-        }
-        
-        total_nodes = complexity_params[complexity]['nodes']
-        total_connections = complexity_params[complexity]['connections']
-        
-        # Generate location names
-        location_names = [
-            'Central Square', 'Park Avenue', 'Main Street', 'Downtown',
-            'Riverside', 'Hillview', 'Market Place', 'University Area',
-            'Industrial Zone', 'Residential Area', 'Shopping Mall', 'Airport Road',
-            'Business District', 'Old Town', 'New City', 'Suburb'
-        ]
-        
-        hospital_names = [
-            'City General Hospital', 'Emergency Medical Center', 'St. Mary Hospital',
-            'Regional Medical Center', 'Community Hospital', 'Trauma Center'
-        ]
-        
-        # Create nodes
-        for i in range(total_nodes):
-            location_name = location_names[i % len(location_names)]
-            self.graph.add_node(i, name=location_name, type='location')
-            self.all_locations.append((i, location_name))
-        
-        # Designate hospitals
-        hospital_indices = random.sample(range(1, total_nodes), num_hospitals)
-        for i, hospital_idx in enumerate(hospital_indices):
-            hospital_name = hospital_names[i % len(hospital_names)]
-            self.graph.nodes[hospital_idx]['name'] = hospital_name
-            self.graph.nodes[hospital_idx]['type'] = 'hospital'
-            self.hospitals.append((hospital_idx, hospital_name))
-        
-        # Set person location (always at node 0)
-        self.person_location = (0, 'Your Location')
-        self.graph.nodes[0]['name'] = 'Your Location'
-        self.graph.nodes[0]['type'] = 'person'
-        
-        # Create realistic road connections with distances
-        edges_added = 0
-        attempts = 0
-        max_attempts = total_connections * 3
-        
-        while edges_added < total_connections and attempts < max_attempts:
-            node1 = random.randint(0, total_nodes - 1)
-            node2 = random.randint(0, total_nodes - 1)
-            
-            if node1 != node2 and not self.graph.has_edge(node1, node2):
-                # Generate realistic distance (1-15 km)
-                distance = round(random.uniform(1.0, 15.0), 1)
-                self.graph.add_edge(node1, node2, weight=distance)
-                edges_added += 1
-            
-            attempts += 1
-        
-        # Ensure all nodes are connected (especially hospitals)
-        if not nx.is_connected(self.graph):
-            components = list(nx.connected_components(self.graph))
-            for i in range(len(components) - 1):
-                node1 = random.choice(list(components[i]))
-                node2 = random.choice(list(components[i + 1]))
-                distance = round(random.uniform(2.0, 8.0), 1)
-                self.graph.add_edge(node1, node2, weight=distance)
-    
-    def dijkstra_algorithm(self, start_node):
-        """
-        Implement Dijkstra's Algorithm to find shortest paths
-        Returns: distances dictionary and previous nodes dictionary
-        """
-        # Initialize distances and previous nodes
-        distances = {node: float('infinity') for node in self.graph.nodes()}
-        previous = {node: None for node in self.graph.nodes()}
-        distances[start_node] = 0
-        
-        # Priority queue: (distance, node)
-        pq = [(0, start_node)]
-        visited = set()
-        
-        while pq:
-            current_distance, current_node = heapq.heappop(pq)
-            
-            if current_node in visited:
-                continue
-                
-            visited.add(current_node)
-            
-            # Check all neighbors
-            for neighbor in self.graph.neighbors(current_node):
-                if neighbor not in visited:
-                    edge_weight = self.graph[current_node][neighbor]['weight']
-                    new_distance = current_distance + edge_weight
-                    
-                    if new_distance < distances[neighbor]:
-                        distances[neighbor] = new_distance
-                        previous[neighbor] = current_node
-                        heapq.heappush(pq, (new_distance, neighbor))
-        
-        return distances, previous
-    
-    def get_shortest_path(self, previous, start, end):
-        """Reconstruct shortest path from previous nodes dictionary"""
-        path = []
-        current = end
-        
-        while current is not None:
-            path.append(current)
-            current = previous[current]
-        
-        path.reverse()
-        return path if path[0] == start else []
-    
-    def find_nearest_hospital(self):
-        """Find the nearest hospital using Dijkstra's algorithm"""
-        person_node = self.person_location[0]
-        
-        # Run Dijkstra's algorithm
-        distances, previous = self.dijkstra_algorithm(person_node)
-        
-        # Find nearest hospital
-        nearest_hospital = None
-        min_distance = float('infinity')
-        
-        for hospital_node, hospital_name in self.hospitals:
-            if distances[hospital_node] < min_distance:
-                min_distance = distances[hospital_node]
-                nearest_hospital = (hospital_node, hospital_name)
-        
-        # Get shortest path to nearest hospital
-        if nearest_hospital:
-            shortest_path = self.get_shortest_path(previous, person_node, nearest_hospital[0])
-            
-            # Store results
-            self.distances = distances
-            self.shortest_paths = previous
-            
-            return {
-                'nearest_hospital': nearest_hospital,
-                'distance': min_distance,
-                'path': shortest_path,
-                'all_hospital_distances': {name: distances[node] for node, name in self.hospitals}
-            }
-        
-        return None
+
+def request_route_from_service(url, origin, method='dijkstra'):
+    """
+    Ask a running routing_service.py instance for the nearest hospital;
+    returns the find_nearest_hospital result fields (None if unreachable)
+    """
+    request = urllib.request.Request(
+        url.rstrip('/') + '/route',
+        data=json.dumps({'origin': origin, 'method': method}).encode('utf-8'),
+        headers={'Content-Type': 'application/json'}, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            result = json.load(response)
+    except urllib.error.HTTPError as e:
+        if e.code == 404:
+            return None
+        raise
     
-    def visualize_graph(self, highlight_path=None):
-        """Create an attractive dark-themed visualization of the graph"""
-        plt.figure(figsize=(14, 10))
-        plt.style.use('dark_background')  # Use dark matplotlib theme
-        
-        # Create layout
-        pos = nx.spring_layout(self.graph, k=3, iterations=50, seed=42)
-        
-        # Draw all edges (roads) in light gray
-        nx.draw_networkx_edges(self.graph, pos, edge_color='#CCCCCC', 
-                              width=2, alpha=0.7)
-        
-        # Draw edge labels (distances)
-        edge_labels = nx.get_edge_attributes(self.graph, 'weight')
-        edge_labels = {k: f"{v} km" for k, v in edge_labels.items()}
-        nx.draw_networkx_edge_labels(self.graph, pos, edge_labels, 
-                                    font_size=8, font_color='#FFFFFF')
-        
-        # Draw nodes with different colors based on type
-        node_colors = []
-        node_sizes = []
-        
-        for node in self.graph.nodes():
-            node_type = self.graph.nodes[node].get('type', 'location')
-            if node_type == 'person':
-                node_colors.append('#4ECDC4')  # Teal for person
-                node_sizes.append(800)
-            elif node_type == 'hospital':
-                node_colors.append('#FF6B6B')  # Coral red for hospitals
-                node_sizes.append(600)
-            else:
-                node_colors.append('#95A5A6')  # Light gray for other locations
-                node_sizes.append(400)
-        
-        nx.draw_networkx_nodes(self.graph, pos, node_color=node_colors, 
-                              node_size=node_sizes, alpha=0.9, edgecolors='white', linewidths=2)
-        
-        # Draw node labels
-        labels = {node: self.graph.nodes[node]['name'][:15] + '...' 
-                 if len(self.graph.nodes[node]['name']) > 15 
-                 else self.graph.nodes[node]['name'] 
-                 for node in self.graph.nodes()}
-        
-        nx.draw_networkx_labels(self.graph, pos, labels, font_size=8, 
-                               font_weight='bold', font_color='white')
-        
-        # Highlight shortest path if provided
-        if highlight_path and len(highlight_path) > 1:
-            path_edges = [(highlight_path[i], highlight_path[i+1]) 
-                         for i in range(len(highlight_path)-1)]
-            nx.draw_networkx_edges(self.graph, pos, edgelist=path_edges, 
-                                  edge_color='#FFE66D', width=5, alpha=1.0)
-        
-        # Add legend with dark theme colors
-        legend_elements = [
-            patches.Patch(color='#4ECDC4', label='👤 Your Location'),
-            patches.Patch(color='#FF6B6B', label='🏥 Hospitals'),
-            patches.Patch(color='#95A5A6', label='📍 Other Locations'),
-            patches.Patch(color='#FFE66D', label='🛣️ Shortest Path')
-        ]
-        plt.legend(handles=legend_elements, loc='upper right', bbox_to_anchor=(1.15, 1),
-                  facecolor='#2E2E2E', edgecolor='white', labelcolor='white')
-        
-        plt.title("🗺️ Emergency Hospital Locator Map", fontsize=16, fontweight='bold', color='white')
-        plt.axis('off')
-        
-        # Set dark background
-        plt.gca().set_facecolor('#2E2E2E')
-        plt.gcf().patch.set_facecolor('#2E2E2E')
-        
-        plt.tight_layout()
-        
-        return plt
+    result['nearest_hospital'] = tuple(result['nearest_hospital'])
+    result['all_hospital_distances'] = {
+        name: float('infinity') if distance is None else distance
+        for name, distance in result['all_hospital_distances'].items()
+    }
+    return result
+
 
 def main():
     # Initialize session state
     if 'locator' not in st.session_state:
-        st.session_state.locator = EmergencyHospitalLocator()
+        st.session_state.locator = EmergencyHospitalLocator(instrument=True)
         st.session_state.map_generated = False
         st.session_state.route_calculated = False
         st.session_state.result = None
+        st.session_state.shared_map = False
+        
+        # Start from a prepared road network if one is configured
+        graph_file = os.environ.get('HOSPITAL_GRAPH_FILE')
+        if graph_file:
+            st.session_state.locator.load_graph_binary(graph_file, build_networkx=True)
+            st.session_state.map_generated = True
+            st.session_state.shared_map = True
+            
+            # Load (or build once and save) its contraction hierarchy
+            ch_file = os.environ.get('HOSPITAL_CH_FILE')
+            if ch_file:
+                st.session_state.locator.prepare_contraction_hierarchy(ch_file)
     
     # Main header
     st.markdown('<h1 class="main-header">🚑 Smart Emergency Hospital Locator using Dijkstra Algorithm</h1>', 
@@ -389,22 +190,39 @@ def main():
                                      ['simple', 'medium', 'complex'], 
                                      index=1)
     
+    # Search method
+    st.sidebar.subheader("🧭 Search Method")
+    search_methods = {'Dijkstra': 'dijkstra', 'Contraction hierarchy': 'ch'}
+    search_method = search_methods[st.sidebar.selectbox("Method", list(search_methods))]
+    
+    # Map view
+    st.sidebar.subheader("🔍 Map View")
+    map_view = st.sidebar.selectbox("View", ['Full map', 'Route neighbourhood'])
+    view_hops = st.sidebar.slider("Neighbourhood size (hops)", 0, 5, 2,
+                                  disabled=map_view == 'Full map')
+    
     # Control buttons
     st.sidebar.subheader("🎮 Controls")
     
     if st.sidebar.button("🔄 Generate New Map", type="primary"):
         st.session_state.locator.generate_city_graph(num_hospitals, complexity)
         st.session_state.map_generated = True
+        st.session_state.shared_map = False
         st.session_state.route_calculated = False
         st.session_state.result = None
         st.rerun()
     
     if st.sidebar.button("🚑 Start Emergency Routing", type="secondary", 
                         disabled=not st.session_state.map_generated):
-        with st.spinner("🔍 Calculating shortest path using Dijkstra Algorithm..."):
-            time.sleep(2)  # Simulation delay
-            st.session_state.result = st.session_state.locator.find_nearest_hospital()
-            st.session_state.route_calculated = True
+        # The routing service only knows the shared map, not generated ones
+        service_url = os.environ.get('ROUTING_SERVICE_URL')
+        if service_url and st.session_state.shared_map:
+            st.session_state.result = request_route_from_service(
+                service_url, st.session_state.locator.person_location[0], search_method)
+        else:
+            st.session_state.result = st.session_state.locator.find_nearest_hospital(
+                method=search_method)
+        st.session_state.route_calculated = True
         st.rerun()
     
     if st.sidebar.button("🔄 Reset", type="secondary"):
@@ -425,9 +243,11 @@ def main():
             if st.session_state.route_calculated and st.session_state.result:
                 highlight_path = st.session_state.result['path']
             
-            fig = st.session_state.locator.visualize_graph(highlight_path)
+            if map_view == 'Route neighbourhood':
+                fig = st.session_state.locator.visualize_viewport(highlight_path, hops=view_hops)
+            else:
+                fig = st.session_state.locator.visualize_graph(highlight_path)
             st.pyplot(fig)
-            plt.close()
         else:
             st.info("👆 Click 'Generate New Map' to create a new city map with hospitals!")
     
@@ -443,6 +263,7 @@ def main():
                 <h3>🚑 Emergency Route Found!</h3>
                 <p><strong>🏥 Nearest Hospital:</strong> {result['nearest_hospital'][1]}</p>
                 <p><strong>📏 Total Distance:</strong> {result['distance']:.1f} km</p>
+                <p><strong>🔎 Nodes Explored:</strong> {result['visited_nodes']} of {st.session_state.locator.graph.number_of_nodes()}</p>
                 <p><strong>🛣️ Route:</strong></p>
                 <ul>
             """, unsafe_allow_html=True)
@@ -528,6 +349,27 @@ def main():
                 """)
             else:
                 st.info("Run the algorithm to see step-by-step explanation!")
+        
+        with st.expander("⏱️ Query Profile"):
+            metrics = st.session_state.locator.metrics
+            last = metrics.last if metrics is not None else None
+            if st.session_state.route_calculated and last is not None:
+                st.markdown(f"**{last['query']}** from node {last['origin']}: "
+                            f"{last['seconds'] * 1000:.2f} ms"
+                            + (" (route cache hit)" if last['cache_hit'] else ""))
+                if 'settled' in last:
+                    st.table({
+                        'Operation': ['Nodes settled', 'Heap pushes', 'Heap pops', 'Stale skips',
+                                      'Relaxations', 'Edges scanned'],
+                        'Count': [last['settled'], last['heap_pushes'], last['heap_pops'],
+                                  last['stale_skips'], last['relaxations'], last['edges_scanned']]
+                    })
+                st.table({
+                    'Phase': list(last['phases']),
+                    'Time (ms)': [f"{t * 1000:.3f}" for t in last['phases'].values()]
+                })
+            else:
+                st.info("Run the algorithm to see its measured cost!")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,58 @@
+"""
+Benchmark: batch nearest-hospital routing throughput from 1 to N workers
+
+Usage: python benchmarks/bench_batch_routing.py [--nodes 100000] [--origins 200] [--workers 1 2 4]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from routing_core import EmergencyHospitalLocator  # noqa: E402
+from bench_csr_dijkstra import build_grid_city  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=100_000)
+    parser.add_argument('--hospitals', type=int, default=20)
+    parser.add_argument('--origins', type=int, default=200)
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    locator = EmergencyHospitalLocator()
+    locator.graph = build_grid_city(args.nodes, args.seed)
+    nodes = list(locator.graph.nodes())
+    locator.hospitals = [(node, f"Hospital {node}") for node in rng.sample(nodes, args.hospitals)]
+    origins = [rng.choice(nodes) for _ in range(args.origins)]
+    locator.get_csr()
+
+    # Reference: the single-query path in a loop
+    start = time.perf_counter()
+    expected = [locator.find_nearest_hospital(origin=origin) for origin in origins]
+    loop_time = time.perf_counter() - start
+    print(f"single-query loop: {args.origins / loop_time:8.1f} queries/s")
+
+    print(f"{'workers':>8} {'time (s)':>10} {'queries/s':>10} {'scaling':>8}")
+    base = None
+    for workers in args.workers:
+        start = time.perf_counter()
+        batch = locator.find_nearest_hospitals_batch(origins, workers=workers)
+        elapsed = time.perf_counter() - start
+
+        if batch['results'] != expected:
+            raise SystemExit(f"batch results with {workers} workers differ from the single-query loop")
+
+        base = base or elapsed
+        print(f"{workers:>8} {elapsed:>10.3f} {args.origins / elapsed:>10.1f} {base / elapsed:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
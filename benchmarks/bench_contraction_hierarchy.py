@@ -0,0 +1,66 @@
+"""
+Benchmark: contraction hierarchy build and queries vs bidirectional Dijkstra
+
+Usage: python benchmarks/bench_contraction_hierarchy.py [--sizes 1000 4000 16000] [--queries 200]
+
+Every CH distance is checked against the bidirectional search. The nodes a
+CH query settles should grow far more slowly with the graph than the
+bidirectional search's, so the speedup widens as the graph grows.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from routing_core import ContractionHierarchy, EmergencyHospitalLocator  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 4_000, 16_000])
+    parser.add_argument('--layout', default='planar', choices=['grid', 'planar'])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'nodes':>9} {'build (s)':>10} {'shortcuts/node':>15} {'ch settled':>11} {'bidir settled':>14} "
+          f"{'ch (ms)':>8} {'bidir (ms)':>11} {'speedup':>8}")
+    for size in args.sizes:
+        locator = EmergencyHospitalLocator()
+        locator.generate_synthetic_city(size, seed=args.seed, layout=args.layout)
+        csr = locator.get_csr()
+
+        start = time.perf_counter()
+        ch = ContractionHierarchy.build(csr)
+        build_time = time.perf_counter() - start
+        shortcuts = sum(1 for middle in ch.up_middle if middle >= 0)
+
+        rng = random.Random(args.seed)
+        pairs = [(rng.randrange(csr.num_nodes), rng.randrange(csr.num_nodes)) for _ in range(args.queries)]
+        ch_time = bidir_time = 0.0
+        ch_settled, bidir_settled = [], []
+        for source, target in pairs:
+            start = time.perf_counter()
+            distance, _, settled = ch.query(source, target)
+            ch_time += time.perf_counter() - start
+            ch_settled.append(settled)
+
+            start = time.perf_counter()
+            expected, _, settled = csr.bidirectional_dijkstra(source, target)
+            bidir_time += time.perf_counter() - start
+            bidir_settled.append(settled)
+            if abs(distance - expected) > 1e-9:
+                raise AssertionError(f"CH distance {distance} != {expected} for {source}->{target}")
+
+        print(f"{csr.num_nodes:>9} {build_time:>10.2f} {shortcuts / csr.num_nodes:>15.2f} "
+              f"{statistics.median(ch_settled):>11.0f} {statistics.median(bidir_settled):>14.0f} "
+              f"{ch_time / len(pairs) * 1000:>8.3f} {bidir_time / len(pairs) * 1000:>11.3f} "
+              f"{bidir_time / ch_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
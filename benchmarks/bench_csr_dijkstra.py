@@ -0,0 +1,104 @@
+"""
+Benchmark: dict-based Dijkstra vs the CSR snapshot engine
+
+Usage: python benchmarks/bench_csr_dijkstra.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import heapq
+import os
+import random
+import sys
+import time
+
+import networkx as nx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from routing_core import EmergencyHospitalLocator  # noqa: E402
+
+
+def legacy_dijkstra(graph, start_node):
+    """The original dict-based implementation, kept as the reference"""
+    distances = {node: float('infinity') for node in graph.nodes()}
+    previous = {node: None for node in graph.nodes()}
+    distances[start_node] = 0
+
+    pq = [(0, start_node)]
+    visited = set()
+
+    while pq:
+        current_distance, current_node = heapq.heappop(pq)
+
+        if current_node in visited:
+            continue
+
+        visited.add(current_node)
+
+        for neighbor in graph.neighbors(current_node):
+            if neighbor not in visited:
+                edge_weight = graph[current_node][neighbor]['weight']
+                new_distance = current_distance + edge_weight
+
+                if new_distance < distances[neighbor]:
+                    distances[neighbor] = new_distance
+                    previous[neighbor] = current_node
+                    heapq.heappush(pq, (new_distance, neighbor))
+
+    return distances, previous
+
+
+def build_grid_city(num_nodes, seed):
+    """Square grid road network with random 1-15 km road lengths"""
+    rng = random.Random(seed)
+    side = max(2, int(num_nodes ** 0.5))
+    graph = nx.Graph()
+    graph.add_nodes_from(range(side * side))
+    for r in range(side):
+        for c in range(side):
+            node = r * side + c
+            if c + 1 < side:
+                graph.add_edge(node, node + 1, weight=round(rng.uniform(1.0, 15.0), 1))
+            if r + 1 < side:
+                graph.add_edge(node, node + side, weight=round(rng.uniform(1.0, 15.0), 1))
+    return graph
+
+
+def best_of(fn, repeat):
+    best = float('infinity')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'nodes':>10} {'legacy (s)':>12} {'compile (s)':>12} {'csr (s)':>10} {'speedup':>8}")
+    for size in args.sizes:
+        locator = EmergencyHospitalLocator()
+        locator.graph = build_grid_city(size, args.seed)
+
+        legacy_time, legacy_result = best_of(lambda: legacy_dijkstra(locator.graph, 0), args.repeat)
+
+        start = time.perf_counter()
+        locator.get_csr()
+        compile_time = time.perf_counter() - start
+
+        csr_time, csr_result = best_of(lambda: locator.dijkstra_algorithm(0), args.repeat)
+
+        if csr_result != legacy_result:
+            raise SystemExit(f"CSR result differs from the dict-based result at {size} nodes")
+
+        print(f"{locator.graph.number_of_nodes():>10} {legacy_time:>12.3f} {compile_time:>12.3f} "
+              f"{csr_time:>10.3f} {legacy_time / csr_time:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
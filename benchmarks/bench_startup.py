@@ -0,0 +1,79 @@
+"""
+Benchmark: cold-start time and memory of routing_core vs the Streamlit app module
+
+Usage: python benchmarks/bench_startup.py [--nodes 100000] [--repeat 5]
+
+Every scenario runs in a fresh interpreter; wall time includes interpreter
+start-up, memory is the child's peak resident set size.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Child epilogue: report peak RSS and which heavy libraries got imported.
+# VmHWM resets on exec, unlike ru_maxrss which keeps the forking parent's peak
+REPORT = (
+    "import json, resource, sys\n"
+    "try:\n"
+    "    peak = int(next(l for l in open('/proc/self/status') if l.startswith('VmHWM')).split()[1])\n"
+    "except OSError:\n"
+    "    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+    "print(json.dumps({'max_rss_kb': peak,\n"
+    "                  'loaded': [m for m in ('streamlit', 'matplotlib', 'networkx') if m in sys.modules]}))\n"
+)
+
+WORKER = (
+    "locator = EmergencyHospitalLocator()\n"
+    "locator.load_graph_binary({path!r})\n"
+    "locator.find_nearest_hospital()\n"
+)
+
+SCENARIOS = {
+    'import routing_core': "import routing_core\n",
+    'import app': "import app\n",
+    'worker via routing_core': "from routing_core import EmergencyHospitalLocator\n" + WORKER,
+    'worker via app': "from app import EmergencyHospitalLocator\n" + WORKER,
+}
+
+
+def run_child(code):
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-c', code + REPORT], cwd=ROOT, check=True,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    elapsed = time.perf_counter() - start
+    return elapsed, json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=100_000, help="graph size for the worker scenarios")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    from routing_core import EmergencyHospitalLocator
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'city.bin')
+        locator = EmergencyHospitalLocator()
+        locator.generate_synthetic_city(args.nodes, seed=1)
+        locator.save_graph_binary(path)
+
+        print(f"{'scenario':>24} {'median (s)':>11} {'min (s)':>9} {'peak RSS MB':>12}  loaded")
+        for name, code in SCENARIOS.items():
+            runs = [run_child(code.format(path=path)) for _ in range(args.repeat)]
+            times = [elapsed for elapsed, _ in runs]
+            report = runs[-1][1]
+            print(f"{name:>24} {statistics.median(times):>11.3f} {min(times):>9.3f} "
+                  f"{report['max_rss_kb'] / 1024:>12.1f}  {', '.join(report['loaded']) or '-'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Benchmark: time-dependent Dijkstra and per-hour tables vs static dijkstra_algorithm
+
+Usage: python benchmarks/bench_time_dependent.py [--sizes 10000 100000] [--departures 0 480 1050]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from routing_core import ARTERIAL_ROAD_KM, EmergencyHospitalLocator  # noqa: E402
+from bench_csr_dijkstra import best_of, build_grid_city  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--departures', type=float, nargs='+', default=[0, 480, 1050],
+                        help="minutes after midnight")
+    parser.add_argument('--hospitals', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'nodes':>10} {'departure':>10} {'static (s)':>11} {'td (s)':>9} {'overhead':>9} "
+          f"{'table (s)':>10} {'lookup (us)':>12}")
+    for size in args.sizes:
+        rng = random.Random(args.seed)
+        locator = EmergencyHospitalLocator()
+        locator.graph = build_grid_city(size, args.seed)
+        for _, _, data in locator.graph.edges(data=True):
+            data['profile'] = 'arterial' if data['weight'] >= ARTERIAL_ROAD_KM else 'residential'
+        nodes = list(locator.graph.nodes())
+        locator.hospitals = [(node, f"Hospital {node}") for node in rng.sample(nodes, args.hospitals)]
+        origins = [rng.choice(nodes) for _ in range(1000)]
+        locator.get_csr()
+        locator.get_edge_profiles()
+
+        static_time, _ = best_of(lambda: locator.dijkstra_algorithm(0), args.repeat)
+        for departure in args.departures:
+            td_time, _ = best_of(lambda: locator.time_dependent_search(0, departure), args.repeat)
+
+            hour = int(departure // 60)
+            start = time.perf_counter()
+            locator.get_hourly_hospital_table(hour)
+            table_time = time.perf_counter() - start
+            start = time.perf_counter()
+            for origin in origins:
+                locator.lookup_nearest_hospital_at(hour, origin)
+            lookup_time = (time.perf_counter() - start) / len(origins)
+
+            print(f"{len(nodes):>10} {departure:>10.0f} {static_time:>11.3f} {td_time:>9.3f} "
+                  f"{td_time / static_time:>8.2f}x {table_time:>10.3f} {lookup_time * 1e6:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Load test: throughput and p50/p99 latency of the routing service
+
+Usage: python benchmarks/load_test_service.py [--url http://127.0.0.1:8765] [--concurrency 32] [--requests 2000]
+
+Without --url a local instance of routing_service.py is started for the run.
+Origins are drawn from --distinct node ids (0..n-1, as produced by
+generate_city_graph and identity-id binary graphs); a small hot set shows
+request coalescing at work.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def request(reader, writer, method, path, payload=None):
+    body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+                 f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode('latin-1')
+                 + body)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def wait_for_service(host, port, timeout=60.0):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+            continue
+        _, health = await request(reader, writer, 'GET', '/health')
+        writer.close()
+        return health
+
+
+async def client(host, port, origins, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    for origin in origins:
+        start = time.perf_counter()
+        status, _ = await request(reader, writer, 'POST', '/route', {'origin': origin})
+        latencies.append(time.perf_counter() - start)
+        if status != 200:
+            errors.append(status)
+    writer.close()
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+async def run(args, host, port):
+    health = await wait_for_service(host, port)
+    rng = random.Random(args.seed)
+    pool = rng.sample(range(health['nodes']), min(args.distinct, health['nodes']))
+    origins = [rng.choice(pool) for _ in range(args.requests)]
+    per_client = [origins[i::args.concurrency] for i in range(args.concurrency)]
+
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, chunk, latencies, errors) for chunk in per_client))
+    elapsed = time.perf_counter() - start
+
+    reader, writer = await asyncio.open_connection(host, port)
+    _, stats = await request(reader, writer, 'GET', '/stats')
+    writer.close()
+
+    latencies.sort()
+    print(f"{'requests':>10} {'conc':>6} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'coalesced':>10} {'errors':>7}")
+    print(f"{len(latencies):>10} {args.concurrency:>6} {len(latencies) / elapsed:>10.1f} "
+          f"{percentile(latencies, 0.50) * 1000:>9.2f} {percentile(latencies, 0.99) * 1000:>9.2f} "
+          f"{stats['coalesced']:>10} {len(errors):>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', help="running service; a local one is started when omitted")
+    parser.add_argument('--port', type=int, default=8765, help="port for the local instance")
+    parser.add_argument('--graph-file', help="binary graph for the local instance")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--distinct', type=int, default=16, help="distinct origins requested")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    process = None
+    if args.url:
+        parts = urlsplit(args.url)
+        host, port = parts.hostname, parts.port or 80
+    else:
+        host, port = '127.0.0.1', args.port
+        command = [sys.executable, os.path.join(ROOT, 'routing_service.py'), '--host', host, '--port', str(port)]
+        if args.graph_file:
+            command += ['--graph-file', args.graph_file]
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+
+    try:
+        asyncio.run(run(args, host, port))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""
+Benchmark suite: routing, generation and rendering, with regression checks
+
+Usage: python benchmarks/run_benchmarks.py [--sizes 1000 10000 100000] [--seeds 1 2 3]
+           [--output results.json] [--baseline baseline.json] [--threshold 0.2]
+
+Each case is timed best-of --repeat, then run once more under tracemalloc
+with counting heap wrappers to record peak memory and heap operations.
+With --baseline, cases slower (or using more memory / heap operations) by
+more than --threshold are reported and the exit status is 1.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+import warnings
+from contextlib import contextmanager
+
+os.environ.setdefault('MPLBACKEND', 'Agg')
+# Map labels use emoji that headless fonts often lack; rendering still works
+warnings.filterwarnings('ignore', message=r'Glyph .* missing from font')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import heapq  # noqa: E402
+
+from routing_core import EmergencyHospitalLocator  # noqa: E402
+
+# Metrics compared against the baseline; wall time is noisy, the rest are
+# deterministic for a given seed
+COMPARED_METRICS = ('wall_seconds', 'peak_memory_bytes', 'heap_pushes', 'heap_pops', 'nodes_settled')
+
+
+@contextmanager
+def count_heap_operations():
+    """Count heapq pushes and pops made by the routing code"""
+    counts = {'pushes': 0, 'pops': 0}
+    push, pop = heapq.heappush, heapq.heappop
+
+    def counting_push(heap, item):
+        counts['pushes'] += 1
+        push(heap, item)
+
+    def counting_pop(heap):
+        counts['pops'] += 1
+        return pop(heap)
+
+    heapq.heappush, heapq.heappop = counting_push, counting_pop
+    try:
+        yield counts
+    finally:
+        heapq.heappush, heapq.heappop = push, pop
+
+
+def measure(fn, setup, repeat):
+    """Best and median wall time of fn() over repeat runs, plus one instrumented run"""
+    times = []
+    result = None
+    for _ in range(repeat):
+        setup()
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+
+    setup()
+    tracemalloc.start()
+    with count_heap_operations() as counts:
+        fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'wall_seconds': min(times),
+        'wall_median_seconds': statistics.median(times),
+        'peak_memory_bytes': peak,
+        'heap_pushes': counts['pushes'],
+        'heap_pops': counts['pops']
+    }, result
+
+
+def routing_cases(size, seed, repeat, render_max):
+    """Time the locator's routing and rendering on a synthetic city"""
+    locator = EmergencyHospitalLocator()
+    locator.generate_synthetic_city(size, seed=seed, build_networkx=size <= render_max)
+    start_node = locator.person_location[0]
+    locator.get_csr()
+
+    def fresh_query():
+        locator.route_cache.clear()
+        locator._tree_root = None
+
+    cases = []
+
+    metrics, (distances, previous) = measure(lambda: locator.dijkstra_algorithm(start_node),
+                                             lambda: None, repeat)
+    metrics['nodes_settled'] = sum(1 for d in distances.values() if d != float('infinity'))
+    cases.append(('dijkstra_algorithm', metrics))
+
+    metrics, result = measure(locator.find_nearest_hospital, fresh_query, repeat)
+    metrics['nodes_settled'] = result['visited_nodes'] if result else 0
+    cases.append(('find_nearest_hospital', metrics))
+
+    farthest = max((node for node, d in distances.items() if d != float('infinity')),
+                   key=distances.get)
+    metrics, path = measure(lambda: locator.get_shortest_path(previous, start_node, farthest),
+                            lambda: None, repeat)
+    metrics['path_length'] = len(path)
+    cases.append(('get_shortest_path', metrics))
+
+    if size <= render_max:
+        highlight = result['path'] if result else None
+
+        def render():
+            locator.visualize_graph(highlight).savefig(io.BytesIO(), format='png')
+
+        def cold():
+            locator._base_map = None
+
+        metrics, _ = measure(render, cold, repeat)
+        cases.append(('visualize_graph', metrics))
+        metrics, _ = measure(render, lambda: None, repeat)
+        cases.append(('visualize_graph_cached', metrics))
+
+    return cases
+
+
+def generation_cases(size, seed, repeat):
+    locator = EmergencyHospitalLocator()
+    metrics, _ = measure(lambda: locator.generate_synthetic_city(size, seed=seed), lambda: None, repeat)
+    return [('generate_synthetic_city', metrics)]
+
+
+def city_graph_cases(seed, repeat):
+    """generate_city_graph is capped at 16 nodes; time each complexity"""
+    cases = []
+    for complexity, size in (('simple', 8), ('medium', 12), ('complex', 16)):
+        locator = EmergencyHospitalLocator()
+        metrics, _ = measure(lambda: locator.generate_city_graph(4, complexity),
+                             lambda: random.seed(seed), repeat)
+        cases.append((size, 'generate_city_graph', metrics))
+    return cases
+
+
+def compare(results, baseline, threshold, min_seconds):
+    """
+    Regressions as (case key, metric, baseline value, new value); wall time
+    must also grow by min_seconds so microsecond cases do not flag noise
+    """
+    previous = {(r['case'], r['size'], r['seed']): r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        old = previous.get((r['case'], r['size'], r['seed']))
+        if old is None:
+            continue
+        for metric in COMPARED_METRICS:
+            if metric not in r or metric not in old or not old[metric]:
+                continue
+            if metric == 'wall_seconds' and r[metric] - old[metric] < min_seconds:
+                continue
+            if r[metric] > old[metric] * (1 + threshold):
+                regressions.append(((r['case'], r['size'], r['seed']), metric, old[metric], r[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    parser.add_argument('--seeds', type=int, nargs='+', default=[1, 2, 3])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--render-max', type=int, default=10_000,
+                        help="largest graph passed to visualize_graph")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help="earlier results file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="allowed relative increase before a metric counts as a regression")
+    parser.add_argument('--min-seconds', type=float, default=0.001,
+                        help="smallest wall time increase that can count as a regression")
+    args = parser.parse_args()
+
+    results = []
+
+    def record(case, size, seed, metrics):
+        results.append({'case': case, 'size': size, 'seed': seed, **metrics})
+        print(f"{case:>24} {size:>9} {seed:>5} {metrics['wall_seconds']:>10.4f} "
+              f"{metrics.get('nodes_settled', ''):>9} {metrics['heap_pushes'] + metrics['heap_pops']:>10} "
+              f"{metrics['peak_memory_bytes'] / 2 ** 20:>9.1f}")
+
+    print(f"{'case':>24} {'nodes':>9} {'seed':>5} {'wall (s)':>10} {'settled':>9} {'heap ops':>10} {'peak MB':>9}")
+    for seed in args.seeds:
+        for size, case, metrics in city_graph_cases(seed, args.repeat):
+            record(case, size, seed, metrics)
+        for size in args.sizes:
+            for case, metrics in generation_cases(size, seed, args.repeat):
+                record(case, size, seed, metrics)
+            for case, metrics in routing_cases(size, seed, args.repeat, args.render_max):
+                record(case, size, seed, metrics)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'meta': {
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'repeat': args.repeat
+            },
+            'results': results
+        }, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold, args.min_seconds)
+        for (case, size, seed), metric, old, new in regressions:
+            print(f"REGRESSION {case} nodes={size} seed={seed}: {metric} {old:.4g} -> {new:.4g}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
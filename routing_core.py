@@ -0,0 +1,3732 @@
+"""
+Routing engine for the Emergency Hospital Locator, free of UI dependencies
+
+networkx is imported on first use of the graph, matplotlib only when a map
+is rendered, so batch jobs and workers that route over a loaded CSR or
+binary graph start quickly. The Streamlit front-end lives in app.py.
+
+Usage: python routing_core.py (--graph-file city.bin | --synthetic 100000 | --edges roads.csv)
+           [--origin 42 | --origins-file origins.txt] [--k 3] [--workers 4]
+           [--method ch] [--ch-file city.ch]
+"""
+import random
+import math
+import time
+from collections import defaultdict, OrderedDict
+from array import array
+import hashlib
+import heapq
+import bisect
+import os
+import sys
+import csv
+import itertools
+import tracemalloc
+import mmap
+import struct
+
+
+class CSRGraph:
+    """
+    Immutable compressed-sparse-row snapshot of an undirected road graph.
+    Node ids are mapped to dense integer indices; the neighbours of index u
+    are targets[offsets[u]:offsets[u + 1]] with matching weights.
+    """
+
+    def __init__(self, node_ids, offsets, targets, weights, xs=None, ys=None, geographic=False,
+                 index=None, heuristic_scale=None):
+        self.node_ids = node_ids if isinstance(node_ids, (list, range)) else list(node_ids)
+        self.index = index if index is not None else {node: i for i, node in enumerate(self.node_ids)}
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        self.num_nodes = len(self.node_ids)
+
+        # Optional node coordinates: planar km, or lon/lat degrees if geographic
+        self.xs = xs
+        self.ys = ys
+        self.geographic = geographic
+        # Optional travel-time profile id per edge, for graphs without networkx
+        self.edge_profiles = None
+        if heuristic_scale is None and xs is not None:
+            heuristic_scale = self._heuristic_scale()
+        self.heuristic_scale = heuristic_scale
+
+        # Preallocated buffers, copied (memcpy) into each query's working arrays
+        self._dist_template = array('d', [float('infinity')]) * self.num_nodes
+        self._pred_template = array('q', [-1]) * self.num_nodes
+
+    @classmethod
+    def from_networkx(cls, graph, geographic=False):
+        """Compile a networkx graph, preserving its node and adjacency order"""
+        node_ids = list(graph.nodes())
+        index = {node: i for i, node in enumerate(node_ids)}
+
+        offsets = array('q', [0])
+        targets = array('q')
+        weights = array('d')
+        for node in node_ids:
+            for neighbor, data in graph.adj[node].items():
+                targets.append(index[neighbor])
+                weights.append(data['weight'])
+            offsets.append(len(targets))
+
+        # Coordinates are only usable if every node has them
+        xs = ys = None
+        node_data = graph.nodes
+        if node_ids and all('x' in node_data[n] and 'y' in node_data[n] for n in node_ids):
+            xs = array('d', (node_data[n]['x'] for n in node_ids))
+            ys = array('d', (node_data[n]['y'] for n in node_ids))
+
+        return cls(node_ids, offsets, targets, weights, xs, ys, geographic)
+
+    @classmethod
+    def from_edge_arrays(cls, node_ids, sources, targets, weights, xs=None, ys=None,
+                         geographic=False, index=None):
+        """
+        Build the CSR by counting sort from parallel edge arrays (indices into
+        node_ids). Each node's neighbours keep edge-list order, as networkx does.
+        """
+        n = len(node_ids)
+        offsets = array('q', [0]) * (n + 1)
+        for u in sources:
+            offsets[u + 1] += 1
+        for v in targets:
+            offsets[v + 1] += 1
+        for i in range(n):
+            offsets[i + 1] += offsets[i]
+
+        fill = offsets[:-1]
+        adj_targets = array('q', [0]) * offsets[n]
+        adj_weights = array('d', [0.0]) * offsets[n]
+        for u, v, w in zip(sources, targets, weights):
+            e = fill[u]
+            adj_targets[e] = v
+            adj_weights[e] = w
+            fill[u] = e + 1
+            e = fill[v]
+            adj_targets[e] = u
+            adj_weights[e] = w
+            fill[v] = e + 1
+
+        return cls(node_ids, offsets, adj_targets, adj_weights, xs, ys, geographic, index)
+
+    def with_edge(self, u, v, weight, profile=0):
+        """
+        Copy of the snapshot with a new road between indices u and v,
+        appended to the end of both nodes' neighbour lists (with the given
+        profile id when the snapshot carries edge profiles)
+        """
+        low, high = min(u, v), max(u, v)
+        first, second = self.offsets[low + 1], self.offsets[high + 1]
+        other = {low: high, high: low}
+
+        targets = array('q', self.targets[:first])
+        targets.append(other[low])
+        targets.extend(self.targets[first:second])
+        targets.append(other[high])
+        targets.extend(self.targets[second:])
+        weights = array('d', self.weights[:first])
+        weights.append(weight)
+        weights.extend(self.weights[first:second])
+        weights.append(weight)
+        weights.extend(self.weights[second:])
+
+        offsets = array('q', self.offsets)
+        for i in range(low + 1, self.num_nodes + 1):
+            offsets[i] += 1 if i <= high else 2
+
+        csr = CSRGraph(self.node_ids, offsets, targets, weights, self.xs, self.ys, self.geographic,
+                       self.index, self.heuristic_scale)
+        if self.edge_profiles is not None:
+            profiles = array('q', self.edge_profiles[:first])
+            profiles.append(profile)
+            profiles.extend(self.edge_profiles[first:second])
+            profiles.append(profile)
+            profiles.extend(self.edge_profiles[second:])
+            csr.edge_profiles = profiles
+        return csr
+
+    def fingerprint(self):
+        """Hash of the node ids and adjacency arrays, to detect a changed graph"""
+        try:
+            digest = hashlib.sha256(array('q', self.node_ids).tobytes())
+        except TypeError:
+            digest = hashlib.sha256(repr(list(self.node_ids)).encode())
+        for values in (self.offsets, self.targets, self.weights):
+            digest.update(values.tobytes())
+        return digest.hexdigest()
+
+    def straight_line(self, u, v):
+        """Straight-line distance in km between two node indices"""
+        if not self.geographic:
+            return math.hypot(self.xs[u] - self.xs[v], self.ys[u] - self.ys[v])
+
+        # Haversine great-circle distance, x = longitude and y = latitude
+        lon1, lat1 = math.radians(self.xs[u]), math.radians(self.ys[u])
+        lon2, lat2 = math.radians(self.xs[v]), math.radians(self.ys[v])
+        a = (math.sin((lat2 - lat1) / 2) ** 2
+             + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+        return 2 * 6371.0 * math.asin(min(1.0, math.sqrt(a)))
+
+    def _heuristic_scale(self):
+        """
+        Largest factor k with k * straight_line(u, v) <= weight for every road,
+        so k * straight-line distance never overestimates road distance
+        """
+        scale = float('infinity')
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        for u in range(self.num_nodes):
+            for e in range(offsets[u], offsets[u + 1]):
+                straight = self.straight_line(u, targets[e])
+                if straight > 0:
+                    scale = min(scale, weights[e] / straight)
+        return scale if scale != float('infinity') else 0.0
+
+    def dijkstra(self, source, targets=None, stop_at='any', stats=None):
+        """
+        Dijkstra's Algorithm over the CSR arrays from a source index, or from
+        a list of (index, starting distance) seeds for a multi-source search
+        With targets, stops once 'any' (or 'all') of the target indices settle,
+        after also settling any nodes tied at that distance
+        A stats dictionary, if given, is filled with the search's operation
+        counts; only stale skips are counted in the loop, the rest is derived
+        Returns: distance array, predecessor array (-1 = no predecessor)
+        and the list of settled indices in settling order
+        """
+        offsets, targets_, weights = self.offsets, self.targets, self.weights
+        dist = array('d', self._dist_template)
+        pred = array('q', self._pred_template)
+        settled = bytearray(self.num_nodes)
+        order = []
+        heappush, heappop = heapq.heappush, heapq.heappop
+
+        is_target = None
+        if targets is not None:
+            is_target = bytearray(self.num_nodes)
+            for t in targets:
+                is_target[t] = 1
+            remaining = sum(is_target) if stop_at == 'all' else 1
+
+        seeds = [(source, 0.0)] if isinstance(source, int) else source
+        pq = []
+        for index, distance in seeds:
+            if distance < dist[index]:
+                dist[index] = distance
+                pq.append((distance, index))
+        heapq.heapify(pq)
+        seeded = len(pq)
+        stop_distance = float('infinity')
+        stale = stopped = 0
+
+        while pq:
+            current_distance, u = heappop(pq)
+
+            # Nodes tied with the last needed target are still settled so
+            # callers can break ties between equally near targets themselves
+            if current_distance > stop_distance:
+                stopped = 1
+                break
+
+            if settled[u]:
+                stale += 1
+                continue
+
+            settled[u] = 1
+            order.append(u)
+
+            if is_target is not None and is_target[u]:
+                remaining -= 1
+                if remaining == 0:
+                    stop_distance = current_distance
+
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets_[e]
+                if not settled[v]:
+                    new_distance = current_distance + weights[e]
+
+                    if new_distance < dist[v]:
+                        dist[v] = new_distance
+                        pred[v] = u
+                        heappush(pq, (new_distance, v))
+
+        if stats is not None:
+            pops = len(order) + stale + stopped
+            stats.update(heap_pushes=pops + len(pq), heap_pops=pops, stale_skips=stale,
+                         relaxations=pops + len(pq) - seeded, settled=len(order),
+                         edges_scanned=sum(offsets[u + 1] - offsets[u] for u in order))
+        return dist, pred, order
+
+    def k_nearest(self, source, targets, k, penalties=None):
+        """
+        Dijkstra from a source index until the k best targets are known,
+        scoring each target by its distance plus a non-negative penalty
+        Any target not yet settled scores at least the current distance, so
+        the search stops once that passes the k-th best score
+        Returns: distance array, predecessor array, settled indices and the
+        ranked list of (score, position in targets), ties in targets order
+        """
+        offsets, targets_, weights = self.offsets, self.targets, self.weights
+        dist = array('d', self._dist_template)
+        pred = array('q', self._pred_template)
+        settled = bytearray(self.num_nodes)
+        order = []
+        heappush, heappop = heapq.heappush, heapq.heappop
+
+        position = {t: i for i, t in enumerate(targets)}
+        remaining = len(position)
+        best = []  # max-heap of the k best (score, position), negated
+        kth_score = float('infinity')
+
+        dist[source] = 0.0
+        pq = [(0.0, source)]
+
+        while pq and remaining:
+            current_distance, u = heappop(pq)
+            if current_distance > kth_score:
+                break
+
+            if settled[u]:
+                continue
+
+            settled[u] = 1
+            order.append(u)
+
+            i = position.get(u)
+            if i is not None:
+                remaining -= 1
+                score = current_distance + (penalties[i] if penalties else 0.0)
+                if len(best) < k:
+                    heappush(best, (-score, -i))
+                elif (score, i) < (-best[0][0], -best[0][1]):
+                    heapq.heapreplace(best, (-score, -i))
+                if len(best) == k:
+                    kth_score = -best[0][0]
+
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets_[e]
+                if not settled[v]:
+                    new_distance = current_distance + weights[e]
+
+                    if new_distance < dist[v]:
+                        dist[v] = new_distance
+                        pred[v] = u
+                        heappush(pq, (new_distance, v))
+
+        ranked = sorted((-score, -i) for score, i in best)
+        return dist, pred, order, ranked
+
+    def time_dependent_dijkstra(self, source, departure, profiles, edge_profile,
+                                targets=None, stop_at='any'):
+        """
+        Dijkstra over travel times that depend on when each road is entered:
+        edge e starting at minute t costs weights[e] * pace of profile
+        edge_profile[e] at t. departure is in minutes after midnight.
+        Exact as long as the profiles are FIFO (leaving later never arrives
+        earlier), which holds when pace falls slower than 1 / road length.
+        Returns: travel minutes since departure, predecessor array and
+        settled order, as dijkstra (targets and stop_at likewise)
+        """
+        offsets, targets_, weights = self.offsets, self.targets, self.weights
+        pace = profiles.pace
+        dist = array('d', self._dist_template)
+        pred = array('q', self._pred_template)
+        settled = bytearray(self.num_nodes)
+        order = []
+        heappush, heappop = heapq.heappush, heapq.heappop
+
+        is_target = None
+        if targets is not None:
+            is_target = bytearray(self.num_nodes)
+            for t in targets:
+                is_target[t] = 1
+            remaining = sum(is_target) if stop_at == 'all' else 1
+
+        dist[source] = 0.0
+        pq = [(0.0, source)]
+        stop_distance = float('infinity')
+
+        while pq:
+            current_distance, u = heappop(pq)
+            if current_distance > stop_distance:
+                break
+
+            if settled[u]:
+                continue
+
+            settled[u] = 1
+            order.append(u)
+
+            if is_target is not None and is_target[u]:
+                remaining -= 1
+                if remaining == 0:
+                    stop_distance = current_distance
+
+            now = departure + current_distance
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets_[e]
+                if not settled[v]:
+                    new_distance = current_distance + weights[e] * pace(edge_profile[e], now)
+
+                    if new_distance < dist[v]:
+                        dist[v] = new_distance
+                        pred[v] = u
+                        heappush(pq, (new_distance, v))
+
+        return dist, pred, order
+
+    def bidirectional_dijkstra(self, source, target):
+        """
+        Point-to-point Dijkstra searching from both ends at once
+        Returns: distance, path as a list of indices, and settled node count
+        """
+        if source == target:
+            return 0.0, [source], 1
+
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        dist = (array('d', self._dist_template), array('d', self._dist_template))
+        pred = (array('q', self._pred_template), array('q', self._pred_template))
+        settled = (bytearray(self.num_nodes), bytearray(self.num_nodes))
+        heaps = ([(0.0, source)], [(0.0, target)])
+        heappush, heappop = heapq.heappush, heapq.heappop
+
+        dist[0][source] = 0.0
+        dist[1][target] = 0.0
+        best = float('infinity')
+        meet = -1
+        visited = 0
+
+        while heaps[0] and heaps[1]:
+            # No unsettled pair of labels can beat the best meeting point
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+
+            side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+            current_distance, u = heappop(heaps[side])
+
+            if settled[side][u]:
+                continue
+
+            settled[side][u] = 1
+            visited += 1
+            side_dist, other_dist, side_pred = dist[side], dist[1 - side], pred[side]
+
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets[e]
+                new_distance = current_distance + weights[e]
+
+                if new_distance < side_dist[v]:
+                    side_dist[v] = new_distance
+                    side_pred[v] = u
+                    heappush(heaps[side], (new_distance, v))
+
+                if new_distance + other_dist[v] < best:
+                    best = new_distance + other_dist[v]
+                    meet = v
+
+        if meet < 0:
+            return best, [], visited
+
+        path = []
+        node = meet
+        while node >= 0:
+            path.append(node)
+            node = pred[0][node]
+        path.reverse()
+
+        node = pred[1][meet]
+        while node >= 0:
+            path.append(node)
+            node = pred[1][node]
+
+        return best, path, visited
+
+    def a_star(self, source, target):
+        """
+        A* search guided by the scaled straight-line distance to the target
+        Returns: distance array, predecessor array and settled order, as dijkstra
+        """
+        if self.xs is None:
+            raise ValueError("A* needs x/y coordinates on every node")
+
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        dist = array('d', self._dist_template)
+        pred = array('q', self._pred_template)
+        settled = bytearray(self.num_nodes)
+        order = []
+        heappush, heappop = heapq.heappush, heapq.heappop
+        straight_line, scale = self.straight_line, self.heuristic_scale
+
+        dist[source] = 0.0
+        pq = [(scale * straight_line(source, target), 0.0, source)]
+
+        while pq:
+            _, current_distance, u = heappop(pq)
+
+            if settled[u]:
+                continue
+
+            settled[u] = 1
+            order.append(u)
+
+            if u == target:
+                break
+
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets[e]
+                if not settled[v]:
+                    new_distance = current_distance + weights[e]
+
+                    if new_distance < dist[v]:
+                        dist[v] = new_distance
+                        pred[v] = u
+                        heappush(pq, (new_distance + scale * straight_line(v, target),
+                                      new_distance, v))
+
+        return dist, pred, order
+
+    def to_dicts(self, dist, pred, order=None):
+        """
+        Convert result arrays into the node-keyed dictionaries used by the UI
+        With a settled order, only the settled nodes are included
+        """
+        node_ids = self.node_ids
+        if order is None:
+            distances = dict(zip(node_ids, dist))
+            previous = {node: (node_ids[p] if p >= 0 else None)
+                        for node, p in zip(node_ids, pred)}
+        else:
+            distances = {node_ids[i]: dist[i] for i in order}
+            previous = {node_ids[i]: (node_ids[pred[i]] if pred[i] >= 0 else None)
+                        for i in order}
+        return distances, previous
+
+
+class NearestHospitalTable:
+    """
+    Nearest-hospital label for every node, built by one multi-source
+    Dijkstra seeded from all hospitals at once. Ties are broken by the
+    hospital's position in the hospital list, matching find_nearest_hospital.
+    """
+
+    def __init__(self, csr, hospitals):
+        self.csr = csr
+        self.hospitals = list(hospitals)
+        self.hospital_nodes = tuple(node for node, _ in self.hospitals)
+        self.distance = array('d', csr._dist_template)
+        self.owner = array('q', csr._pred_template)     # rank in self.hospitals
+        self.next_hop = array('q', csr._pred_template)  # one step toward owner
+
+        self._grow([(csr.index[node], rank) for rank, (node, _) in enumerate(self.hospitals)])
+
+    def _grow(self, seeds):
+        """
+        Multi-source search from (source index, hospital rank) seeds that
+        claims only nodes whose current label it beats, so the same routine
+        builds the table and patches it when a hospital is added.
+        """
+        offsets, targets, weights = self.csr.offsets, self.csr.targets, self.csr.weights
+        distance, owner, next_hop = self.distance, self.owner, self.next_hop
+        heappush, heappop = heapq.heappush, heapq.heappop
+
+        pq = []
+        for source, rank in seeds:
+            if 0.0 < distance[source] or rank < owner[source]:
+                distance[source] = 0.0
+                owner[source] = rank
+                next_hop[source] = -1
+                pq.append((0.0, rank, source))
+        heapq.heapify(pq)
+
+        while pq:
+            current_distance, rank, u = heappop(pq)
+
+            # Skip entries superseded by a shorter (or tie-winning) label
+            if current_distance != distance[u] or rank != owner[u]:
+                continue
+
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets[e]
+                new_distance = current_distance + weights[e]
+
+                if new_distance < distance[v] or (new_distance == distance[v] and rank < owner[v]):
+                    distance[v] = new_distance
+                    owner[v] = rank
+                    next_hop[v] = u
+                    heappush(pq, (new_distance, rank, v))
+
+    def add_hospital(self, node, name):
+        """Patch the labels for a newly added hospital (lowest tie priority)"""
+        self.hospitals.append((node, name))
+        self.hospital_nodes += (node,)
+        self._grow([(self.csr.index[node], len(self.hospitals) - 1)])
+
+    def lookup(self, node):
+        """Return (hospital, distance, path) for a node, or None if unreachable"""
+        i = self.csr.index[node]
+        if self.owner[i] < 0:
+            return None
+
+        node_ids = self.csr.node_ids
+        path = [node]
+        while self.next_hop[i] >= 0:
+            i = self.next_hop[i]
+            path.append(node_ids[i])
+
+        return self.hospitals[self.owner[i]], self.distance[self.csr.index[node]], path
+
+
+class ContractionHierarchy:
+    """
+    Contraction hierarchy over a CSR snapshot: a node ordering plus shortcut
+    edges, stored as an upward graph (each node keeps only its edges to
+    higher-ranked nodes). Shortcuts remember the contracted middle node so
+    query paths can be unpacked back into real roads.
+    """
+
+    FILE_MAGIC = b'EHLCHIER'
+    VERSION = 2
+    # magic, version, flags (unused), nodes, upward edges, SHA-256
+    # fingerprint of the graph; 64 bytes keeps the sections 8-byte aligned
+    FILE_HEADER = struct.Struct('<8sIIqq32s')
+    # rank, up_offsets, up_targets, up_weights, up_middle
+    SECTION_TYPES = ('q', 'q', 'q', 'd', 'q')
+
+    def __init__(self, fingerprint, rank, up_offsets, up_targets, up_weights, up_middle):
+        self.fingerprint = fingerprint
+        self.rank = rank
+        self.up_offsets = up_offsets
+        self.up_targets = up_targets
+        self.up_weights = up_weights
+        self.up_middle = up_middle    # -1 for an original road
+
+    @classmethod
+    def build(cls, csr, witness_limit=300):
+        """
+        Contract nodes in priority order with lazy updates. The priority is
+        twice the edge difference, plus the roads the shortcuts would cover
+        beyond those they replace, plus contracted neighbours and three times
+        the node's level, which spreads contraction evenly over the network.
+        Witness searches stop as soon as every neighbour has a path no longer
+        than the one through the contracted node (witness_limit only caps
+        pathological cases; a missing witness adds a redundant shortcut).
+        """
+        n = csr.num_nodes
+        offsets, targets, weights = csr.offsets, csr.targets, csr.weights
+        heappush, heappop = heapq.heappush, heapq.heappop
+        infinity = float('infinity')
+
+        # Remaining graph: neighbour -> (weight, middle node or -1, roads covered)
+        adj = [dict() for _ in range(n)]
+        for u in range(n):
+            for e in range(offsets[u], offsets[u + 1]):
+                v, w = targets[e], weights[e]
+                if v != u and w != infinity and (v not in adj[u] or w < adj[u][v][0]):
+                    adj[u][v] = (w, -1, 1)
+
+        def shortcuts_for(v):
+            """Shortcuts needed if v were contracted now: (u, x, length, roads)"""
+            neighbors = list(adj[v].items())
+            needed = []
+            for i in range(len(neighbors) - 1):
+                u, (weight_u, _, roads_u) = neighbors[i]
+                # Later neighbours still lacking a witness no longer than via v
+                pending = {x: weight_u + w for x, (w, _, _) in neighbors[i + 1:]}
+                max_distance = max(pending.values())
+
+                witness = {u: 0.0}
+                pq = [(0.0, u)]
+                settled = 0
+                while pq and pending:
+                    d, x = heappop(pq)
+                    if d > witness[x]:
+                        continue
+                    if d > max_distance or settled == witness_limit:
+                        break
+                    settled += 1
+                    for y, (w, _, _) in adj[x].items():
+                        if y != v and d + w < witness.get(y, infinity):
+                            witness[y] = d + w
+                            heappush(pq, (d + w, y))
+                            if d + w <= pending.get(y, -1.0):
+                                del pending[y]
+                                if not pending:
+                                    break
+                                max_distance = max(pending.values())
+
+                for x, (_, _, roads_x) in neighbors[i + 1:]:
+                    if x in pending:
+                        needed.append((u, x, pending[x], roads_u + roads_x))
+            return needed
+
+        contracted_neighbors = [0] * n
+        level = [0] * n
+
+        def priority(v, needed):
+            """Edge difference and covered roads, plus terms that spread contraction"""
+            removed = adj[v].values()
+            return (2 * (len(needed) - len(removed))
+                    + sum(roads for _, _, _, roads in needed) - sum(roads for _, _, roads in removed)
+                    + contracted_neighbors[v] + 3 * level[v])
+
+        current = [priority(v, shortcuts_for(v)) for v in range(n)]
+        pq = [(current[v], v) for v in range(n)]
+        heapq.heapify(pq)
+
+        rank = array('q', [-1]) * n
+        upward = [None] * n
+        next_rank = 0
+
+        while pq:
+            p, v = heappop(pq)
+            if rank[v] >= 0 or p != current[v]:
+                continue
+
+            # Lazy update: re-evaluate and defer if no longer the cheapest
+            needed = shortcuts_for(v)
+            current[v] = priority(v, needed)
+            if pq and current[v] > pq[0][0]:
+                heappush(pq, (current[v], v))
+                continue
+
+            for u, x, via, roads in needed:
+                if x not in adj[u] or via < adj[u][x][0]:
+                    adj[u][x] = adj[x][u] = (via, v, roads)
+
+            upward[v] = adj[v]
+            adj[v] = {}
+            for u in upward[v]:
+                del adj[u][v]
+                contracted_neighbors[u] += 1
+                level[u] = max(level[u], level[v] + 1)
+                # Only the contracted-neighbour term is updated eagerly; the
+                # rest is re-evaluated when u reaches the front of the queue
+                current[u] += 1
+                heappush(pq, (current[u], u))
+
+            rank[v] = next_rank
+            next_rank += 1
+
+        up_offsets = array('q', [0])
+        up_targets = array('q')
+        up_weights = array('d')
+        up_middle = array('q')
+        for v in range(n):
+            for u, (w, middle, _) in upward[v].items():
+                up_targets.append(u)
+                up_weights.append(w)
+                up_middle.append(middle)
+            up_offsets.append(len(up_targets))
+
+        return cls(csr.fingerprint(), rank, up_offsets, up_targets, up_weights, up_middle)
+
+    def save(self, path):
+        """Write the hierarchy as a header followed by its array sections"""
+        with open(path, 'wb') as f:
+            f.write(self.FILE_HEADER.pack(self.FILE_MAGIC, self.VERSION, 0, len(self.rank),
+                                          len(self.up_targets), bytes.fromhex(self.fingerprint)))
+            for typecode, values in zip(self.SECTION_TYPES, (self.rank, self.up_offsets, self.up_targets,
+                                                              self.up_weights, self.up_middle)):
+                _write_section(f, array(typecode, values))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory-map a hierarchy written by save(); returns None for files of
+        another format or version, or truncated ones
+        """
+        if sys.byteorder != 'little':
+            raise ValueError("Contraction hierarchy files can only be mapped on little-endian hosts")
+
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < cls.FILE_HEADER.size:
+                return None
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _, n, m, digest = cls.FILE_HEADER.unpack_from(mapped, 0)
+        counts = (n, n + 1, m, m, m)
+        if magic != cls.FILE_MAGIC or version != cls.VERSION \
+                or len(mapped) != cls.FILE_HEADER.size + 8 * sum(counts):
+            return None
+
+        view = memoryview(mapped)
+        position = cls.FILE_HEADER.size
+        sections = []
+        for typecode, count in zip(cls.SECTION_TYPES, counts):
+            sections.append(view[position:position + 8 * count].cast(typecode))
+            position += 8 * count
+        return cls(digest.hex(), *sections)
+
+    def upward_search(self, source):
+        """
+        Complete Dijkstra over the upward graph with stall-on-demand;
+        returns {index: distance} for the nodes that were not stalled
+        (a stalled label is never part of a shortest path)
+        """
+        up_offsets, up_targets, up_weights = self.up_offsets, self.up_targets, self.up_weights
+        dist = {source: 0.0}
+        pq = [(0.0, source)]
+        stalled = set()
+
+        while pq:
+            d, u = heapq.heappop(pq)
+            if d > dist[u]:
+                continue
+            first, end = up_offsets[u], up_offsets[u + 1]
+            if self._stalled(dist, d, first, end):
+                stalled.add(u)
+                continue
+            for e in range(first, end):
+                v = up_targets[e]
+                if d + up_weights[e] < dist.get(v, float('infinity')):
+                    dist[v] = d + up_weights[e]
+                    heapq.heappush(pq, (dist[v], v))
+
+        for u in stalled:
+            del dist[u]
+        return dist
+
+    def _stalled(self, dist, d, first, end):
+        """
+        Stall-on-demand: a higher node already labelled reaches u (through
+        upward edges first..end, which are also its downward edges) for
+        less than d, so d is not u's distance and need not be expanded
+        """
+        up_targets, up_weights = self.up_targets, self.up_weights
+        infinity = float('infinity')
+        for e in range(first, end):
+            if dist.get(up_targets[e], infinity) + up_weights[e] < d:
+                return True
+        return False
+
+    def query(self, source, target):
+        """
+        Bidirectional upward search between two indices
+        Returns: distance, unpacked path as a list of indices, settled count
+        """
+        up_offsets, up_targets, up_weights = self.up_offsets, self.up_targets, self.up_weights
+        dist = ({source: 0.0}, {target: 0.0})
+        via_edge = ({source: -1}, {target: -1})   # upward edge used to reach a node
+        heaps = ([(0.0, source)], [(0.0, target)])
+        best = float('infinity')
+        meet = -1
+        visited = 0
+
+        while True:
+            # Each side stops once its smallest label cannot improve the best
+            side = -1
+            for s in (0, 1):
+                if heaps[s] and heaps[s][0][0] < best and \
+                        (side < 0 or heaps[s][0][0] < heaps[side][0][0]):
+                    side = s
+            if side < 0:
+                break
+
+            d, u = heapq.heappop(heaps[side])
+            if d > dist[side][u]:
+                continue
+            visited += 1
+
+            other = dist[1 - side].get(u)
+            if other is not None and d + other < best:
+                best = d + other
+                meet = u
+
+            first, end = up_offsets[u], up_offsets[u + 1]
+            if self._stalled(dist[side], d, first, end):
+                continue
+            for e in range(first, end):
+                v = up_targets[e]
+                new_distance = d + up_weights[e]
+                if new_distance < dist[side].get(v, float('infinity')):
+                    dist[side][v] = new_distance
+                    via_edge[side][v] = e
+                    heapq.heappush(heaps[side], (new_distance, v))
+
+        if meet < 0:
+            return best, [], visited
+
+        # Hierarchy edges from source up to the meeting node, then down to target
+        edges = []
+        node = meet
+        while via_edge[0][node] >= 0:
+            edges.append(via_edge[0][node])
+            node = self._edge_source(via_edge[0][node])
+        edges.reverse()
+        path = [source]
+        for e in edges:
+            path.extend(self.unpack(self._edge_source(e), self.up_targets[e])[1:])
+
+        node = meet
+        while via_edge[1][node] >= 0:
+            e = via_edge[1][node]
+            lower = self._edge_source(e)
+            path.extend(self.unpack(node, lower)[1:])
+            node = lower
+
+        return best, path, visited
+
+    def _edge_source(self, e):
+        """Node owning upward edge e (binary search over the offsets)"""
+        lo, hi = 0, len(self.up_offsets) - 1
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if self.up_offsets[mid] <= e:
+                lo = mid
+            else:
+                hi = mid
+        return lo
+
+    def _middle(self, a, b):
+        """Middle node of the hierarchy edge between a and b (-1 for a road)"""
+        low, high = (a, b) if self.rank[a] < self.rank[b] else (b, a)
+        for e in range(self.up_offsets[low], self.up_offsets[low + 1]):
+            if self.up_targets[e] == high:
+                return self.up_middle[e]
+        raise KeyError((a, b))
+
+    def unpack(self, a, b):
+        """Expand the hierarchy edge a-b into the road path a ... b"""
+        path = [a]
+        stack = [(a, b)]
+        while stack:
+            u, v = stack.pop()
+            middle = self._middle(u, v)
+            if middle < 0:
+                path.append(v)
+            else:
+                stack.append((middle, v))
+                stack.append((u, middle))
+        return path
+
+
+class TravelTimeProfiles:
+    """
+    Piecewise-linear time-of-day travel-time profiles shared by many roads
+    Profile p has breakpoints times[offsets[p]:offsets[p + 1]] (minutes
+    after midnight, ascending, the first at 0) with matching paces in
+    minutes per km; pace is interpolated linearly and wraps at midnight.
+    """
+
+    DAY_MINUTES = 1440.0
+
+    def __init__(self):
+        self.names = []
+        self.index = {}
+        self.offsets = array('q', [0])
+        self.times = array('d')
+        self.paces = array('d')
+
+    @classmethod
+    def default(cls):
+        """Free-flow 60 km/h plus arterial and residential rush-hour profiles"""
+        profiles = cls()
+        profiles.add('free', [(0, 1.0)])
+        profiles.add('arterial', [(0, 0.9), (360, 1.0), (480, 2.2), (600, 1.2), (960, 1.3),
+                                  (1050, 2.4), (1170, 1.3), (1320, 1.0)])
+        profiles.add('residential', [(0, 1.4), (420, 1.5), (480, 1.9), (570, 1.5), (1020, 1.7),
+                                     (1080, 1.9), (1140, 1.5)])
+        return profiles
+
+    def add(self, name, breakpoints):
+        """Add a profile from (minute, pace) pairs; returns its id"""
+        breakpoints = sorted(breakpoints)
+        if not breakpoints or breakpoints[0][0] != 0:
+            raise ValueError("A travel-time profile needs a breakpoint at minute 0")
+        if breakpoints[-1][0] >= self.DAY_MINUTES:
+            raise ValueError("Profile breakpoints must fall within one day")
+
+        profile = self.index.get(name)
+        if profile is not None:
+            raise ValueError(f"Travel-time profile {name!r} already exists")
+        profile = self.index[name] = len(self.names)
+        self.names.append(name)
+        for minute, pace in breakpoints:
+            self.times.append(float(minute))
+            self.paces.append(float(pace))
+        self.offsets.append(len(self.times))
+        return profile
+
+    def pace(self, profile, minute):
+        """Minutes per km on roads of this profile when entered at minute"""
+        minute %= self.DAY_MINUTES
+        first, end = self.offsets[profile], self.offsets[profile + 1]
+        i = bisect.bisect_right(self.times, minute, first, end) - 1
+        if i + 1 < end:
+            next_time, next_pace = self.times[i + 1], self.paces[i + 1]
+        else:
+            next_time, next_pace = self.DAY_MINUTES, self.paces[first]
+        start_time, start_pace = self.times[i], self.paces[i]
+        return start_pace + (next_pace - start_pace) * (minute - start_time) / (next_time - start_time)
+
+
+# Length of one degree of latitude, for snapping distances on lon/lat graphs
+KM_PER_DEGREE = 111.32
+
+# Generated roads at least this long get the 'arterial' travel-time profile
+ARTERIAL_ROAD_KM = 8.0
+
+# Above this many nodes visualize_graph defaults to the fast renderer
+FAST_RENDER_THRESHOLD = 500
+
+# Column names accepted by load_road_network, in order of preference
+EDGE_SOURCE_COLUMNS = ('source', 'src', 'u', 'from', 'node1', 'start')
+EDGE_TARGET_COLUMNS = ('target', 'dst', 'v', 'to', 'node2', 'end')
+EDGE_WEIGHT_COLUMNS = ('weight', 'length', 'distance', 'travel_time', 'cost')
+HEADER_COLUMNS = set(EDGE_SOURCE_COLUMNS + EDGE_TARGET_COLUMNS + EDGE_WEIGHT_COLUMNS
+                     + ('id', 'node', 'name', 'x', 'y', 'lon', 'lat'))
+
+
+def _parse_node_id(text):
+    """Node ids are ints when they look like ints, otherwise strings"""
+    text = text.strip()
+    try:
+        return int(text)
+    except ValueError:
+        return text
+
+
+def _read_table_chunks(path, chunk_size):
+    """
+    Stream a comma/tab/whitespace separated table in lists of at most
+    chunk_size rows, skipping blank and comment (#, %) lines
+    Returns: header (lower-cased column names, or None) and a chunk iterator
+    """
+    f = open(path, newline='')
+    lines = (line for line in f if line.strip() and not line.startswith(('#', '%')))
+    first = next(lines, '')
+
+    if ',' in first or '\t' in first:
+        rows = csv.reader(itertools.chain([first], lines),
+                          delimiter=',' if ',' in first else '\t')
+    else:
+        rows = (line.split() for line in itertools.chain([first], lines))
+
+    first_row = next(rows, None)
+    header = None
+    if first_row and any(field.strip().lower() in HEADER_COLUMNS for field in first_row) \
+            and not all(_is_number(field) for field in first_row):
+        header = [field.strip().lower() for field in first_row]
+    elif first_row:
+        rows = itertools.chain([first_row], rows)
+
+    def chunks():
+        try:
+            while True:
+                chunk = list(itertools.islice(rows, chunk_size))
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            f.close()
+
+    return header, chunks()
+
+
+def _is_number(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+
+def _column(header, names, default):
+    """Index of the first matching column name, or default"""
+    if header is None:
+        return default
+    for name in names:
+        if name in header:
+            return header.index(name)
+    return default
+
+
+def _peak_rss_bytes():
+    """Peak resident set size of this process so far (None if unavailable)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# Binary graph file: a fixed header followed by 8-byte aligned sections
+#   node ids int64[n], node types uint8[n], name offsets int64[n + 1],
+#   names utf-8, [x float64[n], y float64[n]], CSR offsets int64[n + 1],
+#   CSR targets int64[adjacency], CSR weights float64[adjacency],
+#   hospital indices int64[hospitals]
+# Version 2 adds a profile header (profile count, profile names size,
+# breakpoint count) after the fixed header, and after the version 1 sections:
+#   hospital capacity int64[hospitals] (-1 = unknown), hospital wait time
+#   float64[hospitals] (NaN = unknown), profile name offsets int64[profiles + 1],
+#   profile names utf-8, breakpoint offsets int64[profiles + 1], breakpoint
+#   times float64[breakpoints], paces float64[breakpoints],
+#   edge profile ids uint8[adjacency]
+GRAPH_FILE_MAGIC = b'EHLGRAPH'
+GRAPH_FILE_VERSION = 2
+GRAPH_FILE_HEADER = struct.Struct('<8sIIqqqqqd')
+GRAPH_FILE_PROFILE_HEADER = struct.Struct('<qqq')
+GRAPH_FLAG_COORDINATES = 1
+GRAPH_FLAG_GEOGRAPHIC = 2
+GRAPH_FLAG_IDENTITY_IDS = 4
+NODE_TYPES = ('location', 'hospital', 'person')
+
+# Overlay file of a sharded graph: magic, version, regions, nodes, roads
+# crossing regions, boundary nodes, hospitals, hospital name bytes
+SHARD_FILE_MAGIC = b'EHLSHARD'
+SHARD_FILE_VERSION = 1
+SHARD_FILE_HEADER = struct.Struct('<8sIIqqqqq')
+
+
+class _IdentityIndex:
+    """Node id -> index mapping for graphs whose node ids are exactly 0..n-1"""
+
+    def __init__(self, size):
+        self.size = size
+
+    def __contains__(self, node):
+        return isinstance(node, int) and 0 <= node < self.size
+
+    def __getitem__(self, node):
+        if node not in self:
+            raise KeyError(node)
+        return node
+
+    def __len__(self):
+        return self.size
+
+
+def _write_section(f, data):
+    """Write an array (little-endian) or raw bytes, padded to an 8-byte boundary"""
+    if isinstance(data, array):
+        if sys.byteorder != 'little':
+            data = array(data.typecode, data)
+            data.byteswap()
+        data = data.tobytes()
+    f.write(data)
+    f.write(b'\0' * (-len(data) % 8))
+
+
+class RouteCache:
+    """
+    Bounded LRU cache of route results. Keys include the graph version, so
+    entries from before a graph change are never served; size is an
+    approximate byte count of the cached results.
+    """
+
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()    # key -> (result, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size_of(result):
+        """Approximate memory held by a result dictionary"""
+        if result is None:
+            return sys.getsizeof(None)
+        if 'hospitals' in result:
+            # find_k_nearest_hospitals: one path per ranked hospital
+            return sys.getsizeof(result) + sum(RouteCache._size_of(entry)
+                                               for entry in result['hospitals'])
+        size = sys.getsizeof(result) + sys.getsizeof(result['path']) + 8 * len(result['path'])
+        if 'all_hospital_distances' in result:
+            size += sys.getsizeof(result['all_hospital_distances'])
+        return size
+
+    def get(self, key):
+        """Return (True, result) on a hit, (False, None) on a miss"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[0]
+
+    def put(self, key, result):
+        size = self._size_of(result)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self.bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (result, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes
+        }
+
+
+class QueryMetrics:
+    """
+    Opt-in query instrumentation for one locator: operation counter totals,
+    time per phase, latency and settled-node histograms, and the slowest
+    queries with their counters, exportable as Prometheus text
+    """
+
+    COUNTERS = {
+        'heap_pushes': "Heap pushes, including the source",
+        'heap_pops': "Heap pops",
+        'stale_skips': "Popped heap entries whose node was already settled",
+        'relaxations': "Edge relaxations that improved a distance",
+        'edges_scanned': "Edges scanned from settled nodes",
+        'settled': "Nodes settled"
+    }
+    SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+    SETTLED_BUCKETS = (10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+    def __init__(self, keep_slowest=10):
+        self.keep_slowest = keep_slowest
+        self.queries = defaultdict(int)
+        self.cache_hits = defaultdict(int)
+        self.totals = defaultdict(int)           # (query, counter)
+        self.phase_seconds = defaultdict(float)  # (query, phase)
+        # query -> [bucket counts..., +Inf count], sum
+        self.seconds = {}
+        self.settled = {}
+        self.slowest = []  # min-heap of (seconds, sequence, record)
+        self.last = None
+
+    @staticmethod
+    def _observe(histograms, query, buckets, value):
+        counts, total = histograms.get(query) or ([0] * (len(buckets) + 1), 0.0)
+        counts[bisect.bisect_left(buckets, value)] += 1
+        histograms[query] = (counts, total + value)
+
+    def record(self, query, seconds, stats=None, origin=None, cache_hit=False):
+        """Add one query: its wall time and, if it searched, its search stats"""
+        self.queries[query] += 1
+        if cache_hit:
+            self.cache_hits[query] += 1
+        self._observe(self.seconds, query, self.SECONDS_BUCKETS, seconds)
+
+        record = {'query': query, 'origin': origin, 'seconds': seconds, 'cache_hit': cache_hit}
+        phases = dict(stats.get('phases', ())) if stats else {}
+        if stats:
+            for counter in self.COUNTERS:
+                record[counter] = stats[counter]
+                self.totals[(query, counter)] += stats[counter]
+            self._observe(self.settled, query, self.SETTLED_BUCKETS, stats['settled'])
+        phases['other'] = max(0.0, seconds - sum(phases.values()))
+        for phase, phase_seconds in phases.items():
+            self.phase_seconds[(query, phase)] += phase_seconds
+        record['phases'] = phases
+        self.last = record
+
+        entry = (seconds, sum(self.queries.values()), record)
+        if len(self.slowest) < self.keep_slowest:
+            heapq.heappush(self.slowest, entry)
+        elif entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def add_phase(self, query, phase, seconds):
+        """Time spent outside any single query, e.g. compiling the CSR"""
+        self.phase_seconds[(query, phase)] += seconds
+
+    def slowest_queries(self):
+        return [record for _, _, record in sorted(self.slowest, reverse=True)]
+
+    def to_prometheus(self, prefix='ehl'):
+        """
+        Prometheus text exposition format; counts are written as exact
+        integers and times at full float precision, never rounded
+        """
+        lines = []
+
+        def number(value):
+            return str(value) if isinstance(value, int) else repr(float(value))
+
+        def family(name, kind, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{prefix}_{name}{{{label_text}}} {number(value)}")
+
+        def histogram(name, help_text, histograms, buckets):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for query, (counts, total) in sorted(histograms.items()):
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append(f'{prefix}_{name}_bucket{{query="{query}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_{name}_sum{{query="{query}"}} {number(total)}')
+                lines.append(f'{prefix}_{name}_count{{query="{query}"}} {cumulative}')
+
+        family('queries_total', 'counter', "Queries answered",
+               [((('query', q),), n) for q, n in sorted(self.queries.items())])
+        family('route_cache_hits_total', 'counter', "Queries answered from the route cache",
+               [((('query', q),), n) for q, n in sorted(self.cache_hits.items())])
+        for counter, help_text in self.COUNTERS.items():
+            family(f'{counter}_total', 'counter', help_text,
+                   [((('query', q),), v) for (q, c), v in sorted(self.totals.items()) if c == counter])
+        family('phase_seconds_total', 'counter', "Time spent per query phase",
+               [((('query', q), ('phase', p)), v) for (q, p), v in sorted(self.phase_seconds.items())])
+        histogram('query_seconds', "Query wall time", self.seconds, self.SECONDS_BUCKETS)
+        histogram('query_settled_nodes', "Nodes settled per search", self.settled, self.SETTLED_BUCKETS)
+        return '\n'.join(lines) + '\n'
+
+
+class SpatialIndex:
+    """
+    Uniform grid over node coordinates for snapping caller positions to the
+    road network. Queries scan rings of cells outward from the caller, so
+    they visit a handful of cells instead of every node. Geographic
+    coordinates are projected with an equirectangular approximation.
+    """
+
+    def __init__(self, csr, cell_size=None):
+        if csr.xs is None:
+            raise ValueError("A spatial index needs x/y coordinates on every node")
+
+        self.csr = csr
+        n = csr.num_nodes
+        self.scale_x = 1.0
+        if csr.geographic and n:
+            self.scale_x = math.cos(math.radians(sum(csr.ys) / n))
+        self.px = array('d', (x * self.scale_x for x in csr.xs))
+        self.py = array('d', csr.ys)
+
+        self.min_x, self.max_x = (min(self.px), max(self.px)) if n else (0.0, 0.0)
+        self.min_y, self.max_y = (min(self.py), max(self.py)) if n else (0.0, 0.0)
+        if cell_size is None:
+            # Collinear nodes span no area; size the cells along the longer side then
+            width, height = self.max_x - self.min_x, self.max_y - self.min_y
+            area = max(width * height, max(width, height) ** 2 / max(n, 1), 1e-12)
+            cell_size = math.sqrt(area / max(n, 1)) * 2
+        self.cell_size = cell_size or 1.0
+
+        self.node_cells = defaultdict(list)
+        for i in range(n):
+            self.node_cells[self._cell(self.px[i], self.py[i])].append(i)
+        self._edge_cells = None
+
+    def _cell(self, x, y):
+        return (int((x - self.min_x) // self.cell_size), int((y - self.min_y) // self.cell_size))
+
+    def _rings(self, x, y):
+        """
+        Yield (ring radius, cells in that ring) outward from the point's
+        cell, clipped to the grid: rings that miss it are skipped and a
+        ring never lists more cells than the grid has along its sides
+        """
+        cx, cy = self._cell(x, y)
+        last_x, last_y = self._cell(self.max_x, self.max_y)
+        first_ring = max(0, -cx, cx - last_x, -cy, cy - last_y)
+        max_ring = max(abs(cx), abs(cy), abs(last_x - cx), abs(last_y - cy))
+        for r in range(first_ring, max_ring + 1):
+            x0, x1 = max(cx - r, 0), min(cx + r, last_x)
+            y0, y1 = max(cy - r, 0), min(cy + r, last_y)
+            ring = []
+            for row in ((cy - r, cy + r) if r else (cy,)):
+                if y0 <= row <= y1:
+                    ring += [(column, row) for column in range(x0, x1 + 1)]
+            for column in ((cx - r, cx + r) if r else ()):
+                if x0 <= column <= x1:
+                    ring += [(column, row) for row in range(max(y0, cy - r + 1), min(y1, cy + r - 1) + 1)]
+            yield r, ring
+
+    def nearest_node(self, x, y):
+        """Return (node index, distance in projected units) nearest to (x, y)"""
+        qx, qy = x * self.scale_x, y
+        best, best_i = float('infinity'), -1
+        for r, ring in self._rings(qx, qy):
+            for cell in ring:
+                for i in self.node_cells.get(cell, ()):
+                    d = math.hypot(self.px[i] - qx, self.py[i] - qy)
+                    if d < best:
+                        best, best_i = d, i
+            # Anything in later rings is at least r cells away
+            if best_i >= 0 and best <= r * self.cell_size:
+                break
+        return best_i, best
+
+    def _build_edge_cells(self):
+        """Register every open road in each cell its bounding box covers"""
+        csr = self.csr
+        self._edge_cells = defaultdict(list)
+        for u in range(csr.num_nodes):
+            for e in range(csr.offsets[u], csr.offsets[u + 1]):
+                v = csr.targets[e]
+                if u < v:
+                    x0, y0 = self._cell(min(self.px[u], self.px[v]), min(self.py[u], self.py[v]))
+                    x1, y1 = self._cell(max(self.px[u], self.px[v]), max(self.py[u], self.py[v]))
+                    for cx in range(x0, x1 + 1):
+                        for cy in range(y0, y1 + 1):
+                            self._edge_cells[(cx, cy)].append((u, e))
+
+    def nearest_edge(self, x, y):
+        """
+        Closest point on any open road to (x, y)
+        Returns: (u index, v index, fraction t from u to v, projected point,
+        distance in projected units), or None if there are no roads
+        """
+        if self._edge_cells is None:
+            self._build_edge_cells()
+
+        csr = self.csr
+        qx, qy = x * self.scale_x, y
+        best, best_hit = float('infinity'), None
+        seen = set()
+        for r, ring in self._rings(qx, qy):
+            for cell in ring:
+                for u, e in self._edge_cells.get(cell, ()):
+                    if e in seen or csr.weights[e] == float('infinity'):
+                        continue
+                    seen.add(e)
+                    v = csr.targets[e]
+                    ax, ay, bx, by = self.px[u], self.py[u], self.px[v], self.py[v]
+                    length_sq = (bx - ax) ** 2 + (by - ay) ** 2
+                    t = 0.0 if length_sq == 0 else \
+                        max(0.0, min(1.0, ((qx - ax) * (bx - ax) + (qy - ay) * (by - ay)) / length_sq))
+                    px, py = ax + t * (bx - ax), ay + t * (by - ay)
+                    d = math.hypot(px - qx, py - qy)
+                    if d < best:
+                        best, best_hit = d, (u, v, t, (px / self.scale_x, py))
+            if best_hit is not None and best <= r * self.cell_size:
+                break
+        return best_hit + (best,) if best_hit else None
+
+
+class GraphShard:
+    """
+    One region of a partitioned road graph, as served by a region worker:
+    the roads inside the region as their own CSR, its boundary nodes (ends
+    of roads leaving the region) and the hospitals it contains.
+    """
+
+    def __init__(self, region, csr, boundary, hospitals):
+        self.region = region
+        self.csr = csr
+        self.boundary = boundary    # node ids
+        self.hospitals = hospitals  # (node, name, rank in the full list)
+        self._table = None
+
+    def hospital_table(self):
+        """Nearest local hospital for every node in the region"""
+        if self._table is None:
+            self._table = NearestHospitalTable(self.csr, [(node, name) for node, name, _ in self.hospitals])
+        return self._table
+
+    def hospital_reach(self, node):
+        """(distance, hospital rank) of the nearest hospital inside the region"""
+        table = self.hospital_table()
+        i = self.csr.index[node]
+        if table.owner[i] < 0:
+            return None
+        return table.distance[i], self.hospitals[table.owner[i]][2]
+
+    def boundary_distances(self, node):
+        """Distances inside the region from a node to every boundary node"""
+        csr = self.csr
+        if not self.boundary:
+            return []
+        dist, _, _ = csr.dijkstra(csr.index[node], targets=[csr.index[b] for b in self.boundary],
+                                  stop_at='all')
+        return [(b, dist[csr.index[b]]) for b in self.boundary if dist[csr.index[b]] != float('infinity')]
+
+    def path(self, source, target):
+        """Shortest path inside the region, as node ids"""
+        csr = self.csr
+        _, path, _ = csr.bidirectional_dijkstra(csr.index[source], csr.index[target])
+        return [csr.node_ids[i] for i in path]
+
+    def hospital_path(self, node):
+        """Path from a node to its nearest hospital inside the region"""
+        return self.hospital_table().lookup(node)[2]
+
+
+class ShardedRouter:
+    """
+    Nearest-hospital routing over a graph split into regions, one worker
+    process per region holding only that region's roads. The coordinator
+    keeps an overlay of boundary nodes: region-internal boundary-to-boundary
+    distance tables (computed by the workers in parallel) plus the roads
+    crossing between regions. A query combines the origin region's local
+    search with an overlay search and each region's local hospital labels,
+    which is exact because any route splits at its region crossings.
+
+    write_shards() partitions a graph once into a directory of per-region
+    binary graph files plus an overlay file. The router then starts from
+    that directory alone: the coordinator maps the overlay file (boundary
+    nodes, crossing roads, hospitals and a region label per node) and each
+    spawned worker maps only its own region file, so no process ever holds
+    the complete graph.
+    """
+
+    def __init__(self, directory, remove_on_close=False):
+        """Start one worker per region of a directory written by write_shards()"""
+        if sys.byteorder != 'little':
+            raise ValueError("Shard files can only be mapped on little-endian hosts")
+        self.directory = directory
+        self._remove_on_close = remove_on_close
+
+        path = os.path.join(directory, 'overlay.bin')
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, regions, n, crossing, boundary_count, hospital_count,
+         names_size) = SHARD_FILE_HEADER.unpack_from(mapped, 0)
+        if magic != SHARD_FILE_MAGIC:
+            raise ValueError(f"{path} is not a shard overlay file")
+        if version != SHARD_FILE_VERSION:
+            raise ValueError(f"Unsupported shard overlay version {version}")
+
+        view = memoryview(mapped)
+        position = SHARD_FILE_HEADER.size
+
+        def section(typecode, count, itemsize):
+            nonlocal position
+            values = view[position:position + count * itemsize].cast(typecode)
+            position += count * itemsize + (-(count * itemsize) % 8)
+            return values
+
+        # Node ids in ascending order with their regions, for region_of()
+        self._node_ids = section('q', n, 8)
+        self._node_regions = section('B', n, 1)
+        cut_u = section('q', crossing, 8)
+        cut_v = section('q', crossing, 8)
+        cut_weights = section('d', crossing, 8)
+        boundary_nodes = section('q', boundary_count, 8)
+        boundary_regions = section('q', boundary_count, 8)
+        hospital_nodes = section('q', hospital_count, 8)
+        name_offsets = section('q', hospital_count + 1, 8)
+        names = section('B', names_size, 1)
+
+        self.regions = regions
+        self.hospitals = [(node, bytes(names[name_offsets[k]:name_offsets[k + 1]]).decode('utf-8'))
+                          for k, node in enumerate(hospital_nodes)]
+        boundary = [[] for _ in range(regions)]
+        for node, region in zip(boundary_nodes, boundary_regions):
+            boundary[region].append(node)
+        ranks = [[] for _ in range(regions)]
+        for rank, (node, _) in enumerate(self.hospitals):
+            ranks[self.region_of(node)].append(rank)
+
+        import multiprocessing
+
+        # Spawned workers start empty and map just their own region file
+        context = multiprocessing.get_context('spawn')
+        self._results = context.Queue()
+        self._requests = []
+        self._workers = []
+        for region in range(regions):
+            requests = context.Queue()
+            worker = context.Process(
+                target=_shard_worker,
+                args=(os.path.join(directory, f'region-{region}.bin'), region, boundary[region],
+                      ranks[region], requests, self._results),
+                daemon=True)
+            worker.start()
+            self._requests.append(requests)
+            self._workers.append(worker)
+        self._next_request = 0
+
+        # Overlay: boundary node -> [(neighbour, distance, region or -1 for a crossing road)]
+        self.overlay = defaultdict(list)
+        for u, v, weight in zip(cut_u, cut_v, cut_weights):
+            self.overlay[u].append((v, weight, -1))
+            self.overlay[v].append((u, weight, -1))
+        self.hospital_reach = {}
+        for region, (table, reach) in self._gather([(r, ('prepare',)) for r in range(regions)]):
+            for u, row in table.items():
+                self.overlay[u].extend((v, distance, region) for v, distance in row if v != u)
+            self.hospital_reach.update(reach)
+
+    @classmethod
+    def write_shards(cls, csr, hospitals, directory, regions=4):
+        """
+        Partition a CSR graph (such as a memory-mapped binary graph file)
+        into regions and write the directory a ShardedRouter starts from:
+        region-<r>.bin per region, in the binary graph format, and
+        overlay.bin. Node ids must be integers; at most 256 regions.
+        """
+        if not 1 <= regions <= 256:
+            raise ValueError(f"regions must be between 1 and 256, got {regions}")
+        hospitals = list(hospitals)
+        region_of_index = cls.partition(csr, regions)
+        shards, cut_edges = cls._split(csr, region_of_index, hospitals, regions)
+        os.makedirs(directory, exist_ok=True)
+
+        for shard in shards:
+            region_graph = EmergencyHospitalLocator()
+            region_graph._csr = shard.csr
+            region_graph.hospitals = [(node, name) for node, name, _ in shard.hospitals]
+            region_graph.save_graph_binary(os.path.join(directory, f'region-{shard.region}.bin'))
+
+        try:
+            node_ids = array('q', csr.node_ids)
+        except TypeError:
+            raise ValueError("Sharded graphs need integer node ids")
+        order = sorted(range(csr.num_nodes), key=node_ids.__getitem__)
+        boundary = [(node, shard.region) for shard in shards for node in shard.boundary]
+        name_offsets = array('q', [0])
+        names = bytearray()
+        for _, name in hospitals:
+            names += name.encode('utf-8')
+            name_offsets.append(len(names))
+
+        with open(os.path.join(directory, 'overlay.bin'), 'wb') as f:
+            f.write(SHARD_FILE_HEADER.pack(SHARD_FILE_MAGIC, SHARD_FILE_VERSION, regions, csr.num_nodes,
+                                           len(cut_edges), len(boundary), len(hospitals), len(names)))
+            _write_section(f, array('q', (node_ids[i] for i in order)))
+            _write_section(f, bytes(region_of_index[i] for i in order))
+            for column, typecode in enumerate('qqd'):
+                _write_section(f, array(typecode, (edge[column] for edge in cut_edges)))
+            _write_section(f, array('q', (node for node, _ in boundary)))
+            _write_section(f, array('q', (region for _, region in boundary)))
+            _write_section(f, array('q', (node for node, _ in hospitals)))
+            _write_section(f, name_offsets)
+            _write_section(f, bytes(names))
+        return directory
+
+    def region_of(self, node):
+        """Region number of a node id"""
+        i = bisect.bisect_left(self._node_ids, node)
+        if i == len(self._node_ids) or self._node_ids[i] != node:
+            raise KeyError(f"Unknown node {node!r}")
+        return self._node_regions[i]
+
+    @staticmethod
+    def partition(csr, regions):
+        """
+        Region number per node index: recursive bisection at the median
+        coordinate along the wider axis, or contiguous breadth-first order
+        when the graph has no coordinates
+        """
+        n = csr.num_nodes
+        region_of = array('q', [0]) * n
+        if csr.xs is not None:
+            pending = [(list(range(n)), 0, regions)]
+            while pending:
+                nodes, first, count = pending.pop()
+                if count == 1 or not nodes:
+                    for i in nodes:
+                        region_of[i] = first
+                    continue
+                width = max(csr.xs[i] for i in nodes) - min(csr.xs[i] for i in nodes)
+                height = max(csr.ys[i] for i in nodes) - min(csr.ys[i] for i in nodes)
+                coordinate = csr.xs if width >= height else csr.ys
+                nodes.sort(key=coordinate.__getitem__)
+                left = count // 2
+                cut = len(nodes) * left // count
+                pending.append((nodes[:cut], first, left))
+                pending.append((nodes[cut:], first + left, count - left))
+        else:
+            seen = bytearray(n)
+            position = 0
+            for root in range(n):
+                if seen[root]:
+                    continue
+                seen[root] = 1
+                queue = [root]
+                for u in queue:
+                    region_of[u] = position * regions // n
+                    position += 1
+                    for e in range(csr.offsets[u], csr.offsets[u + 1]):
+                        v = csr.targets[e]
+                        if not seen[v]:
+                            seen[v] = 1
+                            queue.append(v)
+        return region_of
+
+    @staticmethod
+    def _split(csr, region_of, hospitals, regions):
+        """Per-region shards plus the (u, v, weight) roads crossing regions"""
+        members = [[] for _ in range(regions)]
+        for i in range(csr.num_nodes):
+            members[region_of[i]].append(i)
+
+        cut_edges = []
+        shards = []
+        for region, nodes in enumerate(members):
+            local = {i: k for k, i in enumerate(nodes)}
+            offsets, targets, weights = array('q', [0]), array('q'), array('d')
+            boundary = []
+            for i in nodes:
+                crossing = False
+                for e in range(csr.offsets[i], csr.offsets[i + 1]):
+                    j = csr.targets[e]
+                    k = local.get(j)
+                    if k is not None:
+                        targets.append(k)
+                        weights.append(csr.weights[e])
+                    else:
+                        crossing = True
+                        if i < j:
+                            cut_edges.append((csr.node_ids[i], csr.node_ids[j], csr.weights[e]))
+                offsets.append(len(targets))
+                if crossing:
+                    boundary.append(csr.node_ids[i])
+
+            xs = ys = None
+            if csr.xs is not None:
+                xs = array('d', (csr.xs[i] for i in nodes))
+                ys = array('d', (csr.ys[i] for i in nodes))
+            shard_csr = CSRGraph([csr.node_ids[i] for i in nodes], offsets, targets, weights, xs, ys,
+                                 geographic=csr.geographic, heuristic_scale=csr.heuristic_scale)
+            shard_hospitals = [(node, name, rank) for rank, (node, name) in enumerate(hospitals)
+                               if region_of[csr.index[node]] == region]
+            shards.append(GraphShard(region, shard_csr, boundary, shard_hospitals))
+        return shards, cut_edges
+
+    def _gather(self, requests):
+        """Send (region, message) requests to the workers; replies in request order"""
+        first = self._next_request
+        for offset, (region, message) in enumerate(requests):
+            self._requests[region].put((first + offset, message))
+        self._next_request += len(requests)
+
+        pending = set(range(first, self._next_request))
+        replies = [None] * len(requests)
+        failure = None
+        while pending:
+            request_id, ok, reply = self._results.get()
+            if request_id not in pending:
+                # Reply to an interrupted earlier call that nobody waits for
+                continue
+            pending.discard(request_id)
+            if ok:
+                replies[request_id - first] = reply
+            elif failure is None:
+                failure = reply
+
+        # Raise only once every reply is in, so none is left queued for the next call
+        if failure is not None:
+            raise RuntimeError(f"Region worker failed: {failure}")
+        return replies
+
+    def find_nearest_hospital(self, origin):
+        """Nearest hospital for one origin; see find_nearest_hospitals"""
+        return self.find_nearest_hospitals([origin])[0]
+
+    def find_nearest_hospitals(self, origins):
+        """
+        Nearest hospital for each origin; local searches for origins in
+        different regions run in parallel on their region workers
+        Returns: one {'nearest_hospital', 'distance', 'path'} dict (or None
+        if no hospital is reachable) per origin
+        """
+        origins = list(origins)
+        searches = self._gather([(self.region_of(origin), ('search', origin)) for origin in origins])
+
+        routes = []
+        for origin, (boundary_distances, local) in zip(origins, searches):
+            routes.append(self._overlay_search(origin, boundary_distances, local))
+
+        # Unpack every route's segments, again fanned out over the workers
+        segments = [part for route in routes if route is not None
+                    for part in route[2] if part[0] is not None]
+        paths = iter(self._gather(segments))
+
+        results = []
+        for route in routes:
+            if route is None:
+                results.append(None)
+                continue
+            distance, rank, parts = route
+            path = []
+            for region, request in parts:
+                part = request if region is None else next(paths)
+                path.extend(part[1:] if path and part and path[-1] == part[0] else part)
+            results.append({
+                'nearest_hospital': self.hospitals[rank],
+                'distance': distance,
+                'path': path
+            })
+        return results
+
+    def _overlay_search(self, origin, boundary_distances, local):
+        """
+        Dijkstra over the boundary overlay seeded with the origin's local
+        boundary distances. Returns (distance, hospital rank, path parts) for
+        the best hospital, or None; a part is a (region, message) worker
+        request, or (None, [u, v]) for a road crossing between regions
+        """
+        region = self.region_of(origin)
+        best = (local[0], local[1], None) if local is not None else (float('infinity'), -1, None)
+
+        dist = {}
+        pred = {}
+        pq = []
+        for node, distance in boundary_distances:
+            dist[node] = distance
+            pred[node] = None
+            pq.append((distance, node))
+        heapq.heapify(pq)
+
+        while pq:
+            current_distance, u = heapq.heappop(pq)
+            if current_distance > best[0]:
+                break
+            if current_distance > dist[u]:
+                continue
+
+            reach = self.hospital_reach.get(u)
+            if reach is not None:
+                candidate = (current_distance + reach[0], reach[1], u)
+                if candidate[:2] < best[:2]:
+                    best = candidate
+
+            for v, weight, via in self.overlay[u]:
+                new_distance = current_distance + weight
+                if new_distance < dist.get(v, float('infinity')):
+                    dist[v] = new_distance
+                    pred[v] = (u, via)
+                    heapq.heappush(pq, (new_distance, v))
+
+        distance, rank, exit_node = best
+        if rank < 0:
+            return None
+        if exit_node is None:
+            return distance, rank, [(region, ('hospital_path', origin))]
+
+        # Walk back to the origin region: region-internal legs are unpacked
+        # by that region's worker, crossing roads are already single steps
+        parts = [(self.region_of(exit_node), ('hospital_path', exit_node))]
+        node = exit_node
+        while pred[node] is not None:
+            previous, via = pred[node]
+            if via < 0:
+                parts.append((None, [previous, node]))
+            else:
+                parts.append((via, ('path', previous, node)))
+            node = previous
+        parts.append((region, ('path', origin, node)))
+        parts.reverse()
+        return distance, rank, parts
+
+    def close(self):
+        """Stop the region workers (and remove the shard files if asked to)"""
+        for requests in self._requests:
+            requests.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        self._requests = []
+        if self._remove_on_close:
+            import shutil
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self._remove_on_close = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class EmergencyHospitalLocator:
+    def __init__(self, route_cache_bytes=8 * 1024 * 1024, instrument=False):
+        self._graph = None
+        self.person_location = None
+        self.hospitals = []
+        # Hospital node -> live load: {'capacity': free beds, 'wait_time': minutes}
+        self.hospital_status = {}
+        self.all_locations = []
+        self._distances = {}
+        self._shortest_paths = {}
+        # find_nearest_hospital arguments whose search tree a route cache hit
+        # skipped; rebuilt when distances / shortest_paths are next read
+        self._pending_tree = None
+        self._csr = None
+        self._hospital_table = None
+        self._ch = None
+        self._ch_buckets = None
+        # Root of self.distances / self.shortest_paths when they hold a
+        # complete tree that update_edge keeps repaired, else None
+        self._tree_root = None
+        self._tree_children = defaultdict(set)
+        self._closed_roads = {}
+        self._graph_file = None
+        # CSR index -> location name, for graphs kept without networkx
+        self._node_names = None
+        # (graph version, positions) and ((graph version, fast), figure)
+        self._layout = None
+        self._base_map = None
+        self._path_layer = None
+        self._spatial_index = None
+        # Profile id per CSR edge, and hour -> nearest-hospital table
+        self._edge_profiles = None
+        self._hourly_tables = {}
+        self.travel_time_profiles = TravelTimeProfiles.default()
+        # Bumped by every graph or hospital change; part of every cache key
+        self.graph_version = 0
+        self.route_cache = RouteCache(route_cache_bytes)
+        # QueryMetrics when instrumented; stats of the latest search for it
+        self.metrics = QueryMetrics() if instrument else None
+        self._search_stats = None
+        # 'planar' (x/y in km) or 'latlon' (x = longitude, y = latitude)
+        self.coordinate_system = 'planar'
+        
+    @property
+    def graph(self):
+        """
+        The networkx road graph, created (importing networkx) on first use.
+        Graphs loaded with build_networkx=False only have the CSR snapshot;
+        for those this raises ValueError rather than hand out an empty graph.
+        """
+        if self._graph is None:
+            if self._csr is not None:
+                raise ValueError("This road network was loaded without a networkx graph; "
+                                 "reload it with build_networkx=True")
+            import networkx as nx
+            self._graph = nx.Graph()
+        return self._graph
+
+    @graph.setter
+    def graph(self, graph):
+        self._graph = graph
+
+    @property
+    def distances(self):
+        """
+        Node -> distance from the last find_nearest_hospital search (only
+        the nodes it settled) or from compute_shortest_path_tree
+        """
+        if self._pending_tree is not None:
+            self._restore_tree()
+        return self._distances
+
+    @distances.setter
+    def distances(self, distances):
+        self._distances = distances
+        self._pending_tree = None
+
+    @property
+    def shortest_paths(self):
+        """Node -> previous node on its route, for the same search as distances"""
+        if self._pending_tree is not None:
+            self._restore_tree()
+        return self._shortest_paths
+
+    @shortest_paths.setter
+    def shortest_paths(self, shortest_paths):
+        self._shortest_paths = shortest_paths
+        self._pending_tree = None
+
+    def _restore_tree(self):
+        """Repeat the search a route cache hit answered, for its tree"""
+        person_node, all_distances, method, seeds = self._pending_tree
+        self._pending_tree = None
+        self._find_nearest_hospital(person_node, all_distances, method, seeds)
+
+    def invalidate_graph_caches(self):
+        """Drop compiled snapshots; call after editing self.graph directly"""
+        # Without a networkx graph the CSR is the only copy of the roads
+        if self._graph is not None:
+            self._csr = None
+        self._tree_root = None
+        self._drop_derived_caches()
+    
+    def _drop_derived_caches(self):
+        """Drop everything precomputed from edge weights except the CSR itself"""
+        self.graph_version += 1
+        self._hospital_table = None
+        self._ch = None
+        self._ch_buckets = None
+        self._edge_profiles = None
+        self._hourly_tables = {}
+    
+    def get_csr(self):
+        """Return the CSR snapshot of the graph, compiling it on first use"""
+        if self._csr is None:
+            started = time.perf_counter()
+            self._csr = CSRGraph.from_networkx(self.graph,
+                                               geographic=self.coordinate_system == 'latlon')
+            if self.metrics is not None:
+                self.metrics.add_phase('graph', 'compile_csr', time.perf_counter() - started)
+        return self._csr
+
+    def enable_metrics(self, keep_slowest=10):
+        """Start instrumenting queries; returns the QueryMetrics collector"""
+        self.metrics = QueryMetrics(keep_slowest)
+        return self.metrics
+
+    def disable_metrics(self):
+        self.metrics = None
+
+    def metrics_text(self):
+        """Collected query metrics in Prometheus text format ('' if disabled)"""
+        return self.metrics.to_prometheus() if self.metrics is not None else ''
+        
+    def generate_city_graph(self, num_hospitals, complexity):
+        """Generate a realistic city-like graph with roads and locations"""
+        import networkx as nx
+
+        self.graph = nx.Graph()
+        self._node_names = None
+        self.hospitals = []
+        self.hospital_status = {}
+        self.all_locations = []
+        self._closed_roads = {}
+        self.invalidate_graph_caches()
+        
+        # Define complexity parameters
+        complexity_params = {
+            'simple': {'nodes': 8, 'connections': 12},
+            'medium': {'nodes': 12, 'connections': 18},
+            'complex': {'nodes': 16, 'connections': 25}
+        }
+        
+        total_nodes = complexity_params[complexity]['nodes']
+        total_connections = complexity_params[complexity]['connections']
+        
+        # Generate location names
+        location_names = [
+            'Central Square', 'Park Avenue', 'Main Street', 'Downtown',
+            'Riverside', 'Hillview', 'Market Place', 'University Area',
+            'Industrial Zone', 'Residential Area', 'Shopping Mall', 'Airport Road',
+            'Business District', 'Old Town', 'New City', 'Suburb'
+        ]
+        
+        hospital_names = [
+            'City General Hospital', 'Emergency Medical Center', 'St. Mary Hospital',
+            'Regional Medical Center', 'Community Hospital', 'Trauma Center'
+        ]
+        
+        # Create nodes, scattered over a 9 km x 9 km city
+        self.coordinate_system = 'planar'
+        for i in range(total_nodes):
+            location_name = location_names[i % len(location_names)]
+            self.graph.add_node(i, name=location_name, type='location',
+                                x=round(random.uniform(0.0, 9.0), 2),
+                                y=round(random.uniform(0.0, 9.0), 2))
+            self.all_locations.append((i, location_name))
+        
+        # Designate hospitals
+        hospital_indices = random.sample(range(1, total_nodes), num_hospitals)
+        for i, hospital_idx in enumerate(hospital_indices):
+            hospital_name = hospital_names[i % len(hospital_names)]
+            self.graph.nodes[hospital_idx]['name'] = hospital_name
+            self.graph.nodes[hospital_idx]['type'] = 'hospital'
+            self.hospitals.append((hospital_idx, hospital_name))
+        
+        # Set person location (always at node 0)
+        self.person_location = (0, 'Your Location')
+        self.graph.nodes[0]['name'] = 'Your Location'
+        self.graph.nodes[0]['type'] = 'person'
+        
+        # Create realistic road connections with distances
+        edges_added = 0
+        attempts = 0
+        max_attempts = total_connections * 3
+        
+        while edges_added < total_connections and attempts < max_attempts:
+            node1 = random.randint(0, total_nodes - 1)
+            node2 = random.randint(0, total_nodes - 1)
+            
+            if node1 != node2 and not self.graph.has_edge(node1, node2):
+                self.graph.add_edge(node1, node2, weight=self._road_length(node1, node2))
+                edges_added += 1
+            
+            attempts += 1
+        
+        # Ensure all nodes are connected (especially hospitals)
+        if not nx.is_connected(self.graph):
+            components = list(nx.connected_components(self.graph))
+            for i in range(len(components) - 1):
+                node1 = random.choice(list(components[i]))
+                node2 = random.choice(list(components[i + 1]))
+                self.graph.add_edge(node1, node2, weight=self._road_length(node1, node2))
+        
+        # Long roads are the arterials that jam at rush hour
+        for node1, node2, data in self.graph.edges(data=True):
+            data['profile'] = 'arterial' if data['weight'] >= ARTERIAL_ROAD_KM else 'residential'
+
+    def generate_synthetic_city(self, num_nodes, hospital_density=0.001, seed=0, layout='planar',
+                                block_km=0.25, build_networkx=False):
+        """
+        Deterministic large road network for benchmarking, built in linear
+        time straight into the CSR arrays (node ids 0..num_nodes-1)
+        layout='grid': a Manhattan street grid with ~10% of blocks missing
+        layout='planar': jittered intersections with random block diagonals
+        Roads are the straight line stretched by a 0-20% detour. Column 0
+        keeps every road to the next row and every other node keeps its road
+        to the left or to the row above, so the network is always connected.
+        hospital_density is the fraction of nodes that are hospitals.
+        """
+        if layout not in ('grid', 'planar'):
+            raise ValueError(f"Unknown layout {layout!r}")
+        rng = random.Random(seed)
+        uniform, chance = rng.uniform, rng.random
+        n = num_nodes
+        side = max(1, math.ceil(math.sqrt(n)))
+        jitter = 0.3 * block_km if layout == 'planar' else 0.0
+
+        xs = array('d', [0.0]) * n
+        ys = array('d', [0.0]) * n
+        for i in range(n):
+            row, column = divmod(i, side)
+            xs[i] = column * block_km + (uniform(-jitter, jitter) if jitter else 0.0)
+            ys[i] = row * block_km + (uniform(-jitter, jitter) if jitter else 0.0)
+
+        sources = array('q')
+        targets = array('q')
+        weights = array('d')
+
+        def road(u, v):
+            sources.append(u)
+            targets.append(v)
+            weights.append(math.hypot(xs[u] - xs[v], ys[u] - ys[v]) * uniform(1.0, 1.2))
+
+        # up[i]: node i has its road to the row above (decided before i's left road)
+        up = bytearray(n)
+        for i in range(n):
+            column = i % side
+            if column + 1 < side and i + 1 < n and (chance() < 0.95 or not up[i + 1]):
+                road(i, i + 1)
+            below = i + side
+            if below < n:
+                if column == 0 or chance() < 0.9:
+                    road(i, below)
+                    up[below] = 1
+                if layout == 'planar' and column + 1 < side and below + 1 < n and chance() < 0.3:
+                    # One diagonal per block keeps the network planar
+                    if chance() < 0.5:
+                        road(i, below + 1)
+                    else:
+                        road(i + 1, below)
+
+        csr = CSRGraph.from_edge_arrays(range(n), sources, targets, weights, xs, ys,
+                                        index=_IdentityIndex(n))
+
+        # The caller stands at the centre, which is never a hospital
+        center = min(n - 1, (n // side // 2) * side + side // 2)
+        num_hospitals = min(n - 1, max(1, round(n * hospital_density)))
+        hospital_nodes = sorted(k if k < center else k + 1 for k in rng.sample(range(n - 1), num_hospitals))
+        hospitals = [(node, f"Hospital {k + 1}") for k, node in enumerate(hospital_nodes)]
+
+        graph = None
+        if build_networkx:
+            import networkx as nx
+            graph = nx.Graph()
+            for i in range(n):
+                graph.add_node(i, name=f"Intersection {i}", type='location', x=xs[i], y=ys[i])
+            for node, name in hospitals:
+                graph.nodes[node].update(name=name, type='hospital')
+            graph.nodes[center].update(name='Your Location', type='person')
+            graph.add_weighted_edges_from(zip(sources, targets, weights))
+
+        self.graph = graph
+        self._node_names = None if graph is not None else (lambda i: f"Intersection {i}")
+        self.hospitals = hospitals
+        self.hospital_status = {}
+        self.all_locations = []
+        self.coordinate_system = 'planar'
+        self._closed_roads = {}
+        self.person_location = (center, 'Your Location')
+        self.invalidate_graph_caches()
+        self._csr = csr
+
+    def load_road_network(self, edges_path, hospitals_path=None, nodes_path=None,
+                          chunk_size=100_000, build_networkx=True, coordinate_system='planar',
+                          trace_memory=False):
+        """
+        Stream a real road network from disk in chunks of rows
+        edges: source,target,weight (header and weight column optional)
+        nodes: id,name,x,y  hospitals: id,name[,capacity,wait_time]
+        Fills the compact CSR arrays directly, and the networkx graph too
+        unless build_networkx is False. Duplicate roads are skipped when the
+        networkx graph is built; self-loops are always skipped. Nodes with
+        no row in the nodes file are named by their id, and the caller
+        starts at the first node that is not a hospital.
+        trace_memory=True also measures the peak Python heap with tracemalloc,
+        which makes loading several times slower.
+        Returns: dictionary of load statistics (counts, seconds, peak memory)
+        """
+        started = time.perf_counter()
+        tracing = trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+
+        graph = None
+        if build_networkx:
+            import networkx as nx
+            graph = nx.Graph()
+        node_ids = []
+        index = {}
+        xs = array('d')
+        ys = array('d')
+        names = {}
+
+        def node_index(node):
+            i = index.get(node)
+            if i is None:
+                i = index[node] = len(node_ids)
+                node_ids.append(node)
+                xs.append(float('nan'))
+                ys.append(float('nan'))
+                # Nodes missing from the nodes file are named by their id
+                if graph is not None:
+                    graph.add_node(node, name=str(node), type='location')
+            return i
+
+        if nodes_path:
+            header, chunks = _read_table_chunks(nodes_path, chunk_size)
+            id_col = _column(header, ('id', 'node'), 0)
+            name_col = _column(header, ('name',), None)
+            x_col = _column(header, ('x', 'lon'), None)
+            y_col = _column(header, ('y', 'lat'), None)
+            for chunk in chunks:
+                for row in chunk:
+                    node = _parse_node_id(row[id_col])
+                    i = node_index(node)
+                    attributes = {'type': 'location',
+                                  'name': row[name_col] if name_col is not None else str(node)}
+                    if x_col is not None and y_col is not None:
+                        xs[i] = attributes['x'] = float(row[x_col])
+                        ys[i] = attributes['y'] = float(row[y_col])
+                    if graph is not None:
+                        graph.add_node(node, **attributes)
+                    else:
+                        names[i] = attributes['name']
+
+        sources = array('q')
+        targets = array('q')
+        weights = array('d')
+        skipped = 0
+        header, chunks = _read_table_chunks(edges_path, chunk_size)
+        source_col = _column(header, EDGE_SOURCE_COLUMNS, 0)
+        target_col = _column(header, EDGE_TARGET_COLUMNS, 1)
+        weight_col = _column(header, EDGE_WEIGHT_COLUMNS, None if header else 2)
+        for chunk in chunks:
+            for row in chunk:
+                u = _parse_node_id(row[source_col])
+                v = _parse_node_id(row[target_col])
+                weight = float(row[weight_col]) if weight_col is not None and weight_col < len(row) else 1.0
+                if u == v or (graph is not None and graph.has_edge(u, v)):
+                    skipped += 1
+                    continue
+                sources.append(node_index(u))
+                targets.append(node_index(v))
+                weights.append(weight)
+                if graph is not None:
+                    graph.add_edge(u, v, weight=weight)
+
+        hospitals = []
+        hospital_status = {}
+        if hospitals_path:
+            header, chunks = _read_table_chunks(hospitals_path, chunk_size)
+            id_col = _column(header, ('id', 'node'), 0)
+            name_col = _column(header, ('name',), 1)
+            capacity_col = _column(header, ('capacity',), None)
+            wait_col = _column(header, ('wait_time', 'wait'), None)
+            for chunk in chunks:
+                for row in chunk:
+                    node = _parse_node_id(row[id_col])
+                    name = row[name_col] if name_col < len(row) else str(node)
+                    node_index(node)
+                    hospitals.append((node, name))
+                    if graph is not None:
+                        graph.add_node(node)
+                        graph.nodes[node].update(name=name, type='hospital')
+                    status = {}
+                    if capacity_col is not None and capacity_col < len(row) and row[capacity_col]:
+                        status['capacity'] = int(row[capacity_col])
+                    if wait_col is not None and wait_col < len(row) and row[wait_col]:
+                        status['wait_time'] = float(row[wait_col])
+                    if status:
+                        hospital_status[node] = status
+
+        # Coordinates are only usable if every node has them
+        if any(math.isnan(x) for x in xs):
+            xs = ys = None
+
+        csr = CSRGraph.from_edge_arrays(node_ids, sources, targets, weights, xs, ys,
+                                        geographic=coordinate_system == 'latlon', index=index)
+
+        # The caller starts at the first node that is not a hospital
+        hospital_nodes = {node for node, _ in hospitals}
+        person = next((node for node in node_ids if node not in hospital_nodes), None)
+        if graph is not None and person is not None:
+            graph.nodes[person].update(name='Your Location', type='person')
+
+        self.graph = graph
+        self._node_names = None if graph is not None else (lambda i: names.get(i, str(node_ids[i])))
+        self.hospitals = hospitals
+        self.hospital_status = hospital_status
+        self.all_locations = []
+        self.coordinate_system = coordinate_system
+        self._closed_roads = {}
+        self.person_location = (person, 'Your Location') if person is not None else None
+        self.invalidate_graph_caches()
+        self._csr = csr
+
+        peak = None
+        if tracing:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        return {
+            'nodes': csr.num_nodes,
+            'edges': len(sources),
+            'skipped_edges': skipped,
+            'hospitals': len(hospitals),
+            'load_seconds': time.perf_counter() - started,
+            'peak_rss_bytes': _peak_rss_bytes(),
+            'peak_memory_bytes': peak
+        }
+    
+    def save_graph_binary(self, path):
+        """
+        Write the graph in the versioned binary format (node ids, types,
+        names, coordinates, CSR adjacency, weights, hospitals with their
+        status, travel-time profiles and each road's profile)
+        """
+        csr = self.get_csr()
+        n = csr.num_nodes
+        try:
+            node_ids = array('q', csr.node_ids)
+        except TypeError:
+            raise ValueError("The binary graph format needs integer node ids")
+
+        hospital_names = dict(self.hospitals)
+        person = self.person_location[0] if self.person_location else None
+        node_data = self._graph.nodes if self._graph is not None else {}
+
+        types = bytearray(n)
+        name_offsets = array('q', [0])
+        names = bytearray()
+        for i, node in enumerate(csr.node_ids):
+            data = node_data[node] if node in node_data else {}
+            if node == person:
+                node_type, name = 'person', self.person_location[1]
+            elif node in hospital_names:
+                node_type, name = 'hospital', hospital_names[node]
+            elif self._node_names is not None:
+                node_type, name = 'location', self._node_names(i)
+            else:
+                node_type, name = data.get('type', 'location'), data.get('name', '')
+            types[i] = NODE_TYPES.index(node_type)
+            names += name.encode('utf-8')
+            name_offsets.append(len(names))
+
+        flags = 0
+        if csr.xs is not None:
+            flags |= GRAPH_FLAG_COORDINATES
+        if csr.geographic:
+            flags |= GRAPH_FLAG_GEOGRAPHIC
+        if all(node == i for i, node in enumerate(node_ids)):
+            flags |= GRAPH_FLAG_IDENTITY_IDS
+
+        hospitals = array('q', (csr.index[node] for node, _ in self.hospitals))
+        status = [self.hospital_status.get(node, {}) for node, _ in self.hospitals]
+        capacities = array('q', (s.get('capacity', -1) for s in status))
+        wait_times = array('d', (s.get('wait_time', float('nan')) for s in status))
+
+        profiles = self.travel_time_profiles
+        if len(profiles.names) > 256:
+            raise ValueError("The binary graph format stores at most 256 travel-time profiles")
+        profile_name_offsets = array('q', [0])
+        profile_names = bytearray()
+        for name in profiles.names:
+            profile_names += name.encode('utf-8')
+            profile_name_offsets.append(len(profile_names))
+        edge_profiles = array('B', self.get_edge_profiles())
+
+        with open(path, 'wb') as f:
+            f.write(GRAPH_FILE_HEADER.pack(
+                GRAPH_FILE_MAGIC, GRAPH_FILE_VERSION, flags, n, len(csr.targets),
+                len(hospitals), len(names), csr.index[person] if person is not None else -1,
+                csr.heuristic_scale if csr.heuristic_scale is not None else float('nan')))
+            f.write(GRAPH_FILE_PROFILE_HEADER.pack(len(profiles.names), len(profile_names),
+                                                   len(profiles.times)))
+            for section in (node_ids, bytes(types), name_offsets, bytes(names)):
+                _write_section(f, section)
+            if csr.xs is not None:
+                _write_section(f, array('d', csr.xs))
+                _write_section(f, array('d', csr.ys))
+            _write_section(f, array('q', csr.offsets))
+            _write_section(f, array('q', csr.targets))
+            _write_section(f, array('d', csr.weights))
+            _write_section(f, hospitals)
+            _write_section(f, capacities)
+            _write_section(f, wait_times)
+            _write_section(f, profile_name_offsets)
+            _write_section(f, bytes(profile_names))
+            _write_section(f, array('q', profiles.offsets))
+            _write_section(f, array('d', profiles.times))
+            _write_section(f, array('d', profiles.paces))
+            _write_section(f, edge_profiles)
+    
+    def load_graph_binary(self, path, build_networkx=False):
+        """
+        Memory-map a graph written by save_graph_binary. The CSR arrays are
+        zero-copy views of the page cache, shared by every process mapping
+        the same file; the networkx graph is only built if requested.
+        """
+        if sys.byteorder != 'little':
+            raise ValueError("Binary graph files can only be mapped on little-endian hosts")
+
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, flags, n, adjacency, hospital_count,
+         names_size, person, heuristic_scale) = GRAPH_FILE_HEADER.unpack_from(mapped, 0)
+        if magic != GRAPH_FILE_MAGIC:
+            raise ValueError(f"{path} is not a binary graph file")
+        if version not in (1, GRAPH_FILE_VERSION):
+            raise ValueError(f"Unsupported binary graph version {version}")
+
+        view = memoryview(mapped)
+        position = GRAPH_FILE_HEADER.size
+        if version >= 2:
+            profile_count, profile_names_size, breakpoint_count = \
+                GRAPH_FILE_PROFILE_HEADER.unpack_from(mapped, position)
+            position += GRAPH_FILE_PROFILE_HEADER.size
+
+        def section(typecode, count, itemsize):
+            nonlocal position
+            values = view[position:position + count * itemsize].cast(typecode)
+            position += count * itemsize + (-(count * itemsize) % 8)
+            return values
+
+        node_ids = section('q', n, 8)
+        types = section('B', n, 1)
+        name_offsets = section('q', n + 1, 8)
+        names = section('B', names_size, 1)
+        xs = ys = None
+        if flags & GRAPH_FLAG_COORDINATES:
+            xs = section('d', n, 8)
+            ys = section('d', n, 8)
+        offsets = section('q', n + 1, 8)
+        targets = section('q', adjacency, 8)
+        weights = section('d', adjacency, 8)
+        hospitals = section('q', hospital_count, 8)
+
+        def name_of(i):
+            return bytes(names[name_offsets[i]:name_offsets[i + 1]]).decode('utf-8')
+
+        if flags & GRAPH_FLAG_IDENTITY_IDS:
+            ids, index = range(n), _IdentityIndex(n)
+        else:
+            ids, index = node_ids.tolist(), None
+
+        # Version 1 files predate hospital status and road profiles
+        hospital_status = {}
+        profiles = TravelTimeProfiles.default()
+        edge_profiles = None
+        if version >= 2:
+            capacities = section('q', hospital_count, 8)
+            wait_times = section('d', hospital_count, 8)
+            profile_name_offsets = section('q', profile_count + 1, 8)
+            profile_names = section('B', profile_names_size, 1)
+            breakpoint_offsets = section('q', profile_count + 1, 8)
+            times = section('d', breakpoint_count, 8)
+            paces = section('d', breakpoint_count, 8)
+            edge_profiles = section('B', adjacency, 1)
+
+            for i, h in enumerate(hospitals):
+                status = {}
+                if capacities[i] >= 0:
+                    status['capacity'] = capacities[i]
+                if not math.isnan(wait_times[i]):
+                    status['wait_time'] = wait_times[i]
+                if status:
+                    hospital_status[ids[h]] = status
+
+            profiles = TravelTimeProfiles()
+            for p in range(profile_count):
+                name = bytes(profile_names[profile_name_offsets[p]:profile_name_offsets[p + 1]])
+                first, end = breakpoint_offsets[p], breakpoint_offsets[p + 1]
+                profiles.add(name.decode('utf-8'), zip(times[first:end], paces[first:end]))
+
+        csr = CSRGraph(ids, offsets, targets, weights, xs, ys,
+                       geographic=bool(flags & GRAPH_FLAG_GEOGRAPHIC), index=index,
+                       heuristic_scale=None if math.isnan(heuristic_scale) else heuristic_scale)
+
+        graph = None
+        if build_networkx:
+            import networkx as nx
+            graph = nx.Graph()
+            for i in range(n):
+                attributes = {'name': name_of(i), 'type': NODE_TYPES[types[i]]}
+                if xs is not None:
+                    attributes['x'], attributes['y'] = xs[i], ys[i]
+                graph.add_node(ids[i], **attributes)
+            free = profiles.index.get('free')
+            for u in range(n):
+                for e in range(offsets[u], offsets[u + 1]):
+                    graph.add_edge(ids[u], ids[targets[e]], weight=weights[e])
+                    if edge_profiles is not None and edge_profiles[e] != free:
+                        graph[ids[u]][ids[targets[e]]]['profile'] = profiles.names[edge_profiles[e]]
+        else:
+            # Without networkx the CSR carries the road profiles itself
+            csr.edge_profiles = edge_profiles
+
+        self.graph = graph
+        self._node_names = None if graph is not None else name_of
+        self.hospitals = [(ids[i], name_of(i)) for i in hospitals]
+        self.hospital_status = hospital_status
+        self.travel_time_profiles = profiles
+        self.all_locations = []
+        self.coordinate_system = 'latlon' if flags & GRAPH_FLAG_GEOGRAPHIC else 'planar'
+        self._closed_roads = {}
+        self.person_location = (ids[person], name_of(person)) if person >= 0 else None
+        self.invalidate_graph_caches()
+        self._csr = csr
+        self._graph_file = mapped
+    
+    def get_nearest_hospital_table(self):
+        """Return the nearest-hospital table, rebuilding it if hospitals changed"""
+        hospital_nodes = tuple(node for node, _ in self.hospitals)
+        table = self._hospital_table
+        if table is None or table.csr is not self.get_csr() or table.hospital_nodes != hospital_nodes:
+            table = self._hospital_table = NearestHospitalTable(self.get_csr(), self.hospitals)
+        return table
+    
+    def add_hospital(self, node, name):
+        """Turn an existing location into a hospital, patching the lookup table"""
+        if node not in self.get_csr().index:
+            raise KeyError(f"Unknown node {node!r}")
+        table = self.get_nearest_hospital_table() if self._hospital_table is not None else None
+        if self._graph is not None:
+            self._graph.nodes[node]['name'] = name
+            self._graph.nodes[node]['type'] = 'hospital'
+        self.hospitals.append((node, name))
+        self.graph_version += 1
+        if table is not None:
+            table.add_hospital(node, name)
+    
+    def remove_hospital(self, node):
+        """Turn a hospital back into a plain location"""
+        if node not in self.get_csr().index:
+            raise KeyError(f"Unknown node {node!r}")
+        self.hospitals = [(h, name) for h, name in self.hospitals if h != node]
+        self.hospital_status.pop(node, None)
+        if self._graph is not None:
+            self._graph.nodes[node]['type'] = 'location'
+        self._hospital_table = None
+        self.graph_version += 1
+    
+    def lookup_nearest_hospital(self, node=None):
+        """
+        Nearest hospital for a node from the precomputed table
+        O(1) label lookup plus a walk along the stored next hops
+        """
+        if node is None:
+            node = self.person_location[0]
+
+        entry = self.get_nearest_hospital_table().lookup(node)
+        if entry is None:
+            return None
+
+        nearest_hospital, distance, path = entry
+        return {
+            'nearest_hospital': nearest_hospital,
+            'distance': distance,
+            'path': path
+        }
+    
+    def _road_length(self, node1, node2):
+        """
+        Generate realistic distance (1-15 km): the straight line between the
+        two locations stretched by a random 10-50% detour
+        """
+        a, b = self.graph.nodes[node1], self.graph.nodes[node2]
+        straight = math.hypot(a['x'] - b['x'], a['y'] - b['y'])
+        return round(min(max(straight * random.uniform(1.1, 1.5), 1.0), 15.0), 1)
+    
+    def dijkstra_algorithm(self, start_node):
+        """
+        Implement Dijkstra's Algorithm to find shortest paths
+        Runs on the compiled CSR snapshot of the graph
+        Returns: distances dictionary and previous nodes dictionary
+        """
+        csr = self.get_csr()
+        if self.metrics is None:
+            dist, pred, _ = csr.dijkstra(csr.index[start_node])
+            return csr.to_dicts(dist, pred)
+
+        started = time.perf_counter()
+        stats = {}
+        dist, pred, _ = csr.dijkstra(csr.index[start_node], stats=stats)
+        searched = time.perf_counter()
+        result = csr.to_dicts(dist, pred)
+        finished = time.perf_counter()
+        stats['phases'] = {'search': searched - started, 'to_dicts': finished - searched}
+        self.metrics.record('dijkstra_algorithm', finished - started, stats, origin=start_node)
+        return result
+    
+    def dijkstra_search(self, start_node, targets, stop_at='any', seeds=None):
+        """
+        Target-aware Dijkstra that stops once 'any' or 'all' targets are settled
+        seeds: (node, starting distance) pairs to search from instead of start_node
+        Returns: distances and previous nodes for the settled nodes only,
+        plus the number of nodes visited
+        """
+        csr = self.get_csr()
+        index = csr.index
+        source = index[start_node] if seeds is None else [(index[node], d) for node, d in seeds]
+        stats = {} if self.metrics is not None else None
+        started = time.perf_counter()
+        dist, pred, order = csr.dijkstra(source,
+                                         targets=[index[t] for t in targets],
+                                         stop_at=stop_at, stats=stats)
+        searched = time.perf_counter()
+        distances, previous = csr.to_dicts(dist, pred, order)
+        if stats is not None:
+            stats['phases'] = {'search': searched - started, 'to_dicts': time.perf_counter() - searched}
+            self._search_stats = stats
+        return distances, previous, len(order)
+    
+    def bidirectional_search(self, start_node, target_node):
+        """
+        Bidirectional point-to-point Dijkstra
+        Returns: distance, previous nodes along the path (for get_shortest_path)
+        and the number of nodes visited from both ends
+        """
+        csr = self.get_csr()
+        distance, path, visited = csr.bidirectional_dijkstra(csr.index[start_node],
+                                                             csr.index[target_node])
+        node_ids = csr.node_ids
+        previous = {start_node: None}
+        for a, b in zip(path, path[1:]):
+            previous[node_ids[b]] = node_ids[a]
+        return distance, previous, visited
+    
+    def a_star_search(self, start_node, target_node):
+        """
+        A* search using the straight-line distance between node coordinates
+        Returns: distances and previous nodes for the settled nodes only,
+        plus the number of nodes visited
+        """
+        csr = self.get_csr()
+        dist, pred, order = csr.a_star(csr.index[start_node], csr.index[target_node])
+        distances, previous = csr.to_dicts(dist, pred, order)
+        return distances, previous, len(order)
+    
+    def prepare_contraction_hierarchy(self, path=None):
+        """
+        Load (memory-map) the contraction hierarchy from path if it was built
+        for this exact graph, otherwise build it (and save it to path when
+        given); call at startup so the first method='ch' query does not
+        pay for the build
+        """
+        csr = self.get_csr()
+        # Graph changes drop self._ch, so one built for this CSR is current;
+        # the fingerprint is only needed to validate a file
+        if self._ch is not None and self._ch[0] is csr:
+            return self._ch[1]
+
+        ch = None
+        if path and os.path.exists(path):
+            ch = ContractionHierarchy.load(path)
+            if ch is not None and ch.fingerprint != csr.fingerprint():
+                ch = None
+
+        if ch is None:
+            ch = ContractionHierarchy.build(csr)
+            if path:
+                ch.save(path)
+
+        self._ch = (csr, ch)
+        self._ch_buckets = None
+        return ch
+    
+    def ch_search(self, start_node, target_node):
+        """
+        Point-to-point query on the contraction hierarchy
+        Returns: distance, previous nodes along the unpacked road path
+        (for get_shortest_path) and the number of nodes visited
+        """
+        csr = self.get_csr()
+        ch = self.prepare_contraction_hierarchy()
+        distance, path, visited = ch.query(csr.index[start_node], csr.index[target_node])
+        node_ids = csr.node_ids
+        previous = {start_node: None}
+        for a, b in zip(path, path[1:]):
+            previous[node_ids[b]] = node_ids[a]
+        return distance, previous, visited
+    
+    def _ch_hospital_buckets(self):
+        """Upward search spaces of every hospital: index -> [(distance, rank)]"""
+        hospital_nodes = tuple(node for node, _ in self.hospitals)
+        if self._ch_buckets is None or self._ch_buckets[0] != hospital_nodes:
+            ch = self.prepare_contraction_hierarchy()
+            index = self.get_csr().index
+            buckets = defaultdict(list)
+            for rank, node in enumerate(hospital_nodes):
+                for v, d in ch.upward_search(index[node]).items():
+                    buckets[v].append((d, rank))
+            self._ch_buckets = (hospital_nodes, buckets)
+        return self._ch_buckets[1]
+    
+    def route_to_hospital(self, hospital_node, origin=None, method='bidirectional'):
+        """Shortest route to one chosen hospital ('bidirectional', 'astar' or 'ch')"""
+        if origin is None:
+            origin = self.person_location[0]
+
+        if method == 'astar':
+            distances, previous, visited = self.a_star_search(origin, hospital_node)
+            distance = distances.get(hospital_node, float('infinity'))
+        elif method == 'ch':
+            distance, previous, visited = self.ch_search(origin, hospital_node)
+        else:
+            distance, previous, visited = self.bidirectional_search(origin, hospital_node)
+
+        if hospital_node not in previous:
+            return None
+
+        return {
+            'hospital': (hospital_node, dict(self.hospitals).get(hospital_node)),
+            'distance': distance,
+            'path': self.get_shortest_path(previous, origin, hospital_node),
+            'visited_nodes': visited
+        }
+    
+    def _ch_nearest_hospital_search(self, start_node):
+        """
+        Hospital distances from one upward search matched against the
+        hospitals' precomputed upward search spaces, plus the unpacked path
+        to the nearest one. Returns the same triple as dijkstra_search.
+        """
+        csr = self.get_csr()
+        ch = self.prepare_contraction_hierarchy()
+        buckets = self._ch_hospital_buckets()
+        forward = ch.upward_search(csr.index[start_node])
+
+        best = [float('infinity')] * len(self.hospitals)
+        for v, d in forward.items():
+            for hospital_distance, rank in buckets.get(v, ()):
+                if d + hospital_distance < best[rank]:
+                    best[rank] = d + hospital_distance
+
+        distances = {node: d for (node, _), d in zip(self.hospitals, best)
+                     if d < float('infinity')}
+        previous = {start_node: None}
+        visited = len(forward)
+        if distances:
+            nearest = min(distances, key=distances.get)
+            _, path_previous, path_visited = self.ch_search(start_node, nearest)
+            previous.update(path_previous)
+            visited += path_visited
+        return distances, previous, visited
+    
+    def get_shortest_path(self, previous, start, end):
+        """
+        Reconstruct shortest path from previous nodes dictionary
+        start=None accepts any root (searches started from several seeds)
+        """
+        path = []
+        current = end
+        
+        while current is not None:
+            path.append(current)
+            current = previous[current]
+        
+        path.reverse()
+        return path if start is None or path[0] == start else []
+    
+    def find_nearest_hospital(self, all_distances=True, method='dijkstra', origin=None, seeds=None):
+        """
+        Find the nearest hospital using Dijkstra's algorithm
+        The search stops once every hospital is settled, or the first one
+        when all_distances is False (the table then lists only that hospital).
+        method='ch' answers from the contraction hierarchy instead.
+        origin defaults to the person's location; seeds, (node, distance)
+        pairs such as both ends of a road, replace it as the search start.
+        Results are served from the route cache while the graph is unchanged;
+        treat them as read-only. A cache hit leaves self.distances and
+        self.shortest_paths to be recomputed on their next read, so they
+        still describe the latest query.
+        """
+        if seeds is not None:
+            seeds = tuple(seeds)
+            person_node = seeds
+        else:
+            person_node = self.person_location[0] if origin is None else origin
+        started = time.perf_counter()
+        
+        cache_key = (self.graph_version, person_node, tuple(self.hospitals), all_distances, method)
+        hit, result = self.route_cache.get(cache_key)
+        if hit:
+            # Unless the maintained tree answered it, the search tree belongs
+            # to this query again: rebuild it only if someone reads it
+            answered_by_tree = seeds is None and method != 'ch' and self._tree_root == person_node
+            if result is not None and not answered_by_tree:
+                self._pending_tree = (person_node, all_distances, method, seeds)
+                self._tree_root = None
+            if self.metrics is not None:
+                self.metrics.record('find_nearest_hospital', time.perf_counter() - started,
+                                    origin=person_node, cache_hit=True)
+            return result
+        
+        self._search_stats = None
+        result = self._find_nearest_hospital(person_node, all_distances, method, seeds)
+        self.route_cache.put(cache_key, result)
+        if self.metrics is not None:
+            self.metrics.record('find_nearest_hospital', time.perf_counter() - started,
+                                self._search_stats, origin=person_node)
+        return result
+    
+    def route_cache_stats(self):
+        """Hit/miss/eviction counters and size of the route cache"""
+        return self.route_cache.stats()
+    
+    def _find_nearest_hospital(self, person_node, all_distances, method, seeds=None):
+        """Uncached body of find_nearest_hospital"""
+        hospital_nodes = [node for node, _ in self.hospitals]
+        
+        if seeds is not None:
+            if method != 'dijkstra':
+                raise ValueError(f"Seeded searches need method='dijkstra', not {method!r}")
+            distances, previous, visited = self.dijkstra_search(
+                None, hospital_nodes, stop_at='all' if all_distances else 'any', seeds=seeds)
+        elif method == 'ch':
+            distances, previous, visited = self._ch_nearest_hospital_search(person_node)
+        elif self._tree_root == person_node:
+            # Answer from the maintained shortest-path tree without searching
+            distances, previous, visited = self.distances, self.shortest_paths, 0
+        else:
+            # Run Dijkstra's algorithm until the hospitals are settled
+            distances, previous, visited = self.dijkstra_search(
+                person_node, hospital_nodes, stop_at='all' if all_distances else 'any')
+        
+        nearest_hospital, min_distance = self._pick_nearest_hospital(distances)
+        
+        # Get shortest path to nearest hospital
+        if nearest_hospital:
+            shortest_path = self.get_shortest_path(previous, None if seeds else person_node,
+                                                   nearest_hospital[0])
+            
+            # Store results
+            if distances is not self.distances:
+                self.distances = distances
+                self.shortest_paths = previous
+                self._tree_root = None
+            
+            return {
+                'nearest_hospital': nearest_hospital,
+                'distance': min_distance,
+                'path': shortest_path,
+                'all_hospital_distances': {name: distances.get(node, float('infinity'))
+                                           for node, name in self.hospitals
+                                           if all_distances or node in distances},
+                'visited_nodes': visited
+            }
+        
+        return None
+
+    def _pick_nearest_hospital(self, distances):
+        """(node, name) of the hospital with the smallest distance and that distance"""
+        nearest_hospital = None
+        min_distance = float('infinity')
+        for hospital_node, hospital_name in self.hospitals:
+            if distances.get(hospital_node, float('infinity')) < min_distance:
+                min_distance = distances[hospital_node]
+                nearest_hospital = (hospital_node, hospital_name)
+        return nearest_hospital, min_distance
+
+    def set_road_profile(self, u, v, profile):
+        """Give road u-v a named travel-time profile from travel_time_profiles"""
+        if profile not in self.travel_time_profiles.index:
+            raise KeyError(f"Unknown travel-time profile {profile!r}")
+        if self._graph is not None:
+            self._graph[u][v]['profile'] = profile
+            self._drop_derived_caches()
+            return
+
+        # Without networkx the profile ids live on the CSR edges
+        csr = self.get_csr()
+        if u not in csr.index or v not in csr.index:
+            raise KeyError(f"No road between {u!r} and {v!r}")
+        edge_profiles = array('q', self.get_edge_profiles())
+        iu, iv = csr.index[u], csr.index[v]
+        found = False
+        for a, b in ((iu, iv), (iv, iu)):
+            for e in range(csr.offsets[a], csr.offsets[a + 1]):
+                if csr.targets[e] == b:
+                    edge_profiles[e] = self.travel_time_profiles.index[profile]
+                    found = True
+        if not found:
+            raise KeyError(f"No road between {u!r} and {v!r}")
+        csr.edge_profiles = edge_profiles
+        self._drop_derived_caches()
+
+    def get_edge_profiles(self):
+        """
+        Profile id for every CSR edge, from the networkx edge attributes or,
+        without networkx, the CSR's own; roads without one are free-flowing
+        """
+        csr = self.get_csr()
+        if self._edge_profiles is None or self._edge_profiles[0] is not csr:
+            profile_index = self.travel_time_profiles.index
+            edge_profiles = array('q', [profile_index['free']]) * len(csr.targets)
+            if self._graph is None and csr.edge_profiles is not None:
+                edge_profiles = array('q', csr.edge_profiles)
+            elif self._graph is not None and self._graph.number_of_edges():
+                node_ids, targets = csr.node_ids, csr.targets
+                for u in range(csr.num_nodes):
+                    adjacency = self.graph[node_ids[u]]
+                    for e in range(csr.offsets[u], csr.offsets[u + 1]):
+                        profile = adjacency.get(node_ids[targets[e]], {}).get('profile')
+                        if profile is not None:
+                            edge_profiles[e] = profile_index[profile]
+            self._edge_profiles = (csr, edge_profiles)
+        return self._edge_profiles[1]
+
+    def time_dependent_search(self, start_node, departure, targets=None, stop_at='any'):
+        """
+        Dijkstra on travel minutes for a departure time (minutes after midnight)
+        Returns: travel minutes and previous nodes for the settled nodes,
+        plus the number of nodes visited
+        """
+        csr = self.get_csr()
+        index = csr.index
+        dist, pred, order = csr.time_dependent_dijkstra(
+            index[start_node], departure, self.travel_time_profiles, self.get_edge_profiles(),
+            targets=None if targets is None else [index[t] for t in targets], stop_at=stop_at)
+        distances, previous = csr.to_dicts(dist, pred, order)
+        return distances, previous, len(order)
+
+    def find_nearest_hospital_at(self, departure, origin=None):
+        """
+        Hospital reached soonest when leaving at departure (minutes after
+        midnight); 'distance' is the travel time in minutes
+        """
+        person_node = self.person_location[0] if origin is None else origin
+        distances, previous, visited = self.time_dependent_search(
+            person_node, departure, [node for node, _ in self.hospitals])
+
+        nearest_hospital, min_time = self._pick_nearest_hospital(distances)
+        if nearest_hospital is None:
+            return None
+        return {
+            'nearest_hospital': nearest_hospital,
+            'distance': min_time,
+            'path': self.get_shortest_path(previous, person_node, nearest_hospital[0]),
+            'departure': departure,
+            'visited_nodes': visited
+        }
+
+    def get_hourly_hospital_table(self, hour):
+        """
+        Nearest-hospital table for one hour of the day, built on road travel
+        times frozen at the start of that hour and cached until the graph
+        or hospitals change
+        """
+        csr = self.get_csr()
+        hour %= 24
+        hospital_nodes = tuple(node for node, _ in self.hospitals)
+        table = self._hourly_tables.get(hour)
+        if table is None or table.hospital_nodes != hospital_nodes:
+            pace = self.travel_time_profiles.pace
+            minute = hour * 60.0
+            paces = [pace(p, minute) for p in range(len(self.travel_time_profiles.names))]
+            weights = array('d', (weight * paces[p]
+                                  for weight, p in zip(csr.weights, self.get_edge_profiles())))
+            hourly = CSRGraph(csr.node_ids, csr.offsets, csr.targets, weights, index=csr.index)
+            table = self._hourly_tables[hour] = NearestHospitalTable(hourly, self.hospitals)
+        return table
+
+    def lookup_nearest_hospital_at(self, hour, node=None):
+        """
+        Nearest hospital by travel minutes during an hour of the day, from
+        the cached per-hour table
+        """
+        if node is None:
+            node = self.person_location[0]
+
+        entry = self.get_hourly_hospital_table(hour).lookup(node)
+        if entry is None:
+            return None
+
+        nearest_hospital, minutes, path = entry
+        return {
+            'nearest_hospital': nearest_hospital,
+            'distance': minutes,
+            'path': path
+        }
+
+    def set_hospital_status(self, node, capacity=None, wait_time=None):
+        """
+        Record live load on a hospital node: capacity = free emergency beds
+        (0 = on diversion), wait_time = current ER wait in minutes
+        """
+        if node not in self.get_csr().index:
+            raise KeyError(f"Unknown node {node!r}")
+        status = self.hospital_status.setdefault(node, {})
+        if capacity is not None:
+            status['capacity'] = capacity
+        if wait_time is not None:
+            status['wait_time'] = wait_time
+
+    def find_k_nearest_hospitals(self, k=3, origin=None, wait_weight=0.0, include_diverted=False):
+        """
+        The k best hospitals from a single search, each with its path
+        Ranked by road distance plus wait_weight km per minute of wait_time;
+        hospitals with capacity 0 are skipped unless include_diverted.
+        The search stops as soon as the k-th hospital is settled.
+        Returns: dictionary with the ranked 'hospitals' and 'visited_nodes'
+        """
+        if k < 1:
+            raise ValueError(f"k must be at least 1, got {k}")
+        person_node = self.person_location[0] if origin is None else origin
+
+        candidates = []
+        for node, name in self.hospitals:
+            status = self.hospital_status.get(node, {})
+            capacity = status.get('capacity')
+            if capacity == 0 and not include_diverted:
+                continue
+            candidates.append((node, name, capacity, status.get('wait_time', 0.0)))
+
+        cache_key = (self.graph_version, 'k_nearest', person_node, tuple(candidates), k, wait_weight)
+        hit, result = self.route_cache.get(cache_key)
+        if hit:
+            return result
+
+        csr = self.get_csr()
+        index = csr.index
+        dist, pred, order, ranked = csr.k_nearest(
+            index[person_node], [index[node] for node, _, _, _ in candidates], k,
+            [wait_weight * wait_time for _, _, _, wait_time in candidates] if wait_weight else None)
+
+        hospitals = []
+        for score, i in ranked:
+            node, name, capacity, wait_time = candidates[i]
+            path = []
+            current = index[node]
+            while current != -1:
+                path.append(csr.node_ids[current])
+                current = pred[current]
+            path.reverse()
+            hospitals.append({
+                'hospital': (node, name),
+                'distance': dist[index[node]],
+                'score': score,
+                'capacity': capacity,
+                'wait_time': wait_time,
+                'path': path
+            })
+
+        result = {'hospitals': hospitals, 'visited_nodes': len(order)}
+        self.route_cache.put(cache_key, result)
+        return result
+
+    def get_spatial_index(self):
+        """Grid index over node coordinates, rebuilt with the CSR snapshot"""
+        csr = self.get_csr()
+        if self._spatial_index is None or self._spatial_index.csr is not csr:
+            self._spatial_index = SpatialIndex(csr)
+        return self._spatial_index
+    
+    def snap_to_road(self, x, y, mode='node'):
+        """
+        Snap a caller's coordinates to the road network: the nearest node
+        (mode='node') or the nearest point on an open road (mode='edge')
+        Returns: dictionary describing the snapped position (offset = km
+        from the caller), or None
+        """
+        if mode not in ('node', 'edge'):
+            raise ValueError(f"Unknown snap mode {mode!r}")
+        csr = self.get_csr()
+        index = self.get_spatial_index()
+        if mode == 'edge':
+            hit = index.nearest_edge(x, y)
+            if hit is None:
+                return None
+            u, v, fraction, point, offset = hit
+            return {
+                'edge': (csr.node_ids[u], csr.node_ids[v]),
+                'fraction': fraction,
+                'point': point,
+                'offset': offset * (KM_PER_DEGREE if csr.geographic else 1.0)
+            }
+
+        i, offset = index.nearest_node(x, y)
+        if i < 0:
+            return None
+        return {
+            'node': csr.node_ids[i],
+            'point': (csr.xs[i], csr.ys[i]),
+            'offset': offset * (KM_PER_DEGREE if csr.geographic else 1.0)
+        }
+    
+    def find_nearest_hospital_from_coordinates(self, x, y, snap='node', method='dijkstra'):
+        """
+        Route from raw caller coordinates: snap them to the road network and
+        use the snapped point as the origin of find_nearest_hospital. Edge
+        snapping starts the search from both ends of the road, offset by the
+        distance along it, which needs method='dijkstra'. The result gains a
+        'snapped' entry.
+        """
+        snapped = self.snap_to_road(x, y, mode=snap)
+        if snapped is None:
+            return None
+
+        if snap != 'edge':
+            result = self.find_nearest_hospital(method=method, origin=snapped['node'])
+            return dict(result, snapped=snapped) if result else None
+
+        u, v = snapped['edge']
+        weight = self._road_weight(u, v)
+        result = self.find_nearest_hospital(
+            method=method,
+            seeds=[(u, snapped['fraction'] * weight), (v, (1 - snapped['fraction']) * weight)])
+        return dict(result, snapped=snapped) if result else None
+    
+    def find_nearest_hospitals_batch(self, origins, workers=1):
+        """
+        Route many callers at once, fanning out over a process pool that
+        shares one read-only CSR snapshot (workers=None uses every core)
+        Returns: one find_nearest_hospital result per origin and the
+        origins x hospitals distance matrix (columns in self.hospitals order)
+        """
+        global _batch_snapshot
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        origins = list(origins)
+        snapshot = (self.get_csr(), list(self.hospitals))
+        workers = workers or os.cpu_count() or 1
+
+        if workers <= 1 or len(origins) <= 1:
+            _init_batch_worker(snapshot)
+            try:
+                answers = [_batch_route(origin) for origin in origins]
+            finally:
+                _batch_snapshot = None
+        else:
+            # Forked workers inherit the snapshot copy-on-write; otherwise
+            # it is pickled once per worker through the initializer
+            if 'fork' in multiprocessing.get_all_start_methods():
+                context, initargs = multiprocessing.get_context('fork'), (None,)
+                _batch_snapshot = snapshot
+            else:
+                context, initargs = None, (snapshot,)
+
+            chunksize = max(1, len(origins) // (workers * 4))
+            try:
+                with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                         initializer=_init_batch_worker,
+                                         initargs=initargs) as pool:
+                    answers = list(pool.map(_batch_route, origins, chunksize=chunksize))
+            finally:
+                _batch_snapshot = None
+
+        return {
+            'origins': origins,
+            'hospitals': list(self.hospitals),
+            'results': [result for result, _ in answers],
+            'distance_matrix': [row for _, row in answers]
+        }
+    
+    def start_sharded_router(self, regions=4, directory=None):
+        """
+        Partition the current graph into regions served by one worker process
+        each; close() the returned ShardedRouter (or use it as a context
+        manager) when done. The shard files go to directory, kept for later
+        ShardedRouter(directory) runs, or to a temporary one removed on close.
+        """
+        remove_on_close = directory is None
+        if remove_on_close:
+            import tempfile
+            directory = tempfile.mkdtemp(prefix='ehl-shards-')
+        ShardedRouter.write_shards(self.get_csr(), self.hospitals, directory, regions)
+        return ShardedRouter(directory, remove_on_close=remove_on_close)
+    
+    def compute_shortest_path_tree(self, root=None):
+        """
+        Full shortest-path tree from root (default: the person's location),
+        stored in self.distances / self.shortest_paths and repaired
+        incrementally by every later road update
+        """
+        if root is None:
+            root = self.person_location[0]
+
+        self.distances, self.shortest_paths = self.dijkstra_algorithm(root)
+        self._tree_root = root
+        self._tree_children = defaultdict(set)
+        for node, parent in self.shortest_paths.items():
+            if parent is not None:
+                self._tree_children[parent].add(node)
+        return self.distances, self.shortest_paths
+    
+    def close_road(self, u, v):
+        """Close the road u-v; returns the nodes whose distance changed"""
+        weight = self._road_weight(u, v)
+        if weight == float('infinity'):
+            raise KeyError(f"No open road between {u!r} and {v!r}")
+        # The networkx edge is removed, so keep its attributes (such as the
+        # travel-time profile) for reopen_road; the CSR keeps its own
+        data = self._graph.get_edge_data(u, v) if self._graph is not None else None
+        attributes = dict(data) if data is not None else None
+        self._closed_roads[frozenset((u, v))] = (weight, attributes)
+        return self.update_edge(u, v, None)
+    
+    def reopen_road(self, u, v):
+        """Reopen a road closed by close_road with its previous length and profile"""
+        weight, attributes = self._closed_roads.pop(frozenset((u, v)))
+        if attributes is not None and self._graph is not None:
+            self._graph.add_edge(u, v, **attributes)
+        return self.update_edge(u, v, weight)
+    
+    def set_travel_time(self, u, v, weight):
+        """Change the weight of road u-v (adds the road if missing)"""
+        return self.update_edge(u, v, weight)
+    
+    def update_edge(self, u, v, weight):
+        """
+        Apply a road change (weight None closes the road) and repair the
+        cached shortest-path tree, touching only the affected nodes
+        Returns: set of nodes whose shortest distance changed
+        """
+        csr = self.get_csr()
+        if self._graph is None and (u not in csr.index or v not in csr.index):
+            raise ValueError(f"Road {u!r}-{v!r} joins a node this graph does not have; "
+                             f"new nodes need a networkx graph (build_networkx=True)")
+        old_weight = self._road_weight(u, v)
+        new_weight = float('infinity') if weight is None else weight
+
+        if self._graph is not None:
+            if weight is None:
+                if self._graph.has_edge(u, v):
+                    self._graph.remove_edge(u, v)
+            else:
+                self._graph.add_edge(u, v, weight=weight)
+
+        self._patch_csr_edge(u, v, new_weight)
+        self._drop_derived_caches()
+
+        if self._tree_root is None or new_weight == old_weight:
+            return set()
+        if new_weight < old_weight:
+            return self._repair_after_decrease(u, v, new_weight)
+        return self._repair_after_increase(u, v)
+    
+    def _road_weight(self, u, v):
+        """Length of the road u-v in the CSR snapshot (infinity if none or closed)"""
+        csr = self.get_csr()
+        if u not in csr.index or v not in csr.index:
+            return float('infinity')
+        iu, iv = csr.index[u], csr.index[v]
+        return min((csr.weights[e] for e in range(csr.offsets[iu], csr.offsets[iu + 1])
+                    if csr.targets[e] == iv), default=float('infinity'))
+    
+    def _patch_csr_edge(self, u, v, weight):
+        """
+        Update the edge weight in place in the CSR; a road between existing
+        nodes that was never in it is spliced in. A new node drops the CSR,
+        which is then recompiled from the networkx graph (update_edge
+        rejects new nodes on graphs loaded without one).
+        """
+        csr = self._csr
+        if csr is None:
+            return
+        if u not in csr.index or v not in csr.index:
+            self._csr = None
+            return
+
+        iu, iv = csr.index[u], csr.index[v]
+        if isinstance(csr.weights, memoryview):
+            # Memory-mapped weights are read-only: take a private copy first
+            csr.weights = array('d', csr.weights)
+        found = False
+        for a, b in ((iu, iv), (iv, iu)):
+            for e in range(csr.offsets[a], csr.offsets[a + 1]):
+                if csr.targets[e] == b:
+                    csr.weights[e] = weight
+                    found = True
+
+        if not found and weight != float('infinity'):
+            self._csr = csr = csr.with_edge(iu, iv, weight, self.travel_time_profiles.index.get('free', 0))
+        if csr.xs is not None and weight != float('infinity'):
+            # Keep the A* heuristic admissible for a shorter road
+            straight = csr.straight_line(iu, iv)
+            if straight > 0:
+                csr.heuristic_scale = min(csr.heuristic_scale, weight / straight)
+    
+    def _set_tree_parent(self, node, parent):
+        old_parent = self.shortest_paths.get(node)
+        if old_parent is not None:
+            self._tree_children[old_parent].discard(node)
+        if parent is not None:
+            self._tree_children[parent].add(node)
+        self.shortest_paths[node] = parent
+    
+    def _propagate_tree(self, pq, changed, allowed=None):
+        """Dijkstra-style propagation of improved labels from the heap"""
+        distances = self.distances
+        csr = self.get_csr()
+        node_ids, index = csr.node_ids, csr.index
+        offsets, targets, weights = csr.offsets, csr.targets, csr.weights
+        while pq:
+            current_distance, node = heapq.heappop(pq)
+            if current_distance > distances[node]:
+                continue
+            i = index[node]
+            for e in range(offsets[i], offsets[i + 1]):
+                neighbor = node_ids[targets[e]]
+                if allowed is not None and neighbor not in allowed:
+                    continue
+                new_distance = current_distance + weights[e]
+                if new_distance < distances.get(neighbor, float('infinity')):
+                    distances[neighbor] = new_distance
+                    self._set_tree_parent(neighbor, node)
+                    changed.add(neighbor)
+                    heapq.heappush(pq, (new_distance, neighbor))
+    
+    def _repair_after_decrease(self, u, v, weight):
+        """A shorter (or new) road can only improve labels reachable through it"""
+        distances = self.distances
+        changed = set()
+        pq = []
+        for a, b in ((u, v), (v, u)):
+            new_distance = distances.get(a, float('infinity')) + weight
+            if new_distance < distances.get(b, float('infinity')):
+                distances[b] = new_distance
+                self._set_tree_parent(b, a)
+                changed.add(b)
+                heapq.heappush(pq, (new_distance, b))
+        self._propagate_tree(pq, changed)
+        return changed
+    
+    def _repair_after_increase(self, u, v):
+        """
+        A longer (or closed) road only matters if it was a tree edge: the
+        subtree below it is detached and re-attached from its unaffected border
+        """
+        distances, previous = self.distances, self.shortest_paths
+        if previous.get(v) == u:
+            child = v
+        elif previous.get(u) == v:
+            child = u
+        else:
+            return set()
+
+        affected = set()
+        stack = [child]
+        while stack:
+            node = stack.pop()
+            affected.add(node)
+            stack.extend(self._tree_children.get(node, ()))
+
+        old_distances = {node: distances[node] for node in affected}
+        for node in affected:
+            distances[node] = float('infinity')
+            self._set_tree_parent(node, None)
+
+        csr = self.get_csr()
+        node_ids, index = csr.node_ids, csr.index
+        offsets, targets, weights = csr.offsets, csr.targets, csr.weights
+        pq = []
+        for node in affected:
+            i = index[node]
+            for e in range(offsets[i], offsets[i + 1]):
+                neighbor = node_ids[targets[e]]
+                through = distances.get(neighbor, float('infinity')) + weights[e]
+                if neighbor not in affected and through < distances[node]:
+                    distances[node] = through
+                    self._set_tree_parent(node, neighbor)
+            if previous[node] is not None:
+                heapq.heappush(pq, (distances[node], node))
+
+        self._propagate_tree(pq, set(), allowed=affected)
+        return {node for node in affected if distances[node] != old_distances[node]}
+    
+    def get_layout(self):
+        """Node positions for drawing: stored coordinates, else a cached spring layout"""
+        if self._layout is None or self._layout[0] != self.graph_version:
+            node_data = self.graph.nodes(data=True)
+            if all('x' in data and 'y' in data for _, data in node_data):
+                pos = {node: (data['x'], data['y']) for node, data in node_data}
+            else:
+                import networkx as nx
+                pos = nx.spring_layout(self.graph, k=3, iterations=50, seed=42)
+            self._layout = (self.graph_version, pos)
+        return self._layout[1]
+    
+    def visualize_graph(self, highlight_path=None, fast=None):
+        """
+        Create an attractive dark-themed visualization of the graph
+        The base map is rendered once per graph version and reused; only the
+        highlighted path layer is redrawn. fast=True (the default above
+        FAST_RENDER_THRESHOLD nodes) draws a label-free map from collections.
+        Returns: the matplotlib Figure
+        """
+        from matplotlib.collections import LineCollection
+
+        if fast is None:
+            fast = self.graph.number_of_nodes() > FAST_RENDER_THRESHOLD
+        
+        key = (self.graph_version, fast)
+        if self._base_map is None or self._base_map[0] != key:
+            self._base_map = (key, self._render_base_map(fast))
+            self._path_layer = None
+        fig = self._base_map[1]
+        
+        # Swap the highlighted path layer
+        if self._path_layer is not None:
+            self._path_layer.remove()
+            self._path_layer = None
+        
+        if highlight_path and len(highlight_path) > 1:
+            pos = self.get_layout()
+            path_edges = [(pos[highlight_path[i]], pos[highlight_path[i+1]])
+                          for i in range(len(highlight_path)-1)]
+            self._path_layer = LineCollection(path_edges, colors='#FFE66D', linewidths=5,
+                                              alpha=1.0, zorder=1.5)
+            fig.axes[0].add_collection(self._path_layer)
+        
+        return fig
+    
+    def _node_style(self, node):
+        """Marker color and size for a node based on its type"""
+        node_type = self.graph.nodes[node].get('type', 'location')
+        if node_type == 'person':
+            return '#4ECDC4', 800  # Teal for person
+        elif node_type == 'hospital':
+            return '#FF6B6B', 600  # Coral red for hospitals
+        return '#95A5A6', 400  # Light gray for other locations
+    
+    def visualize_viewport(self, highlight_path=None, bbox=None, hops=None,
+                           grid_cells=20, max_labels=60):
+        """
+        Level-of-detail map of one viewport: a bounding box (xmin, ymin,
+        xmax, ymax) in layout coordinates, or the k-hop neighbourhood of the
+        person and the route (default: the route itself). Only nodes in view
+        are drawn in detail, the surrounding context is aggregated into grid
+        cells, and labels are dropped as more of the map comes into view.
+        Returns: the matplotlib Figure
+        """
+        from matplotlib import patches, style
+        from matplotlib.collections import LineCollection
+        from matplotlib.figure import Figure
+
+        pos = self.get_layout()
+        graph = self.graph
+        path = list(highlight_path or [])
+        
+        if bbox is None:
+            seeds = set(path)
+            if self.person_location and self.person_location[0] in graph:
+                seeds.add(self.person_location[0])
+            region = set(seeds)
+            frontier = list(seeds)
+            for _ in range(hops or 0):
+                frontier = [nbr for node in frontier for nbr in graph.adj[node] if nbr not in region]
+                region.update(frontier)
+            xs = [pos[node][0] for node in region]
+            ys = [pos[node][1] for node in region]
+            pad = 0.1 * max(max(xs) - min(xs), max(ys) - min(ys), 1.0)
+            bbox = (min(xs) - pad, min(ys) - pad, max(xs) + pad, max(ys) + pad)
+        
+        xmin, ymin, xmax, ymax = bbox
+        width, height = xmax - xmin, ymax - ymin
+        
+        # Context window around the viewport, aggregated into grid cells
+        cxmin, cymin = xmin - width / 2, ymin - height / 2
+        cxmax, cymax = xmax + width / 2, ymax + height / 2
+        cell_w, cell_h = (cxmax - cxmin) / grid_cells, (cymax - cymin) / grid_cells
+        
+        in_view = []
+        cells = defaultdict(lambda: [0, 0.0, 0.0])
+        for node, (x, y) in pos.items():
+            if xmin <= x <= xmax and ymin <= y <= ymax:
+                in_view.append(node)
+            elif cxmin <= x <= cxmax and cymin <= y <= cymax:
+                cell = cells[(int((x - cxmin) / cell_w), int((y - cymin) / cell_h))]
+                cell[0] += 1
+                cell[1] += x
+                cell[2] += y
+        
+        order = {node: i for i, node in enumerate(in_view)}
+        edges = [(u, v) for u in in_view for v in graph.adj[u]
+                 if v not in order or order[u] < order[v]]
+        
+        with style.context('dark_background'):
+            fig = Figure(figsize=(14, 10))
+            ax = fig.add_subplot()
+            
+            # Roads touching the viewport, thinner as more come into view
+            ax.add_collection(LineCollection([(pos[u], pos[v]) for u, v in edges],
+                                             colors='#CCCCCC', alpha=0.7, zorder=1,
+                                             linewidths=2 if len(edges) <= max_labels else 0.8))
+            
+            # Aggregated context: one marker per grid cell, sized by node count
+            if cells:
+                counts = [count for count, _, _ in cells.values()]
+                ax.scatter([sx / count for count, sx, _ in cells.values()],
+                           [sy / count for count, _, sy in cells.values()],
+                           s=[min(30 + 10 * count, 600) for count in counts],
+                           marker='s', c='#5D6D7E', alpha=0.5, zorder=1.2, linewidths=0)
+            
+            styles = [self._node_style(node) for node in in_view]
+            detail = len(in_view) <= max_labels
+            ax.scatter([pos[node][0] for node in in_view], [pos[node][1] for node in in_view],
+                       c=[color for color, _ in styles],
+                       s=[size if detail else size / 10 for _, size in styles],
+                       edgecolors='white' if detail else 'none', linewidths=2 if detail else 0,
+                       alpha=0.9, zorder=2)
+            
+            if len(path) > 1:
+                ax.add_collection(LineCollection([(pos[a], pos[b]) for a, b in zip(path, path[1:])],
+                                                 colors='#FFE66D', linewidths=5, zorder=1.5))
+            
+            # Label density by zoom: everything when zoomed in, then only
+            # the person and hospitals, then nothing
+            labelled = in_view if detail else [node for node in in_view
+                                               if graph.nodes[node].get('type') in ('person', 'hospital')]
+            if len(labelled) <= max_labels:
+                for node in labelled:
+                    name = graph.nodes[node].get('name', str(node))
+                    ax.text(*pos[node], name[:15] + '...' if len(name) > 15 else name,
+                            fontsize=8, fontweight='bold', color='white',
+                            ha='center', va='center', zorder=3)
+            if len(edges) <= max_labels // 2:
+                for u, v in edges:
+                    (x1, y1), (x2, y2) = pos[u], pos[v]
+                    ax.text((x1 + x2) / 2, (y1 + y2) / 2, f"{graph[u][v]['weight']} km",
+                            fontsize=8, color='#FFFFFF', ha='center', va='center', zorder=3)
+            
+            legend_elements = [
+                patches.Patch(color='#4ECDC4', label='👤 Your Location'),
+                patches.Patch(color='#FF6B6B', label='🏥 Hospitals'),
+                patches.Patch(color='#95A5A6', label='📍 Other Locations'),
+                patches.Patch(color='#5D6D7E', label='▦ Aggregated Locations'),
+                patches.Patch(color='#FFE66D', label='🛣️ Shortest Path')
+            ]
+            ax.legend(handles=legend_elements, loc='upper right', bbox_to_anchor=(1.15, 1),
+                      facecolor='#2E2E2E', edgecolor='white', labelcolor='white')
+            
+            ax.set_title(f"🗺️ Emergency Hospital Locator Map ({len(in_view)} locations in view)",
+                         fontsize=16, fontweight='bold', color='white')
+            ax.set_xlim(cxmin, cxmax)
+            ax.set_ylim(cymin, cymax)
+            ax.axis('off')
+            ax.set_facecolor('#2E2E2E')
+            fig.patch.set_facecolor('#2E2E2E')
+            fig.tight_layout()
+        
+        return fig
+    
+    def _render_base_map(self, fast):
+        """Draw the static part of the map: roads, locations, labels and legend"""
+        import networkx as nx
+        from matplotlib import patches, style
+        from matplotlib.collections import LineCollection
+        from matplotlib.figure import Figure
+
+        pos = self.get_layout()
+        
+        with style.context('dark_background'):  # Use dark matplotlib theme
+            fig = Figure(figsize=(14, 10))
+            ax = fig.add_subplot()
+            
+            # Node colors and sizes based on type
+            node_colors = []
+            node_sizes = []
+            
+            for node in self.graph.nodes():
+                color, size = self._node_style(node)
+                node_colors.append(color)
+                node_sizes.append(size)
+            
+            if fast:
+                # One collection for all roads and one for all nodes, no labels
+                ax.add_collection(LineCollection([(pos[u], pos[v]) for u, v in self.graph.edges()],
+                                                 colors='#CCCCCC', linewidths=0.5, alpha=0.7,
+                                                 zorder=1))
+                xy = [pos[node] for node in self.graph.nodes()]
+                if xy:
+                    ax.scatter([x for x, _ in xy], [y for _, y in xy], c=node_colors,
+                               s=[size / 40 for size in node_sizes], zorder=2, linewidths=0)
+                ax.autoscale_view()
+            else:
+                # Draw all edges (roads) in light gray
+                nx.draw_networkx_edges(self.graph, pos, edge_color='#CCCCCC', 
+                                      width=2, alpha=0.7, ax=ax)
+                
+                # Draw edge labels (distances)
+                edge_labels = nx.get_edge_attributes(self.graph, 'weight')
+                edge_labels = {k: f"{v} km" for k, v in edge_labels.items()}
+                nx.draw_networkx_edge_labels(self.graph, pos, edge_labels, 
+                                            font_size=8, font_color='#FFFFFF', ax=ax)
+                
+                nx.draw_networkx_nodes(self.graph, pos, node_color=node_colors, 
+                                      node_size=node_sizes, alpha=0.9, edgecolors='white',
+                                      linewidths=2, ax=ax)
+                
+                # Draw node labels
+                labels = {node: self.graph.nodes[node]['name'][:15] + '...' 
+                         if len(self.graph.nodes[node]['name']) > 15 
+                         else self.graph.nodes[node]['name'] 
+                         for node in self.graph.nodes()}
+                
+                nx.draw_networkx_labels(self.graph, pos, labels, font_size=8, 
+                                       font_weight='bold', font_color='white', ax=ax)
+            
+            # Add legend with dark theme colors
+            legend_elements = [
+                patches.Patch(color='#4ECDC4', label='👤 Your Location'),
+                patches.Patch(color='#FF6B6B', label='🏥 Hospitals'),
+                patches.Patch(color='#95A5A6', label='📍 Other Locations'),
+                patches.Patch(color='#FFE66D', label='🛣️ Shortest Path')
+            ]
+            ax.legend(handles=legend_elements, loc='upper right', bbox_to_anchor=(1.15, 1),
+                      facecolor='#2E2E2E', edgecolor='white', labelcolor='white')
+            
+            ax.set_title("🗺️ Emergency Hospital Locator Map", fontsize=16, fontweight='bold', color='white')
+            ax.axis('off')
+            
+            # Set dark background
+            ax.set_facecolor('#2E2E2E')
+            fig.patch.set_facecolor('#2E2E2E')
+            
+            fig.tight_layout()
+        
+        return fig
+
+
+# Read-only (CSR snapshot, hospitals) used by batch routing workers
+_batch_snapshot = None
+
+
+def _init_batch_worker(snapshot):
+    """Process pool initializer: install the shared graph snapshot"""
+    global _batch_snapshot
+    if snapshot is not None:
+        _batch_snapshot = snapshot
+
+
+def _batch_route(origin):
+    """Answer one batch query exactly as find_nearest_hospital would"""
+    csr, hospitals = _batch_snapshot
+    locator = EmergencyHospitalLocator()
+    locator._csr = csr
+    locator.hospitals = hospitals
+
+    result = locator.find_nearest_hospital(origin=origin)
+    row = [locator.distances.get(node, float('infinity')) if result else float('infinity')
+           for node, _ in hospitals]
+    return result, row
+
+
+def _shard_worker(path, region, boundary, ranks, requests, results):
+    """
+    Region worker: map the region's graph file, then answer (request id,
+    message) pairs until None. ranks are the region's hospitals' positions
+    in the full hospital list, in file order.
+    """
+    region_graph = EmergencyHospitalLocator()
+    region_graph.load_graph_binary(path)
+    shard = GraphShard(region, region_graph.get_csr(), boundary,
+                       [(node, name, rank) for (node, name), rank in zip(region_graph.hospitals, ranks)])
+    handlers = {
+        'search': lambda node: (shard.boundary_distances(node), shard.hospital_reach(node)),
+        'path': shard.path,
+        'hospital_path': shard.hospital_path
+    }
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        request_id, (operation, *args) = request
+        try:
+            if operation == 'prepare':
+                # Boundary-to-boundary table and local hospital reach
+                table = {b: shard.boundary_distances(b) for b in shard.boundary}
+                reach = {b: shard.hospital_reach(b) for b in shard.boundary}
+                reply = shard.region, (table, {b: r for b, r in reach.items() if r is not None})
+            else:
+                reply = handlers[operation](*args)
+            results.put((request_id, True, reply))
+        except Exception as e:
+            results.put((request_id, False, repr(e)))
+
+
+def json_safe(value):
+    """Result dictionaries as JSON-safe values (unreachable distances become null)"""
+    if isinstance(value, dict):
+        return {str(k): json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(v) for v in value]
+    if isinstance(value, float) and math.isinf(value):
+        return None
+    return value
+
+
+def main(argv=None):
+    """Command line: one-shot or batch nearest-hospital queries, JSON lines out"""
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--graph-file', help="binary graph written by save_graph_binary()")
+    source.add_argument('--edges', help="road CSV for load_road_network (with --hospitals / --nodes)")
+    source.add_argument('--synthetic', type=int, metavar='NODES', help="generate_synthetic_city size")
+    parser.add_argument('--hospitals', help="hospital CSV for --edges")
+    parser.add_argument('--nodes', help="node CSV for --edges")
+    parser.add_argument('--seed', type=int, default=0, help="seed for --synthetic")
+    parser.add_argument('--origin', help="single origin node (default: the person's location)")
+    parser.add_argument('--origins-file', help="file with one origin node per line ('-' for stdin)")
+    parser.add_argument('--k', type=int, help="return the k nearest hospitals instead of one")
+    parser.add_argument('--workers', type=int, default=1, help="processes for batch queries")
+    parser.add_argument('--method', choices=['dijkstra', 'ch'],
+                        help="search method (default: 'ch' with --ch-file, else 'dijkstra')")
+    parser.add_argument('--ch-file', default=os.environ.get('HOSPITAL_CH_FILE'),
+                        help="contraction hierarchy file, loaded at start or built and saved "
+                             "there (default: $HOSPITAL_CH_FILE)")
+    args = parser.parse_args(argv)
+
+    locator = EmergencyHospitalLocator()
+    if args.graph_file:
+        locator.load_graph_binary(args.graph_file)
+    elif args.edges:
+        locator.load_road_network(args.edges, args.hospitals, args.nodes, build_networkx=False)
+    else:
+        locator.generate_synthetic_city(args.synthetic, seed=args.seed)
+
+    method = args.method or ('ch' if args.ch_file else 'dijkstra')
+    if method == 'ch':
+        locator.prepare_contraction_hierarchy(args.ch_file)
+
+    if args.origins_file:
+        with (sys.stdin if args.origins_file == '-' else open(args.origins_file)) as f:
+            origins = [_parse_node_id(line) for line in f if line.strip()]
+    else:
+        origins = [locator.person_location[0] if args.origin is None else _parse_node_id(args.origin)]
+
+    if args.k:
+        results = [locator.find_k_nearest_hospitals(args.k, origin=origin) for origin in origins]
+    elif method == 'ch' or len(origins) == 1:
+        results = [locator.find_nearest_hospital(method=method, origin=origin) for origin in origins]
+    else:
+        results = locator.find_nearest_hospitals_batch(origins, workers=args.workers)['results']
+
+    for origin, result in zip(origins, results):
+        print(json.dumps({'origin': origin, 'result': json_safe(result)}))
+
+
+if __name__ == '__main__':
+    main()
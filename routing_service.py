@@ -0,0 +1,217 @@
+"""
+Async HTTP/JSON routing service wrapping EmergencyHospitalLocator
+
+Usage: python routing_service.py [--port 8765] [--graph-file city.bin | --complexity complex]
+           [--ch-file city.ch]
+
+Endpoints:
+    GET  /health  -> {"status": "ok", "graph_version": ...}
+    GET  /stats   -> request, coalescing and route cache counters
+    GET  /metrics -> query instrumentation in Prometheus text format
+    POST /route   {"origin": node} or {"x": .., "y": .., "snap": "node"|"edge"},
+                  optionally with "method": "dijkstra"|"ch"
+                  -> the find_nearest_hospital result fields
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from routing_core import EmergencyHospitalLocator, json_safe
+
+
+class RoutingService:
+    """
+    Serves routing requests from one locator. Searches run in an executor so
+    the event loop never blocks, and concurrent identical requests against
+    the same graph version share a single computation.
+    """
+
+    def __init__(self, locator, executor=None):
+        self.locator = locator
+        # Pure-Python searches hold the GIL, so one routing thread is enough;
+        # use find_nearest_hospitals_batch for multi-core throughput
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+        self._in_flight = {}
+        self.requests = 0
+        self.computations = 0
+        self.coalesced = 0
+
+    async def route(self, request):
+        """Answer one /route request body, coalescing identical ones in flight"""
+        method = request.get('method', 'dijkstra')
+        if method not in ('dijkstra', 'ch'):
+            raise ValueError(f"Unknown method {method!r}")
+        if 'origin' in request:
+            origin = request['origin']
+            if origin not in self.locator.get_csr().index:
+                raise LookupError(f"Unknown origin node {origin!r}")
+            key = ('node', origin, method, self.locator.graph_version)
+            call = (self.locator.find_nearest_hospital, (), {'origin': origin, 'method': method})
+        else:
+            x, y = float(request['x']), float(request['y'])
+            snap = request.get('snap', 'node')
+            if snap not in ('node', 'edge'):
+                raise ValueError(f"Unknown snap mode {snap!r}")
+            key = ('point', x, y, snap, method, self.locator.graph_version)
+            call = (self.locator.find_nearest_hospital_from_coordinates, (x, y),
+                    {'snap': snap, 'method': method})
+
+        self.requests += 1
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            self.computations += 1
+            function, args, kwargs = call
+            future = asyncio.get_running_loop().run_in_executor(
+                self.executor, lambda: function(*args, **kwargs))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        # Shielded so one client hanging up does not cancel the shared search
+        return await asyncio.shield(future)
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'computations': self.computations,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._in_flight),
+            'graph_version': self.locator.graph_version,
+            'route_cache': self.locator.route_cache_stats()
+        }
+
+    async def handle_connection(self, reader, writer):
+        """
+        Minimal HTTP/1.1 with keep-alive: one JSON request/response at a
+        time. A malformed request gets 400 and the connection is closed;
+        an unexpected error while answering gets 500.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, target, headers, body = await self.read_request(reader, request_line)
+                except ValueError as e:
+                    await self.respond(writer, '400 Bad Request',
+                                       {'error': f"Malformed HTTP request: {e}"}, keep_alive=False)
+                    break
+
+                try:
+                    status, payload = await self.dispatch(method, target, body)
+                except Exception as e:
+                    status, payload = '500 Internal Server Error', {'error': f"Internal server error: {e!r}"}
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def read_request(reader, request_line):
+        """Parse one request after its first line: (method, target, headers, body)"""
+        parts = request_line.decode('latin-1').split()
+        if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+            raise ValueError(f"bad request line {request_line[:100]!r}")
+        method, target, _ = parts
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, colon, value = line.decode('latin-1').partition(':')
+            if not colon:
+                raise ValueError(f"bad header line {line[:100]!r}")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length', 0))
+        if length < 0:
+            raise ValueError(f"negative Content-Length {length}")
+        return method, target, headers, await reader.readexactly(length)
+
+    @staticmethod
+    async def respond(writer, status, payload, keep_alive):
+        """Write one response: JSON, or metrics text for a str payload"""
+        if isinstance(payload, str):
+            content_type, data = 'text/plain; version=0.0.4', payload.encode('utf-8')
+        else:
+            content_type, data = 'application/json', json.dumps(payload).encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1')
+            + data)
+        await writer.drain()
+
+    async def dispatch(self, method, target, body):
+        """Map a request to (status line, JSON-serialisable payload or metrics text)"""
+        if method == 'GET' and target == '/health':
+            return '200 OK', {'status': 'ok', 'graph_version': self.locator.graph_version,
+                              'nodes': len(self.locator.get_csr().node_ids)}
+        if method == 'GET' and target == '/stats':
+            return '200 OK', self.stats()
+        if method == 'GET' and target == '/metrics':
+            return '200 OK', self.locator.metrics_text()
+        if method != 'POST' or target != '/route':
+            return '404 Not Found', {'error': f"No route for {method} {target}"}
+
+        try:
+            request = json.loads(body or b'{}')
+            if not isinstance(request, dict):
+                raise TypeError("the body must be a JSON object")
+            result = await self.route(request)
+        except (KeyError, TypeError, ValueError) as e:
+            # KeyError first: it is also a LookupError, but means a missing field
+            return '400 Bad Request', {'error': f"Invalid routing request: {e}"}
+        except LookupError as e:
+            return '404 Not Found', {'error': str(e)}
+
+        if result is None:
+            return '404 Not Found', {'error': "No hospital reachable from this origin"}
+        return '200 OK', json_safe(result)
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--graph-file', help="binary graph written by save_graph_binary()")
+    parser.add_argument('--complexity', default='complex', choices=['simple', 'medium', 'complex'])
+    parser.add_argument('--hospitals', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--ch-file', default=os.environ.get('HOSPITAL_CH_FILE'),
+                        help="contraction hierarchy for method 'ch', loaded at start or built "
+                             "and saved there (default: $HOSPITAL_CH_FILE)")
+    args = parser.parse_args()
+
+    locator = EmergencyHospitalLocator(instrument=True)
+    if args.graph_file:
+        locator.load_graph_binary(args.graph_file)
+    else:
+        random.seed(args.seed)
+        locator.generate_city_graph(args.hospitals, args.complexity)
+    locator.get_csr()
+    if args.ch_file:
+        locator.prepare_contraction_hierarchy(args.ch_file)
+
+    print(f"Routing service listening on http://{args.host}:{args.port}")
+    asyncio.run(RoutingService(locator).serve(args.host, args.port))
+
+
+if __name__ == '__main__':
+    main()
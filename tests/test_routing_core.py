@@ -0,0 +1,812 @@
+"""
+Tests for routing_core, checked against plain Dijkstra and brute force
+
+Usage: python -m pytest tests
+"""
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+from array import array
+
+import networkx as nx
+import pytest
+
+os.environ.setdefault('MPLBACKEND', 'Agg')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import routing_core  # noqa: E402
+from routing_core import (CSRGraph, ContractionHierarchy, EmergencyHospitalLocator,  # noqa: E402
+                          NearestHospitalTable, SpatialIndex, TravelTimeProfiles)
+
+INFINITY = float('infinity')
+
+
+def synthetic_city(size, seed=1, **kwargs):
+    kwargs.setdefault('hospital_density', 0.005)
+    locator = EmergencyHospitalLocator()
+    locator.generate_synthetic_city(size, seed=seed, **kwargs)
+    return locator
+
+
+def road_length(csr, u, v):
+    """Shortest open road between node ids u and v in a CSR snapshot"""
+    iu, iv = csr.index[u], csr.index[v]
+    return min((csr.weights[e] for e in range(csr.offsets[iu], csr.offsets[iu + 1])
+                if csr.targets[e] == iv), default=INFINITY)
+
+
+def path_length(csr, path):
+    return sum(road_length(csr, a, b) for a, b in zip(path, path[1:]))
+
+
+# Nearest-hospital table
+
+def test_hospital_table_matches_find_nearest_hospital():
+    locator = synthetic_city(1500, seed=7)
+    csr = locator.get_csr()
+    for origin in random.Random(0).sample(range(1500), 40):
+        expected = locator.find_nearest_hospital(origin=origin)
+        result = locator.lookup_nearest_hospital(origin)
+        assert result['nearest_hospital'] == expected['nearest_hospital']
+        assert result['distance'] == pytest.approx(expected['distance'])
+        assert result['path'][0] == origin
+        assert result['path'][-1] == result['nearest_hospital'][0]
+        assert path_length(csr, result['path']) == pytest.approx(result['distance'])
+
+
+def test_added_hospital_patches_table_like_a_rebuild():
+    locator = synthetic_city(1500, seed=7)
+    table = locator.get_nearest_hospital_table()
+    for node in (3, 777, 1499):
+        locator.add_hospital(node, f"Clinic {node}")
+        assert locator.get_nearest_hospital_table() is table
+
+        rebuilt = NearestHospitalTable(locator.get_csr(), locator.hospitals)
+        assert list(table.distance) == pytest.approx(list(rebuilt.distance))
+        assert list(table.owner) == list(rebuilt.owner)
+        assert locator.lookup_nearest_hospital(node)['distance'] == 0.0
+
+    locator.remove_hospital(777)
+    assert locator.lookup_nearest_hospital(777)['nearest_hospital'][0] != 777
+
+
+# Early-terminating and bidirectional search
+
+def test_stop_at_any_settles_only_nodes_up_to_the_nearest_hospital():
+    locator = synthetic_city(1500, seed=3)
+    hospital_nodes = [node for node, _ in locator.hospitals]
+    for origin in random.Random(1).sample(range(1500), 20):
+        full, _ = locator.dijkstra_algorithm(origin)
+        nearest = min(full[h] for h in hospital_nodes)
+        farthest = max(full[h] for h in hospital_nodes)
+
+        distances, _, visited = locator.dijkstra_search(origin, hospital_nodes, stop_at='any')
+        assert visited == len(distances) == sum(1 for d in full.values() if d <= nearest)
+        _, _, visited_all = locator.dijkstra_search(origin, hospital_nodes, stop_at='all')
+        assert visited_all == sum(1 for d in full.values() if d <= farthest)
+
+        expected = locator.find_nearest_hospital(origin=origin)
+        result = locator.find_nearest_hospital(all_distances=False, origin=origin)
+        assert result['nearest_hospital'] == expected['nearest_hospital']
+        assert result['distance'] == expected['distance']
+        assert result['path'] == expected['path']
+        assert result['visited_nodes'] == visited <= expected['visited_nodes'] == visited_all
+        assert set(result['all_hospital_distances']) <= set(expected['all_hospital_distances'])
+        assert result['nearest_hospital'][1] in result['all_hospital_distances']
+
+
+@pytest.mark.parametrize('layout', ['grid', 'planar'])
+def test_bidirectional_search_matches_dijkstra(layout):
+    locator = synthetic_city(1500, layout=layout)
+    csr = locator.get_csr()
+    rng = random.Random(0)
+    for source in rng.sample(range(1500), 10):
+        expected, _ = locator.dijkstra_algorithm(source)
+        for target in rng.sample(range(1500), 5):
+            distance, previous, visited = locator.bidirectional_search(source, target)
+            assert distance == pytest.approx(expected[target])
+            path = locator.get_shortest_path(previous, source, target)
+            assert path_length(csr, path) == pytest.approx(expected[target])
+            assert visited <= 2 * csr.num_nodes
+
+        hospital = locator.hospitals[0][0]
+        route = locator.route_to_hospital(hospital, origin=source)
+        assert route['distance'] == pytest.approx(expected[hospital])
+        assert route['path'][0] == source and route['path'][-1] == hospital
+
+
+# A* search
+
+@pytest.mark.parametrize('layout', ['grid', 'planar'])
+def test_a_star_matches_dijkstra(layout):
+    locator = synthetic_city(1500, layout=layout)
+    csr = locator.get_csr()
+    rng = random.Random(0)
+    for source in rng.sample(range(1500), 10):
+        expected, _ = locator.dijkstra_algorithm(source)
+        for target in rng.sample(range(1500), 5):
+            distances, previous, visited = locator.a_star_search(source, target)
+            assert distances[target] == pytest.approx(expected[target])
+            path = locator.get_shortest_path(previous, source, target)
+            assert path_length(csr, path) == pytest.approx(expected[target])
+            # The scaled straight line never overestimates the road distance
+            assert csr.heuristic_scale * csr.straight_line(source, target) <= expected[target] + 1e-9
+            assert visited <= sum(1 for d in expected.values() if d <= expected[target])
+
+
+def test_a_star_on_generated_city_graph():
+    random.seed(11)
+    locator = EmergencyHospitalLocator()
+    locator.generate_city_graph(4, 'complex')
+    for hospital, _ in locator.hospitals:
+        expected, _ = locator.dijkstra_algorithm(0)
+        route = locator.route_to_hospital(hospital, method='astar')
+        assert route['distance'] == pytest.approx(expected[hospital])
+        assert route['path'][0] == 0 and route['path'][-1] == hospital
+
+
+# Contraction hierarchy
+
+@pytest.mark.parametrize('layout', ['grid', 'planar'])
+def test_contraction_hierarchy_matches_dijkstra(layout):
+    locator = synthetic_city(1500, layout=layout)
+    csr = locator.get_csr()
+    rng = random.Random(0)
+    for source in rng.sample(range(1500), 10):
+        expected, _ = locator.dijkstra_algorithm(source)
+        for target in rng.sample(range(1500), 5):
+            distance, previous, _ = locator.ch_search(source, target)
+            assert distance == pytest.approx(expected[target])
+            path = locator.get_shortest_path(previous, source, target)
+            assert path_length(csr, path) == pytest.approx(expected[target])
+
+
+def test_contraction_hierarchy_hospital_distances_match_dijkstra():
+    locator = synthetic_city(2000, seed=5)
+    for origin in random.Random(1).sample(range(2000), 15):
+        expected = locator.find_nearest_hospital(origin=origin)
+        result = locator.find_nearest_hospital(origin=origin, method='ch')
+        assert result['distance'] == pytest.approx(expected['distance'])
+        assert result['all_hospital_distances'] == pytest.approx(expected['all_hospital_distances'])
+        assert path_length(locator.get_csr(), result['path']) == pytest.approx(result['distance'])
+
+
+def test_contraction_hierarchy_file_is_reloaded_for_the_same_graph(tmp_path, monkeypatch):
+    path = str(tmp_path / 'city.ch')
+    built = synthetic_city(1000, seed=2).prepare_contraction_hierarchy(path)
+
+    def no_build(*args, **kwargs):
+        raise AssertionError("the saved hierarchy should have been loaded")
+
+    locator = synthetic_city(1000, seed=2)
+    with monkeypatch.context() as patch:
+        patch.setattr(ContractionHierarchy, 'build', no_build)
+        loaded = locator.prepare_contraction_hierarchy(path)
+    assert loaded.fingerprint == built.fingerprint
+    for name in ('rank', 'up_offsets', 'up_targets', 'up_weights', 'up_middle'):
+        assert list(getattr(loaded, name)) == list(getattr(built, name))
+    expected, _ = locator.dijkstra_algorithm(0)
+    assert locator.ch_search(0, 999)[0] == pytest.approx(expected[999])
+
+    # A hierarchy for another graph is rebuilt and the file replaced
+    other = synthetic_city(1000, seed=3)
+    rebuilt = other.prepare_contraction_hierarchy(path)
+    assert rebuilt.fingerprint == other.get_csr().fingerprint() != built.fingerprint
+    assert ContractionHierarchy.load(path).fingerprint == rebuilt.fingerprint
+
+
+def test_contraction_hierarchy_load_rejects_other_files(tmp_path):
+    path = tmp_path / 'city.ch'
+    synthetic_city(300).prepare_contraction_hierarchy(str(path))
+    data = path.read_bytes()
+
+    for content in (b'', b'\x80\x04\x95 not a hierarchy', b'EHLGRAPH' + data[8:], data[:-8]):
+        path.write_bytes(content)
+        assert ContractionHierarchy.load(str(path)) is None
+
+
+def test_command_line_loads_contraction_hierarchy_at_start(tmp_path, capsys):
+    path = str(tmp_path / 'city.ch')
+    routing_core.main(['--synthetic', '800', '--seed', '4', '--ch-file', path, '--origin', '17'])
+    assert ContractionHierarchy.load(path) is not None
+    result = json.loads(capsys.readouterr().out)['result']
+
+    expected = synthetic_city(800, seed=4, hospital_density=0.001).find_nearest_hospital(origin=17)
+    assert result['distance'] == pytest.approx(expected['distance'])
+    assert result['path'] == expected['path']
+
+
+# Batch routing
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_batch_matches_single_queries(workers):
+    locator = synthetic_city(1200, seed=6)
+    origins = random.Random(2).sample(range(1200), 12)
+    batch = locator.find_nearest_hospitals_batch(origins, workers=workers)
+    assert batch['origins'] == origins
+    assert batch['hospitals'] == locator.hospitals
+
+    for origin, result, row in zip(origins, batch['results'], batch['distance_matrix']):
+        expected = locator.find_nearest_hospital(origin=origin)
+        assert result['nearest_hospital'] == expected['nearest_hospital']
+        assert result['distance'] == expected['distance']
+        assert result['path'] == expected['path']
+        assert result['all_hospital_distances'] == expected['all_hospital_distances']
+        assert row == [expected['all_hospital_distances'][name] for _, name in locator.hospitals]
+
+
+# Sharded routing
+
+def test_sharded_router_matches_single_graph_search():
+    locator = synthetic_city(3000, seed=3)
+    origins = random.Random(5).sample(range(3000), 25)
+    with locator.start_sharded_router(regions=4) as router:
+        directory = router.directory
+        assert sorted(os.listdir(directory)) == ['overlay.bin'] + [f'region-{r}.bin' for r in range(4)]
+        results = router.find_nearest_hospitals(origins)
+
+        # A failing request still drains every reply before raising
+        with pytest.raises(RuntimeError):
+            router._gather([(0, ('unknown',)), (1, ('search', origins[0]))])
+        assert router.find_nearest_hospital(origins[0]) == results[0]
+    assert not os.path.exists(directory)
+
+    csr = locator.get_csr()
+    for origin, result in zip(origins, results):
+        expected = locator.find_nearest_hospital(origin=origin)
+        assert result['nearest_hospital'] == expected['nearest_hospital']
+        assert result['distance'] == pytest.approx(expected['distance'])
+        assert result['path'][0] == origin and result['path'][-1] == expected['nearest_hospital'][0]
+        assert path_length(csr, result['path']) == pytest.approx(expected['distance'])
+
+
+def test_sharded_router_starts_from_a_shard_directory(tmp_path):
+    locator = synthetic_city(1500, seed=8)
+    graph_file = str(tmp_path / 'city.bin')
+    locator.save_graph_binary(graph_file)
+
+    # Partition straight from the memory-mapped graph file
+    mapped = EmergencyHospitalLocator()
+    mapped.load_graph_binary(graph_file)
+    directory = str(tmp_path / 'shards')
+    routing_core.ShardedRouter.write_shards(mapped.get_csr(), mapped.hospitals, directory, regions=3)
+
+    with routing_core.ShardedRouter(directory) as router:
+        assert router.hospitals == locator.hospitals
+        with pytest.raises(KeyError):
+            router.region_of(10 ** 6)
+        for origin in (0, 777, 1499):
+            result = router.find_nearest_hospital(origin)
+            expected = locator.find_nearest_hospital(origin=origin)
+            assert result['nearest_hospital'] == expected['nearest_hospital']
+            assert result['distance'] == pytest.approx(expected['distance'])
+    assert os.path.exists(os.path.join(directory, 'overlay.bin'))
+
+
+# Incremental shortest-path tree repair
+
+@pytest.mark.parametrize('build_networkx', [False, True])
+def test_repaired_tree_matches_fresh_recompute(build_networkx):
+    locator = synthetic_city(1500, seed=2, build_networkx=build_networkx)
+    root = locator.person_location[0]
+    locator.compute_shortest_path_tree()
+    rng = random.Random(5)
+    closed = []
+
+    for _ in range(40):
+        csr = locator.get_csr()
+        u = rng.randrange(csr.num_nodes)
+        neighbors = [csr.node_ids[csr.targets[e]] for e in range(csr.offsets[u], csr.offsets[u + 1])
+                     if csr.weights[e] != INFINITY]
+        action = rng.random()
+        if action < 0.3 and neighbors:
+            v = rng.choice(neighbors)
+            locator.close_road(u, v)
+            closed.append((u, v))
+        elif action < 0.6 and neighbors:
+            v = rng.choice(neighbors)
+            locator.set_travel_time(u, v, road_length(csr, u, v) * rng.choice([0.3, 3.0]))
+        elif action < 0.8 and closed:
+            locator.reopen_road(*closed.pop())
+        else:
+            v = rng.randrange(csr.num_nodes)
+            if v != u:
+                locator.set_travel_time(u, v, rng.uniform(0.1, 2.0))
+
+        csr = locator.get_csr()
+        if build_networkx:
+            # The patched snapshot must still describe the networkx graph
+            csr = CSRGraph.from_networkx(locator.graph)
+        dist, _, _ = csr.dijkstra(csr.index[root])
+        for node, distance in locator.distances.items():
+            assert distance == pytest.approx(dist[csr.index[node]])
+        for node, parent in locator.shortest_paths.items():
+            if parent is not None:
+                assert locator.distances[parent] + road_length(csr, parent, node) == \
+                    pytest.approx(locator.distances[node])
+
+
+def test_road_updates_without_networkx():
+    locator = synthetic_city(400)
+    with pytest.raises(KeyError):
+        locator.close_road(0, 399)
+    with pytest.raises(ValueError):
+        locator.set_travel_time(0, 10 ** 9, 1.0)
+    with pytest.raises(ValueError):
+        locator.graph
+
+
+# Route cache
+
+def test_route_cache_hits_misses_and_version_bumps():
+    locator = synthetic_city(900, seed=4)
+    a, b = 10, 500
+    first = locator.find_nearest_hospital(origin=a)
+    assert locator.find_nearest_hospital(origin=a) is first
+    assert locator.route_cache_stats()['hits'] == 1
+    assert locator.route_cache_stats()['misses'] == 1
+
+    # Any road or hospital change bumps the graph version, so nothing stale is served
+    version = locator.graph_version
+    u, v = first['path'][:2]
+    locator.close_road(u, v)
+    assert locator.graph_version > version
+    rerouted = locator.find_nearest_hospital(origin=a)
+    assert rerouted is not first
+    assert rerouted['distance'] >= first['distance']
+    assert locator.route_cache_stats()['misses'] == 2
+
+    version = locator.graph_version
+    locator.add_hospital(b, "Field Hospital")
+    assert locator.graph_version > version
+    assert locator.find_nearest_hospital(origin=b)['distance'] == 0.0
+    assert locator.route_cache_stats()['misses'] == 3
+
+
+def test_route_cache_hit_restores_the_last_query_tree():
+    locator = synthetic_city(900, seed=4)
+    locator.find_nearest_hospital(origin=10)
+    tree_a = dict(locator.distances)
+    locator.find_nearest_hospital(origin=500)
+    tree_b = dict(locator.distances)
+
+    result = locator.find_nearest_hospital(origin=10)
+    assert locator.route_cache_stats()['hits'] == 1
+    assert locator.distances == tree_a != tree_b
+    assert locator.get_shortest_path(locator.shortest_paths, 10, result['nearest_hospital'][0]) == \
+        result['path']
+
+
+def test_route_cache_evicts_least_recently_used_within_max_bytes():
+    locator = synthetic_city(900, seed=4)
+    locator.find_nearest_hospital(origin=0)
+    entry_bytes = locator.route_cache_stats()['bytes']
+    locator.route_cache.clear()
+    locator.route_cache.max_bytes = int(entry_bytes * 3.5)
+
+    for origin in range(0, 40, 8):
+        locator.find_nearest_hospital(origin=origin)
+        locator.find_nearest_hospital(origin=0)    # keep origin 0 recently used
+        stats = locator.route_cache_stats()
+        assert stats['bytes'] <= stats['max_bytes']
+
+    stats = locator.route_cache_stats()
+    assert stats['evictions'] > 0
+    assert stats['entries'] < 5
+    hits = stats['hits']
+    locator.find_nearest_hospital(origin=0)
+    assert locator.route_cache_stats()['hits'] == hits + 1
+    locator.find_nearest_hospital(origin=8)
+    assert locator.route_cache_stats()['hits'] == hits + 1
+
+
+# Streaming road network loader
+
+def write_lines(path, lines):
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+
+# Map labels use emoji that headless fonts often lack; rendering still works
+@pytest.mark.filterwarnings('ignore:Glyph .* missing from font')
+def test_edges_and_hospitals_only_network_renders(tmp_path):
+    edges = write_lines(tmp_path / 'edges.csv', ['source,target,weight', '1,2,3.0', '2,3,1.5',
+                                                 '3,4,2.0', '1,4,9.0'])
+    hospitals = write_lines(tmp_path / 'hospitals.csv', ['id,name', '4,North Clinic'])
+    locator = EmergencyHospitalLocator()
+    locator.load_road_network(edges, hospitals)
+
+    assert locator.person_location == (1, 'Your Location')
+    assert locator.graph.nodes[1]['type'] == 'person'
+    assert locator.graph.nodes[2] == {'name': '2', 'type': 'location'}
+    assert locator.graph.nodes[4] == {'name': 'North Clinic', 'type': 'hospital'}
+
+    result = locator.find_nearest_hospital()
+    assert result['path'] == [1, 2, 3, 4] and result['distance'] == pytest.approx(6.5)
+    assert [locator.graph.nodes[node]['name'] for node in result['path']] == \
+        ['Your Location', '2', '3', 'North Clinic']
+    locator.visualize_graph(result['path'])
+    locator.visualize_viewport(result['path'], hops=1)
+
+
+def test_loader_column_order_delimiters_and_chunks(tmp_path):
+    tab_separated = write_lines(tmp_path / 'roads.tsv', ['length\tv\tu', '2.5\tb\ta', '4.0\tc\tb',
+                                                         '1.0\ta\tc'])
+    locator = EmergencyHospitalLocator()
+    locator.load_road_network(tab_separated, build_networkx=False)
+    csr = locator.get_csr()
+    assert list(csr.node_ids) == ['a', 'b', 'c']
+    assert road_length(csr, 'a', 'b') == 2.5 and road_length(csr, 'b', 'c') == 4.0
+    assert road_length(csr, 'c', 'a') == 1.0
+
+    # No header, whitespace separated, comments, no weight column: unit roads
+    plain = write_lines(tmp_path / 'roads.txt', ['% edge list', '# from to', '10 11', '',
+                                                 '11  12', '12 13'])
+    locator.load_road_network(plain, build_networkx=False)
+    csr = locator.get_csr()
+    assert list(csr.node_ids) == [10, 11, 12, 13]
+    assert path_length(csr, [10, 11, 12, 13]) == 3.0
+
+    rows = ['u,v,weight'] + [f'{i},{i + 1},{1 + i % 3}' for i in range(50)] + ['7,19,2.5']
+    edges = write_lines(tmp_path / 'roads.csv', rows)
+    whole, chunked = EmergencyHospitalLocator(), EmergencyHospitalLocator()
+    whole.load_road_network(edges, build_networkx=False)
+    chunked.load_road_network(edges, chunk_size=3, build_networkx=False)
+    for name in ('offsets', 'targets', 'weights'):
+        assert list(getattr(chunked.get_csr(), name)) == list(getattr(whole.get_csr(), name))
+
+
+def test_loader_counts_skipped_edges(tmp_path):
+    edges = write_lines(tmp_path / 'edges.csv', ['source,target,weight', '1,2,3.0', '2,1,4.0',
+                                                 '2,2,1.0', '2,3,1.0', '1,2,5.0'])
+    nodes = write_lines(tmp_path / 'nodes.csv', ['id,name,x,y', '1,Docks,0,0', '2,Mill,1,0',
+                                                 '3,Bridge,2,0'])
+    locator = EmergencyHospitalLocator()
+    stats = locator.load_road_network(edges, nodes_path=nodes)
+    assert (stats['nodes'], stats['edges'], stats['skipped_edges']) == (3, 2, 3)
+    assert locator.graph[1][2]['weight'] == 3.0
+    assert locator.graph.nodes[2] == {'name': 'Mill', 'type': 'location', 'x': 1.0, 'y': 0.0}
+
+    # Without networkx only the self-loop is skipped; parallel roads stay
+    stats = locator.load_road_network(edges, nodes_path=nodes, build_networkx=False)
+    assert (stats['edges'], stats['skipped_edges']) == (4, 1)
+    assert road_length(locator.get_csr(), 1, 2) == 3.0
+
+
+# Binary graph format
+
+def test_binary_round_trip_preserves_networkx_graph(tmp_path):
+    random.seed(3)
+    locator = EmergencyHospitalLocator()
+    locator.generate_city_graph(5, 'complex')
+    hospital = locator.hospitals[0][0]
+    locator.set_hospital_status(hospital, capacity=0, wait_time=12.5)
+    locator.travel_time_profiles.add('night', [(0, 0.8), (600, 1.1)])
+    u, v = next(iter(locator.graph.edges()))
+    locator.set_road_profile(u, v, 'night')
+
+    path = str(tmp_path / 'city.bin')
+    locator.save_graph_binary(path)
+    loaded = EmergencyHospitalLocator()
+    loaded.load_graph_binary(path, build_networkx=True)
+
+    assert nx.utils.graphs_equal(locator.graph, loaded.graph)
+    assert loaded.hospitals == locator.hospitals
+    assert loaded.person_location == locator.person_location
+    assert loaded.hospital_status == {hospital: {'capacity': 0, 'wait_time': 12.5}}
+    assert loaded.travel_time_profiles.names == locator.travel_time_profiles.names
+
+
+def test_binary_round_trip_without_networkx(tmp_path):
+    locator = synthetic_city(900, seed=2, build_networkx=True)
+    locator.set_road_profile(0, 1, 'arterial')
+    locator.set_hospital_status(locator.hospitals[0][0], wait_time=30.0)
+    first, second = str(tmp_path / 'first.bin'), str(tmp_path / 'second.bin')
+    locator.save_graph_binary(first)
+
+    # Load, edit and save again with the CSR alone
+    csr_only = EmergencyHospitalLocator()
+    csr_only.load_graph_binary(first)
+    assert list(csr_only.get_edge_profiles()) == list(locator.get_edge_profiles())
+    assert csr_only.find_nearest_hospital(origin=5)['distance'] == \
+        locator.find_nearest_hospital(origin=5)['distance']
+    csr_only.set_road_profile(0, 1, 'residential')
+    locator.set_road_profile(0, 1, 'residential')
+    csr_only.save_graph_binary(second)
+
+    loaded = EmergencyHospitalLocator()
+    loaded.load_graph_binary(second, build_networkx=True)
+    assert nx.utils.graphs_equal(locator.graph, loaded.graph)
+    assert loaded.hospital_status == locator.hospital_status
+
+
+def test_binary_load_rejects_other_files(tmp_path):
+    path = tmp_path / 'city.bin'
+    path.write_bytes(b'NOTAGRAPH' + bytes(200))
+    with pytest.raises(ValueError):
+        EmergencyHospitalLocator().load_graph_binary(str(path))
+
+
+# Snapping caller coordinates
+
+def segment_distance(ax, ay, bx, by, x, y):
+    length_sq = (bx - ax) ** 2 + (by - ay) ** 2
+    t = 0.0 if length_sq == 0 else max(0.0, min(1.0, ((x - ax) * (bx - ax) + (y - ay) * (by - ay)) / length_sq))
+    return math.hypot(ax + t * (bx - ax) - x, ay + t * (by - ay) - y)
+
+
+def test_snapping_matches_brute_force():
+    locator = synthetic_city(2000, seed=4)
+    csr = locator.get_csr()
+    index = locator.get_spatial_index()
+    rng = random.Random(3)
+    width, height = max(csr.xs), max(csr.ys)
+    for _ in range(100):
+        x, y = rng.uniform(-2, width + 2), rng.uniform(-2, height + 2)
+
+        _, distance = index.nearest_node(x, y)
+        assert distance == pytest.approx(min(math.hypot(csr.xs[i] - x, csr.ys[i] - y)
+                                             for i in range(csr.num_nodes)))
+
+        hit = index.nearest_edge(x, y)
+        expected = min(segment_distance(csr.xs[u], csr.ys[u], csr.xs[csr.targets[e]], csr.ys[csr.targets[e]], x, y)
+                       for u in range(csr.num_nodes) for e in range(csr.offsets[u], csr.offsets[u + 1]))
+        assert hit[-1] == pytest.approx(expected)
+
+
+def test_edge_snapped_route_starts_from_both_road_ends():
+    locator = synthetic_city(2000, seed=4)
+    csr = locator.get_csr()
+    rng = random.Random(4)
+    for _ in range(20):
+        x, y = rng.uniform(0, max(csr.xs)), rng.uniform(0, max(csr.ys))
+        result = locator.find_nearest_hospital_from_coordinates(x, y, snap='edge')
+        u, v = result['snapped']['edge']
+        fraction, length = result['snapped']['fraction'], road_length(csr, u, v)
+        from_u, _ = locator.dijkstra_algorithm(u)
+        from_v, _ = locator.dijkstra_algorithm(v)
+        expected = min(min(fraction * length + from_u[h], (1 - fraction) * length + from_v[h])
+                       for h, _ in locator.hospitals)
+        assert result['distance'] == pytest.approx(expected)
+        assert result['path'][0] in (u, v)
+
+
+def test_spatial_index_handles_collinear_nodes():
+    n = 5000
+    xs = array('d', (float(i) for i in range(n)))
+    ys = array('d', [3.0]) * n
+    csr = CSRGraph.from_edge_arrays(range(n), array('q', range(n - 1)), array('q', range(1, n)),
+                                    array('d', [1.0]) * (n - 1), xs, ys)
+    index = SpatialIndex(csr)
+    assert index.cell_size > 1.0
+    assert index.nearest_node(2500.2, 40.0) == (2500, pytest.approx(math.hypot(0.2, 37.0)))
+    assert index.nearest_node(-1e5, 1e5)[0] == 0
+    assert index.nearest_edge(20.5, -7.0)[-1] == pytest.approx(10.0)
+
+
+# Load-aware k-nearest hospitals
+
+def test_k_nearest_hospitals_ranked_by_distance_and_wait():
+    locator = synthetic_city(2000, seed=8, hospital_density=0.01)
+    origin = 1000
+    expected, _ = locator.dijkstra_algorithm(origin)
+    by_distance = sorted(locator.hospitals, key=lambda h: expected[h[0]])
+
+    result = locator.find_k_nearest_hospitals(4, origin=origin)
+    assert [entry['hospital'] for entry in result['hospitals']] == by_distance[:4]
+    for entry in result['hospitals']:
+        assert entry['distance'] == pytest.approx(expected[entry['hospital'][0]])
+        assert path_length(locator.get_csr(), entry['path']) == pytest.approx(entry['distance'])
+
+    # Diverted hospitals drop out; waits push hospitals down the ranking
+    diverted, busy = by_distance[0][0], by_distance[1][0]
+    locator.set_hospital_status(diverted, capacity=0)
+    locator.set_hospital_status(busy, wait_time=600.0)
+    ranked = [entry['hospital'] for entry in
+              locator.find_k_nearest_hospitals(3, origin=origin, wait_weight=0.1)['hospitals']]
+    assert diverted not in [node for node, _ in ranked]
+    assert ranked == [h for h in by_distance if h[0] not in (diverted, busy)][:3]
+    first = locator.find_k_nearest_hospitals(1, origin=origin, include_diverted=True)['hospitals'][0]
+    assert first['hospital'][0] == diverted
+
+
+def test_k_nearest_hospitals_needs_k_of_at_least_one():
+    locator = synthetic_city(400)
+    with pytest.raises(ValueError):
+        locator.find_k_nearest_hospitals(0)
+    assert len(locator.find_k_nearest_hospitals(1)['hospitals']) == 1
+
+
+# Query metrics
+
+def test_search_counters_match_a_counting_heap(monkeypatch):
+    locator = synthetic_city(1500, seed=4)
+    csr = locator.get_csr()
+    hospital_indices = [csr.index[node] for node, _ in locator.hospitals]
+    calls = {'push': 0, 'pop': 0}
+    heappush, heappop = routing_core.heapq.heappush, routing_core.heapq.heappop
+
+    def counting_push(heap, item):
+        calls['push'] += 1
+        heappush(heap, item)
+
+    def counting_pop(heap):
+        calls['pop'] += 1
+        return heappop(heap)
+
+    monkeypatch.setattr(routing_core.heapq, 'heappush', counting_push)
+    monkeypatch.setattr(routing_core.heapq, 'heappop', counting_pop)
+    for origin in (0, 321, 1499):
+        for targets in (None, hospital_indices):
+            calls.update(push=0, pop=0)
+            stats = {}
+            _, _, order = csr.dijkstra(origin, targets=targets, stats=stats)
+            # One seeded source, then every improving relaxation is one push
+            assert stats['relaxations'] == calls['push']
+            assert stats['heap_pushes'] == calls['push'] + 1
+            assert stats['heap_pops'] == calls['pop']
+            assert stats['settled'] == len(order)
+            assert stats['edges_scanned'] == sum(csr.offsets[u + 1] - csr.offsets[u] for u in order)
+    monkeypatch.undo()
+
+    # The exporter's totals are the per-query counters summed
+    metrics = locator.enable_metrics()
+    for origin in (0, 321, 1499):
+        locator.dijkstra_algorithm(origin)
+    text = metrics.to_prometheus()
+    records = metrics.slowest_queries()
+    for counter in routing_core.QueryMetrics.COUNTERS:
+        total = sum(record[counter] for record in records)
+        assert f'ehl_{counter}_total{{query="dijkstra_algorithm"}} {total}\n' in text
+    assert 'ehl_query_settled_nodes_sum{query="dijkstra_algorithm"} 4500.0\n' in text
+    assert 'ehl_query_settled_nodes_count{query="dijkstra_algorithm"} 3\n' in text
+
+
+def test_prometheus_counters_are_not_rounded():
+    metrics = routing_core.QueryMetrics()
+    stats = dict.fromkeys(routing_core.QueryMetrics.COUNTERS, 5163500)
+    stats['phases'] = {'search': 0.123456789}
+    metrics.record('batch', 0.123456789, stats)
+    metrics.record('batch', 1.0, dict(stats, heap_pushes=1))
+
+    text = metrics.to_prometheus()
+    assert 'ehl_heap_pushes_total{query="batch"} 5163501\n' in text
+    assert 'ehl_heap_pops_total{query="batch"} 10327000\n' in text
+    assert 'ehl_query_settled_nodes_sum{query="batch"} 10327000.0\n' in text
+    assert 'ehl_query_seconds_sum{query="batch"} 1.123456789\n' in text
+    assert 'ehl_phase_seconds_total{query="batch",phase="search"} 0.246913578\n' in text
+    assert 'ehl_query_settled_nodes_bucket{query="batch",le="10000000"} 2\n' in text
+
+
+# Synthetic city generator
+
+@pytest.mark.parametrize('build_networkx', [False, True])
+def test_synthetic_caller_is_never_a_hospital(build_networkx):
+    locator = synthetic_city(100, seed=1, hospital_density=0.2, build_networkx=build_networkx)
+    person = locator.person_location[0]
+    hospital_nodes = [node for node, _ in locator.hospitals]
+    assert len(hospital_nodes) == len(set(hospital_nodes)) == 20
+    assert person not in hospital_nodes
+    if build_networkx:
+        types = nx.get_node_attributes(locator.graph, 'type')
+        assert [node for node in types if types[node] == 'hospital'] == hospital_nodes
+        assert types[person] == 'person'
+
+    everyone = synthetic_city(10, seed=1, hospital_density=1.0)
+    assert sorted(node for node, _ in everyone.hospitals) == [n for n in range(10)
+                                                             if n != everyone.person_location[0]]
+
+
+@pytest.mark.parametrize('size,seed,layout', [(2000, 2, 'grid'), (2000, 4, 'grid'), (2000, 6, 'grid'),
+                                              (2000, 10, 'grid'), (2000, 11, 'grid'),
+                                              (5000, 6, 'planar')])
+def test_synthetic_city_is_connected(size, seed, layout):
+    distances, _, _ = synthetic_city(size, seed=seed, layout=layout).get_csr().dijkstra(0)
+    assert INFINITY not in distances
+
+
+# Time-dependent travel times
+
+def test_pace_interpolates_and_wraps_at_midnight():
+    profiles = TravelTimeProfiles.default()
+    arterial, residential = profiles.index['arterial'], profiles.index['residential']
+    assert profiles.pace(profiles.index['free'], 555.0) == 1.0
+    assert profiles.pace(arterial, 480.0) == 2.2
+    assert profiles.pace(arterial, 420.0) == pytest.approx(1.6)
+    # After the last breakpoint the pace heads back to the minute-0 pace
+    assert profiles.pace(residential, 1290.0) == pytest.approx(1.45)
+    assert profiles.pace(arterial, 1440.0 + 420.0) == pytest.approx(1.6)
+    assert profiles.pace(residential, -150.0) == pytest.approx(1.45)
+
+    with pytest.raises(ValueError):
+        profiles.add('late', [(60, 1.0)])
+    with pytest.raises(ValueError):
+        profiles.add('free', [(0, 2.0)])
+
+
+@pytest.mark.parametrize('pace', [1.0, 1.5])
+def test_flat_profile_is_static_distance_times_pace(pace):
+    locator = synthetic_city(900, seed=9, build_networkx=True)
+    if pace != 1.0:
+        locator.travel_time_profiles.add('flat', [(0, pace)])
+        for u, v in locator.graph.edges():
+            locator.set_road_profile(u, v, 'flat')
+    origin = locator.person_location[0]
+    static, _ = locator.dijkstra_algorithm(origin)
+
+    for departure in (0.0, 475.0, 1430.0):
+        minutes, _, _ = locator.time_dependent_search(origin, departure)
+        assert minutes.keys() == static.keys()
+        for node, distance in static.items():
+            assert minutes[node] == pytest.approx(distance * pace)
+
+        result = locator.find_nearest_hospital_at(departure)
+        expected = locator.find_nearest_hospital()
+        assert result['nearest_hospital'] == expected['nearest_hospital']
+        assert result['distance'] == pytest.approx(expected['distance'] * pace)
+        hourly = locator.lookup_nearest_hospital_at(int(departure // 60))
+        assert hourly['distance'] == pytest.approx(result['distance'])
+
+
+@pytest.mark.parametrize('build_networkx', [False, True])
+def test_closed_and_reopened_road_keeps_its_profile(build_networkx):
+    locator = synthetic_city(400, seed=2, build_networkx=build_networkx)
+    origin = locator.person_location[0]
+    u, v = origin, origin + 1
+    locator.set_road_profile(u, v, 'arterial')
+    profiles = list(locator.get_edge_profiles())
+    rush_hour, _, _ = locator.time_dependent_search(origin, 480.0)
+
+    locator.close_road(u, v)
+    locator.reopen_road(u, v)
+    if build_networkx:
+        assert locator.graph[u][v]['profile'] == 'arterial'
+    assert list(locator.get_edge_profiles()) == profiles
+    assert locator.time_dependent_search(origin, 480.0)[0] == rush_hour
+
+
+# Command line
+
+def run_command_line(capsys, *argv):
+    routing_core.main([str(arg) for arg in argv])
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_command_line_batch_from_origins_file(tmp_path, capsys, workers):
+    origins = [5, 250, 799]
+    origins_file = write_lines(tmp_path / 'origins.txt', [str(origin) for origin in origins] + [''])
+    lines = run_command_line(capsys, '--synthetic', 800, '--seed', 4, '--origins-file', origins_file,
+                             '--workers', workers)
+    assert [line['origin'] for line in lines] == origins
+
+    locator = synthetic_city(800, seed=4, hospital_density=0.001)
+    for origin, line in zip(origins, lines):
+        expected = locator.find_nearest_hospital(origin=origin)
+        assert line['result']['nearest_hospital'] == list(expected['nearest_hospital'])
+        assert line['result']['distance'] == pytest.approx(expected['distance'])
+        assert line['result']['path'] == expected['path']
+
+
+def test_command_line_k_nearest_from_edge_list(tmp_path, capsys):
+    edges = write_lines(tmp_path / 'edges.csv', ['source,target,weight', '1,2,3.0', '2,3,1.5',
+                                                 '3,4,2.0', '1,4,9.0', '1,5,4.0'])
+    hospitals = write_lines(tmp_path / 'hospitals.csv', ['id,name', '4,North Clinic', '5,Harbour'])
+    [line] = run_command_line(capsys, '--edges', edges, '--hospitals', hospitals, '--k', 2)
+    assert line['origin'] == 1
+    ranked = line['result']['hospitals']
+    assert [hospital['hospital'] for hospital in ranked] == [[5, 'Harbour'], [4, 'North Clinic']]
+    assert ranked[1]['path'] == [1, 2, 3, 4]
+    assert [hospital['distance'] for hospital in ranked] == [4.0, 6.5]
+
+
+def test_command_line_runs_without_the_ui_packages():
+    # routing_core must not pull in streamlit or matplotlib just to route
+    script = ("import sys, routing_core; routing_core.main(['--synthetic', '200', '--origin', '3']); "
+              "assert not {'streamlit', 'matplotlib'} & set(sys.modules)")
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+    assert json.loads(output)['origin'] == 3
@@ -0,0 +1,135 @@
+"""
+Tests for the async HTTP routing service: coalescing and error responses
+
+Usage: python -m pytest tests
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from routing_core import EmergencyHospitalLocator  # noqa: E402
+from routing_service import RoutingService  # noqa: E402
+
+
+def make_service():
+    random.seed(42)
+    locator = EmergencyHospitalLocator(instrument=True)
+    locator.generate_city_graph(4, 'complex')
+    return RoutingService(locator)
+
+
+async def exchange(service, raw):
+    """Send raw bytes to a served RoutingService; returns (status code, JSON body)"""
+    server = await asyncio.start_server(service.handle_connection, '127.0.0.1', 0)
+    async with server:
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        writer.write(raw)
+        await writer.drain()
+        status_line = await reader.readline()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers['content-length']))
+        writer.close()
+    return int(status_line.split()[1]), json.loads(body)
+
+
+def post(payload):
+    body = json.dumps(payload).encode('utf-8')
+    return (b"POST /route HTTP/1.1\r\nConnection: close\r\n"
+            + f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body)
+
+
+def test_identical_requests_in_flight_share_one_search():
+    service = make_service()
+    locator = service.locator
+    search = locator.find_nearest_hospital
+    started, release = threading.Event(), threading.Event()
+
+    def slow_search(**kwargs):
+        started.set()
+        release.wait(5)
+        return search(**kwargs)
+
+    locator.find_nearest_hospital = slow_search
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        first = asyncio.ensure_future(service.route({'origin': 0}))
+        await loop.run_in_executor(None, started.wait, 5)
+        second = asyncio.ensure_future(service.route({'origin': 0}))
+        other = asyncio.ensure_future(service.route({'origin': 0, 'method': 'ch'}))
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(first, second, other)
+
+    first, second, other = asyncio.run(run())
+    assert first is second
+    assert other['distance'] == first['distance']
+    assert service.stats()['requests'] == 3
+    assert service.stats()['computations'] == 2
+    assert service.stats()['coalesced'] == 1
+    assert service.stats()['in_flight'] == 0
+
+
+def test_route_over_http():
+    service = make_service()
+    status, body = asyncio.run(exchange(service, post({'origin': 0})))
+    assert status == 200
+    assert body['distance'] == service.locator.find_nearest_hospital()['distance']
+
+    status, body = asyncio.run(exchange(service, post({'x': 4.5, 'y': 4.5, 'snap': 'edge'})))
+    assert status == 200 and body['snapped']['edge']
+
+
+def test_bad_requests_get_400():
+    service = make_service()
+    for payload in ({'x': 1.0}, {'x': 'east', 'y': 1.0}, {'x': 1.0, 'y': 1.0, 'snap': 'road'},
+                    {'origin': 0, 'method': 'fastest'}, [0]):
+        status, body = asyncio.run(exchange(service, post(payload)))
+        assert status == 400, payload
+        assert 'error' in body
+
+    status, _ = asyncio.run(exchange(service, b"POST /route HTTP/1.1\r\nContent-Length: 5\r\n\r\n{oops"))
+    assert status == 400
+    for raw in (b"NONSENSE\r\n\r\n", b"GET /health HTTP/1.1\r\nContent-Length: many\r\n\r\n",
+                b"GET /health HTTP/1.1\r\nno colon here\r\n\r\n"):
+        status, body = asyncio.run(exchange(service, raw))
+        assert status == 400, raw
+        assert body['error'].startswith("Malformed HTTP request")
+
+
+def test_unknown_targets_get_404():
+    service = make_service()
+    status, _ = asyncio.run(exchange(service, post({'origin': 999})))
+    assert status == 404
+    status, _ = asyncio.run(exchange(service, b"GET /nowhere HTTP/1.1\r\n\r\n"))
+    assert status == 404
+
+    # A caller cut off from every hospital
+    service.locator.graph.add_node(99, name='Island', type='location', x=0.0, y=0.0)
+    service.locator.invalidate_graph_caches()
+    status, body = asyncio.run(exchange(service, post({'origin': 99})))
+    assert status == 404
+    assert body['error'] == "No hospital reachable from this origin"
+
+
+def test_unexpected_errors_get_500():
+    service = make_service()
+
+    def broken(**kwargs):
+        raise RuntimeError("worker pool went away")
+
+    service.locator.find_nearest_hospital = broken
+    status, body = asyncio.run(exchange(service, post({'origin': 0})))
+    assert status == 500
+    assert 'worker pool went away' in body['error']